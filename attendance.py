@@ -0,0 +1,169 @@
+from datetime import datetime
+
+from storage import dialect
+
+# --- Biometric attendance ingestion ---
+# Gate devices post batches of punches (employee, time, optional in/out
+# direction) to /api/attendance/punches. Every punch is kept once in
+# AttendancePunches, keyed by employee, day, time and direction, so a
+# replayed batch inserts nothing. Punches are grouped by
+# (EmployeeID, AttendanceDate) in memory and processed a chunk of days at a
+# time, one short transaction per chunk:
+#
+#   1. insert the chunk's punches with one executemany, skipping known ones
+#   2. if any were new, re-pair each day from all of its stored punches:
+#      the first 'in' (or first punch) is the check-in, the last 'out' (or
+#      last later punch) the check-out
+#   3. upsert the days whose pairing changed into Attendance, again with
+#      one executemany
+#
+# Pairing from the stored punches makes the result independent of the
+# order batches arrive in. A day re-paired after new punches replaces a
+# manual edit of that day's times.
+
+DIRECTIONS = ('in', 'out')
+CHUNK_SIZE = 500
+MAX_BATCH = 20000
+
+
+def ensure_schema(conn):
+    if dialect(conn).table_exists(conn, 'AttendancePunches'):
+        return
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS AttendancePunches (
+            EmployeeID INTEGER NOT NULL,
+            PunchDate DATE NOT NULL,
+            PunchTime TIME NOT NULL,
+            Direction TEXT NOT NULL DEFAULT '',
+            DeviceID TEXT,
+            ReceivedAt TEXT NOT NULL,
+            PRIMARY KEY (EmployeeID, PunchDate, PunchTime, Direction)
+        )
+    ''')
+    # The upsert target. Fails if Attendance already holds two rows for one
+    # employee and day; those have to be merged by hand first.
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_attendance_employee_date ON Attendance(EmployeeID, AttendanceDate)')
+
+
+def parse_punch(punch):
+    """(EmployeeID, date, time, direction, device) from a posted punch; raises ValueError."""
+    if not isinstance(punch, dict):
+        raise ValueError('punch must be an object')
+    try:
+        employee_id = int(punch['employee_id'])
+        when = punch['time']
+        if isinstance(when, (int, float)) and not isinstance(when, bool):
+            when = datetime.fromtimestamp(when)
+        else:
+            when = datetime.fromisoformat(str(when))
+    except KeyError as e:
+        raise ValueError(f'missing {e.args[0]}') from None
+    except (TypeError, ValueError, OverflowError, OSError):
+        raise ValueError('employee_id must be an integer and time an ISO datetime or epoch seconds') from None
+    direction = (punch.get('direction') or '').lower()
+    if direction and direction not in DIRECTIONS:
+        raise ValueError("direction must be 'in', 'out' or omitted")
+    device = punch.get('device')
+    return employee_id, when.date().isoformat(), when.strftime('%H:%M:%S'), direction, None if device is None else str(device)[:64]
+
+
+def pair(punches):
+    """(check-in, check-out) of one day's ``(time, direction)`` punches; either may be None."""
+    punches = sorted(punches)
+    ins = [t for t, d in punches if d == 'in']
+    check_in = ins[0] if ins else next((t for t, d in punches if d != 'out'), None)
+    outs = [t for t, d in punches if d == 'out' and (check_in is None or t > check_in)]
+    if outs:
+        check_out = outs[-1]
+    else:
+        check_out = next((t for t, d in reversed(punches) if d == '' and check_in is not None and t > check_in), None)
+    return check_in, check_out
+
+
+def _chunks(days, size):
+    """Split {day key: punches} into lists of keys holding about ``size`` punches; a day is never split."""
+    chunk, count = [], 0
+    for key in sorted(days):
+        if chunk and count + len(days[key]) > size:
+            yield chunk
+            chunk, count = [], 0
+        chunk.append(key)
+        count += len(days[key])
+    if chunk:
+        yield chunk
+
+
+def _placeholders(values):
+    return ', '.join('?' for _ in values)
+
+
+def ingest(conn, punches, chunk_size=CHUNK_SIZE):
+    """Store parsed ``punches`` and update the Attendance days they touch. Commits per chunk.
+
+    Returns counts of punches received, new, duplicate (already stored) and
+    for unknown employees, and of Attendance days written.
+    """
+    ensure_schema(conn)
+    conn.commit()
+    days = {}
+    for employee_id, day, time, direction, device in punches:
+        days.setdefault((employee_id, day), {})[(time, direction)] = device
+    employees = sorted({e for e, _ in days})
+    known = set()
+    for i in range(0, len(employees), CHUNK_SIZE):
+        batch = employees[i:i + CHUNK_SIZE]
+        known.update(row[0] for row in conn.execute(f'SELECT EmployeeID FROM Employees WHERE EmployeeID IN ({_placeholders(batch)})', batch))
+    result = {'received': len(punches), 'new': 0, 'duplicate': 0, 'unknown': 0, 'days_updated': 0}
+    for key in [key for key in days if key[0] not in known]:
+        result['unknown'] += len(days.pop(key))
+
+    received_at = datetime.now().isoformat()
+    for keys in _chunks(days, chunk_size):
+        rows = [(employee_id, day, time, direction, device, received_at)
+                for employee_id, day in keys for (time, direction), device in days[(employee_id, day)].items()]
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT INTO AttendancePunches (EmployeeID, PunchDate, PunchTime, Direction, DeviceID, ReceivedAt)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (EmployeeID, PunchDate, PunchTime, Direction) DO NOTHING
+        ''', rows)
+        new = max(cursor.rowcount, 0)
+        result['new'] += new
+        result['duplicate'] += len(rows) - new
+        if new:
+            result['days_updated'] += _pair_days(conn, keys)
+        conn.commit()
+    return result
+
+
+def _pair_days(conn, keys):
+    """Re-pair the days ``keys`` from their stored punches and upsert the changed ones."""
+    wanted = set(keys)
+    employees = sorted({e for e, _ in keys})
+    dates = sorted({d for _, d in keys})
+    punches = {}
+    for row in conn.execute(f'''
+        SELECT EmployeeID, PunchDate, PunchTime, Direction FROM AttendancePunches
+        WHERE PunchDate IN ({_placeholders(dates)}) AND EmployeeID IN ({_placeholders(employees)})
+    ''', dates + employees):
+        key = (row[0], str(row[1]))
+        if key in wanted:
+            punches.setdefault(key, []).append((str(row[2]), row[3]))
+    current = {}
+    for row in conn.execute(f'''
+        SELECT EmployeeID, AttendanceDate, Status, CheckInTime, CheckOutTime FROM Attendance
+        WHERE AttendanceDate IN ({_placeholders(dates)}) AND EmployeeID IN ({_placeholders(employees)})
+    ''', dates + employees):
+        current[(row[0], str(row[1]))] = (row[2], *(None if t is None else str(t) for t in row[3:]))
+    updates = []
+    for key, day_punches in punches.items():
+        paired = ('Present', *pair(day_punches))
+        if current.get(key) != paired:
+            updates.append((*key, *paired))
+    conn.executemany('''
+        INSERT INTO Attendance (EmployeeID, AttendanceDate, Status, CheckInTime, CheckOutTime)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (EmployeeID, AttendanceDate) DO UPDATE SET
+            Status = excluded.Status, CheckInTime = excluded.CheckInTime, CheckOutTime = excluded.CheckOutTime
+    ''', updates)
+    return len(updates)
@@ -0,0 +1,188 @@
+from datetime import datetime, timedelta
+import gzip
+import json
+import os
+import re
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from db import get_db_connection
+
+# --- AuditLog retention ---
+# `flask archive-audit` moves AuditLog rows older than AUDIT_RETENTION_DAYS
+# into one archive per month under AUDIT_ARCHIVE_DIR:
+#
+#   audit-YYYY-MM.jsonl.gz   rows as JSON lines, sorted by entity, one gzip
+#                            member per (EntityType, EntityID)
+#   audit-YYYY-MM.index.json byte range of each entity's member, row count
+#                            and the archive's size
+#
+# so one entity's history is a seek and a small decompress, while the whole
+# month still reads as a single gzip stream. search() merges the live table
+# with the archives, newest first. Archives are written before their rows
+# are deleted; a run interrupted in between is repaired by the next one,
+# which merges by AuditID.
+
+COLUMNS = ('AuditID', 'EntityType', 'EntityID', 'Action', 'PerformedBy', 'ActionTime', 'Details')
+_MONTH_RE = re.compile(r'^audit-(\d{4}-\d{2})\.jsonl\.gz$')
+
+
+def archive_dir(app=None):
+    app = app or current_app
+    return app.config['AUDIT_ARCHIVE_DIR'] or os.path.join(app.instance_path, 'audit_archive')
+
+
+def _paths(directory, month):
+    base = os.path.join(directory, f'audit-{month}')
+    return f'{base}.jsonl.gz', f'{base}.index.json'
+
+
+def _entity_key(entity_type, entity_id):
+    return f"{entity_type or ''}:{'' if entity_id is None else entity_id}"
+
+
+def archived_months(directory):
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(m.group(1) for m in map(_MONTH_RE.match, names) if m)
+
+
+def _sort_key(row):
+    return (str(row['ActionTime'] or ''), row['AuditID'])
+
+
+def read_month(directory, month, entity_type=None, entity_id=None):
+    """Archived rows of ``month``; just one entity's when both keys are given."""
+    data_path, index_path = _paths(directory, month)
+    if entity_type is not None and entity_id is not None:
+        try:
+            with open(index_path) as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            index = None
+        # An index that does not match the archive (a rewrite in progress)
+        # is ignored in favour of a full scan.
+        if index is not None and index['size'] == os.path.getsize(data_path):
+            span = index['entities'].get(_entity_key(entity_type, entity_id))
+            if span is None:
+                return []
+            with open(data_path, 'rb') as f:
+                f.seek(span[0])
+                lines = gzip.decompress(f.read(span[1])).decode('utf-8').splitlines()
+            return [json.loads(line) for line in lines]
+    rows = []
+    with gzip.open(data_path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            row = json.loads(line)
+            if entity_type is not None and row['EntityType'] != entity_type:
+                continue
+            if entity_id is not None and row['EntityID'] != entity_id:
+                continue
+            rows.append(row)
+    return rows
+
+
+def write_month(directory, month, rows):
+    """Write ``rows`` (merged with any existing archive for ``month``) atomically."""
+    os.makedirs(directory, exist_ok=True)
+    data_path, index_path = _paths(directory, month)
+    merged = {}
+    if os.path.exists(data_path):
+        merged.update((row['AuditID'], row) for row in read_month(directory, month))
+    merged.update((row['AuditID'], row) for row in rows)
+
+    groups = {}
+    for row in sorted(merged.values(), key=_sort_key):
+        groups.setdefault(_entity_key(row['EntityType'], row['EntityID']), []).append(row)
+    entities = {}
+    tmp = f'{data_path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        for key in sorted(groups):
+            payload = ''.join(json.dumps(row, default=str) + '\n' for row in groups[key])
+            member = gzip.compress(payload.encode('utf-8'), compresslevel=9, mtime=0)
+            entities[key] = [f.tell(), len(member)]
+            f.write(member)
+        size = f.tell()
+    index_tmp = f'{index_path}.{os.getpid()}.tmp'
+    with open(index_tmp, 'w') as f:
+        json.dump({'month': month, 'rows': len(merged), 'size': size, 'entities': entities}, f)
+    os.replace(tmp, data_path)
+    os.replace(index_tmp, index_path)
+    return len(merged)
+
+
+def archive(conn, directory, retention_days, echo=print):
+    """Move AuditLog rows older than ``retention_days`` into monthly archives. Commits per month."""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_auditlog_time ON AuditLog(ActionTime)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_auditlog_entity ON AuditLog(EntityType, EntityID)')
+    conn.commit()
+    cutoff = (datetime.now() - timedelta(days=retention_days)).isoformat()
+    months = {}
+    for row in conn.execute(f"SELECT {', '.join(COLUMNS)} FROM AuditLog WHERE ActionTime < ? ORDER BY AuditID", (cutoff,)):
+        row = dict(zip(COLUMNS, row))
+        months.setdefault(str(row['ActionTime'])[:7], []).append(row)
+    moved = 0
+    for month in sorted(months):
+        rows = months[month]
+        total = write_month(directory, month, rows)
+        conn.executemany('DELETE FROM AuditLog WHERE AuditID = ?', [(row['AuditID'],) for row in rows])
+        conn.commit()
+        moved += len(rows)
+        echo(f'audit-{month}: {len(rows)} rows archived ({total} in archive)')
+    return moved
+
+
+def search(conn, directory, entity_type=None, entity_id=None, since=None, until=None, limit=100):
+    """Audit rows matching the filters from the live table and the archives, newest first.
+
+    ``since``/``until`` are ISO date or datetime strings (``until`` exclusive).
+    """
+    filters, params = [], []
+    for column, value in (('EntityType', entity_type), ('EntityID', entity_id)):
+        if value is not None:
+            filters.append(f'{column} = ?')
+            params.append(value)
+    if since:
+        filters.append('ActionTime >= ?')
+        params.append(since)
+    if until:
+        filters.append('ActionTime < ?')
+        params.append(until)
+    where = f"WHERE {' AND '.join(filters)}" if filters else ''
+    rows = [dict(zip(COLUMNS, row)) for row in conn.execute(
+        f"SELECT {', '.join(COLUMNS)} FROM AuditLog {where} ORDER BY ActionTime DESC, AuditID DESC LIMIT ?", params + [limit])]
+
+    # Archived rows are older than every live one, so months are read
+    # newest first only until the limit is met.
+    for month in reversed(archived_months(directory)):
+        if len(rows) >= limit:
+            break
+        if (since and month < since[:7]) or (until and month > until[:7]):
+            continue
+        archived = read_month(directory, month, entity_type, entity_id)
+        archived = [row for row in archived
+                    if (not since or str(row['ActionTime']) >= since) and (not until or str(row['ActionTime']) < until)]
+        rows.extend(sorted(archived, key=_sort_key, reverse=True))
+    return rows[:limit]
+
+
+@click.command('archive-audit')
+@click.option('--days', type=int, default=None, help='Keep this many days live (default AUDIT_RETENTION_DAYS).')
+@with_appcontext
+def archive_audit_command(days):
+    """Move old AuditLog rows into compressed monthly archives (e.g. from cron)."""
+    days = current_app.config['AUDIT_RETENTION_DAYS'] if days is None else days
+    conn = get_db_connection()
+    try:
+        moved = archive(conn, archive_dir(), days, click.echo)
+    finally:
+        conn.close()
+    click.echo(f'{moved} audit rows archived to {archive_dir()}')
+
+
+def init_app(app):
+    app.cli.add_command(archive_audit_command)
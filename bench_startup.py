@@ -0,0 +1,82 @@
+"""Startup-time benchmark.
+
+Measures, in fresh interpreters, how long it takes to import and build the
+app and to serve the first request, with a cold and a warm Jinja bytecode
+cache. Use --max-ms to fail (exit 1) when the median cold start regresses.
+
+    python bench_startup.py --runs 5 --max-ms 800
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+PROBE = r'''
+import json, os, sys, time
+t0 = time.perf_counter()
+sys.path.insert(0, os.environ['BENCH_ROOT'])
+from app import create_app
+app = create_app({'TESTING': True})
+t1 = time.perf_counter()
+client = app.test_client()
+with client.session_transaction() as s:
+    s.update(user_id=1, username='bench', employee_name='Bench', role='Administrator', employee_id=1)
+first = client.get(os.environ['BENCH_PATH'])
+t2 = time.perf_counter()
+print(json.dumps({'create_app_ms': (t1 - t0) * 1000, 'first_request_ms': (t2 - t1) * 1000,
+                  'status': first.status_code, 'modules': len(sys.modules)}))
+'''
+
+
+def run_once(env):
+    out = subprocess.run([sys.executable, '-c', PROBE], env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def summarize(label, samples):
+    create = statistics.median(s['create_app_ms'] for s in samples)
+    first = statistics.median(s['first_request_ms'] for s in samples)
+    print(f"{label:<22} create_app {create:8.1f} ms   first request {first:8.1f} ms   "
+          f"modules {samples[0]['modules']}   status {samples[0]['status']}")
+    return create + first
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--path', default='/dashboard', help='URL of the first request')
+    parser.add_argument('--max-ms', type=float, help='fail if median cold start + first request exceeds this')
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix='rmc-bench-')
+    try:
+        db = os.path.join(work, 'bench.db')
+        shutil.copy(os.path.join(ROOT, 'rmc_erp_system.db'), db)
+        cache_dir = os.path.join(work, 'jinja_cache')
+        env = dict(os.environ, BENCH_ROOT=ROOT, BENCH_PATH=args.path,
+                   RMC_DATABASE=db, RMC_JINJA_CACHE_DIR=cache_dir, PYTHONDONTWRITEBYTECODE='0')
+
+        cold = []
+        for _ in range(args.runs):
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            cold.append(run_once(env))
+        warm = [run_once(env) for _ in range(args.runs)]
+
+        cold_total = summarize('cold template cache', cold)
+        summarize('warm template cache', warm)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    if args.max_ms is not None and cold_total > args.max_ms:
+        print(f'FAIL: cold start {cold_total:.1f} ms exceeds {args.max_ms:.1f} ms')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
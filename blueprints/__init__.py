@@ -0,0 +1,21 @@
+# Blueprints are registered by create_app() from the import strings in
+# BLUEPRINTS; config['ENABLED_BLUEPRINTS'] can narrow the set so a worker
+# pool (e.g. API-only) never imports the views it doesn't serve.
+BLUEPRINTS = {
+    'main': 'blueprints.main:bp',
+    'erp': 'blueprints.erp:bp',
+    'jobkart': 'blueprints.jobkart:bp',
+    'integration': 'blueprints.integration:bp',
+    'api': 'blueprints.api:bp',
+}
+
+# Engines whose init_app (CLI commands, settings) only the named blueprints
+# need; create_app() imports and initialises each one once, and only when
+# one of its blueprints is enabled. Storage, partitions, HTTP caching and
+# reporting serve every page and are always initialised.
+ENGINES = {
+    'erp': ('fleet', 'telemetry'),
+    'jobkart': ('geocoding',),
+    'integration': ('outbox',),
+    'api': ('audit_archive', 'geocoding', 'outbox', 'telemetry'),
+}
@@ -0,0 +1,437 @@
+from flask import Blueprint, Response, current_app, request, flash, session, jsonify
+from datetime import date, datetime
+import hmac
+import json
+import time
+
+import attendance
+import audit_archive
+import http_cache
+import change_log
+import mobile_sync
+import outbox
+import partitions
+import query_cache
+import sales_cube
+import telemetry
+from auth import admin_required, login_required
+from db import assign_vehicle, get_db_connection, log_job_progress
+from reporting import get_report_connection
+
+bp = Blueprint('api', __name__)
+
+# --- JSON API Routes ---
+# NumPy-backed engines (mrp, qc_analytics, forecasting, trip_planner) are
+# imported inside the views that use them so a worker only loads them when
+# needed.
+@bp.route('/api/search')
+@login_required
+@http_cache.conditional('Orders', 'Customers', 'Inventory', 'Employees', 'Roles')
+def global_search():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'results': []})
+    
+    conn = get_db_connection()
+    like = conn.dialect.like
+    results = []
+    
+    try:
+        # Search in Orders
+        orders = conn.execute(f'''
+            SELECT o.OrderID as id, 'order' as type, 
+                   'Order #' || o.OrderID || ' - ' || c.CustomerName as title,
+                   'Quantity: ' || o.Quantity || ' | Status: ' || o.Status as description,
+                   '/erp/orders/' || o.OrderID as url
+            FROM Orders o 
+            JOIN Customers c ON o.CustomerID = c.CustomerID 
+            WHERE c.CustomerName {like} ? OR CAST(o.OrderID AS TEXT) {like} ?
+            LIMIT 5
+        ''', (f'%{query}%', f'%{query}%')).fetchall()
+        
+        for order in orders:
+            results.append(dict(order))
+        
+        # Search in Customers
+        customers = conn.execute(f'''
+            SELECT CustomerID as id, 'customer' as type,
+                   CustomerName as title,
+                   COALESCE(Address, '') as description,
+                   '/erp/crm' as url
+            FROM Customers 
+            WHERE CustomerName {like} ? OR Address {like} ?
+            LIMIT 5
+        ''', (f'%{query}%', f'%{query}%')).fetchall()
+        
+        for customer in customers:
+            results.append(dict(customer))
+        
+        # Search in Inventory
+        inventory = conn.execute(f'''
+            SELECT MaterialID as id, 'material' as type,
+                   MaterialName as title,
+                   'Stock: ' || CurrentStock || ' ' || Unit as description,
+                   '/erp/inventory' as url
+            FROM Inventory 
+            WHERE MaterialName {like} ?
+            LIMIT 5
+        ''', (f'%{query}%',)).fetchall()
+        
+        for item in inventory:
+            results.append(dict(item))
+        
+        # Search in Employees
+        employees = conn.execute(f'''
+            SELECT e.EmployeeID as id, 'employee' as type,
+                   e.Name as title,
+                   r.RoleName as description,
+                   '/erp/employees' as url
+            FROM Employees e 
+            LEFT JOIN Roles r ON e.RoleID = r.RoleID
+            WHERE e.Name {like} ?
+            LIMIT 5
+        ''', (f'%{query}%',)).fetchall()
+        
+        for employee in employees:
+            results.append(dict(employee))
+            
+    except Exception as e:
+        print(f"Search error: {e}")
+    finally:
+        conn.close()
+    
+    return jsonify({'results': results[:15]})  # Limit to 15 results
+
+@bp.route('/api/forecast')
+@login_required
+def api_forecast():
+    import forecasting
+    horizon = min(max(request.args.get('days', 14, type=int), 1), 90)
+    product_id = request.args.get('product_id', type=int)
+    plant_id = request.args.get('plant_id', type=int)
+    conn = get_report_connection()
+    result = forecasting.forecaster.for_series(conn, product_id, plant_id, horizon)
+    conn.close()
+    return jsonify(result)
+
+@bp.route('/api/mrp')
+@login_required
+def api_mrp():
+    import mrp
+    horizon = min(max(request.args.get('days', 90, type=int), 1), 365)
+    conn = get_report_connection()
+    projection = mrp.build_projection(conn, horizon)
+    conn.close()
+    return jsonify(projection)
+
+@bp.route('/api/qc/control_chart')
+@login_required
+def api_qc_control_chart():
+    import qc_analytics
+    test_type = request.args.get('test_type', '')
+    product_id = request.args.get('product_id', 0, type=int)
+    plant_id = request.args.get('plant_id', 0, type=int)
+    window = min(max(request.args.get('window', qc_analytics.ROLLING_WINDOW, type=int), 2), 100)
+    conn = get_db_connection()
+    qc_analytics.ensure_versioned(conn)
+    conn.close()
+    conn = get_report_connection()
+    analytics = qc_analytics.get_analytics(conn, current_app.config['DATABASE_URL'] or current_app.config['DATABASE'])
+    conn.close()
+    chart = analytics.chart(test_type, product_id, plant_id, window)
+    if chart is None:
+        return jsonify({'error': 'No QC results for this series'}), 404
+    return jsonify(chart)
+
+@bp.route('/api/analytics/cube')
+@login_required
+def api_sales_cube():
+    group_by = [d for d in request.args.get('group_by', 'month').split(',') if d]
+    filters = {}
+    for dim in sales_cube.DIMENSIONS:
+        values = request.args.getlist(dim)
+        if values:
+            filters[dim] = values
+    conn = get_db_connection()
+    sales_cube.ensure_schema(conn)
+    conn.commit()
+    conn.close()
+    conn = get_report_connection(tables=('SalesCube',))
+    try:
+        rows = sales_cube.query(conn, group_by, filters, request.args.get('month_from'), request.args.get('month_to'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        conn.close()
+    return jsonify({'group_by': group_by, 'rows': rows})
+
+@bp.route('/api/query_cache')
+@login_required
+@admin_required
+def api_query_cache_stats():
+    return jsonify(query_cache.cache.stats())
+
+@bp.route('/api/audit')
+@login_required
+@admin_required
+def api_audit_log():
+    limit = min(request.args.get('limit', 100, type=int), 1000)
+    conn = get_db_connection()
+    try:
+        rows = audit_archive.search(conn, audit_archive.archive_dir(),
+                                    entity_type=request.args.get('entity_type') or None,
+                                    entity_id=request.args.get('entity_id', type=int),
+                                    since=request.args.get('since') or None,
+                                    until=request.args.get('until') or None,
+                                    limit=limit)
+    finally:
+        conn.close()
+    return jsonify({'rows': rows})
+
+@bp.route('/api/integration/deliveries')
+@login_required
+@admin_required
+def api_integration_deliveries():
+    conn = get_db_connection()
+    try:
+        delivery_stats = outbox.stats(conn)
+        conn.commit()
+    finally:
+        conn.close()
+    return jsonify(delivery_stats)
+
+@bp.route('/api/history/<table>/<int:entity_id>')
+@login_required
+def api_entity_history(table, entity_id):
+    table = {name.lower(): name for name in change_log.TRACKED}.get(table.lower())
+    if table is None:
+        return jsonify({'error': 'Unknown entity type'}), 404
+    conn = get_db_connection()
+    try:
+        at = request.args.get('at')
+        if at:
+            try:
+                state = change_log.state_at(conn, table, entity_id, at)
+            except ValueError:
+                return jsonify({'error': 'at must be an ISO date or datetime'}), 400
+            return jsonify({'entity': table, 'id': entity_id, 'at': at, 'state': state})
+        return jsonify({'entity': table, 'id': entity_id, 'changes': change_log.timeline(conn, table, entity_id)})
+    finally:
+        conn.close()
+
+def _compact_json(payload):
+    # Compressed on the way out by http_cache.
+    return Response(json.dumps(payload, default=str, separators=(',', ':')), mimetype='application/json')
+
+@bp.route('/api/sync')
+@login_required
+def api_sync():
+    token = request.args.get('token') or None
+    if token is not None and not token.isdigit():
+        return jsonify({'error': 'Invalid sync token'}), 400
+    page_size = min(max(request.args.get('limit', current_app.config['SYNC_PAGE_SIZE'], type=int), 1), 5000)
+    conn = get_db_connection()
+    try:
+        payload = mobile_sync.pull(conn, session['employee_id'], token, page_size)
+        conn.commit()
+    finally:
+        conn.close()
+    return _compact_json(payload)
+
+@bp.route('/api/sync/progress', methods=['POST'])
+@login_required
+def api_sync_progress():
+    updates = (request.get_json(silent=True) or {}).get('updates')
+    if not isinstance(updates, list) or len(updates) > mobile_sync.MAX_UPLOAD_BATCH:
+        return jsonify({'error': f'Send a list of at most {mobile_sync.MAX_UPLOAD_BATCH} updates'}), 400
+    if not all(isinstance(u, dict) and u.get('key') and str(u.get('job_id', '')).isdigit() and u.get('status') for u in updates):
+        return jsonify({'error': 'Each update needs key, job_id and status'}), 400
+    conn = get_db_connection()
+    mobile_sync.ensure_schema(conn)
+    conn.commit()
+    conn.close()
+
+    # One transaction per partition the job cards live in (just one
+    # without PLANT_PARTITIONS).
+    groups = {}
+    for i, update in enumerate(updates):
+        groups.setdefault(partitions.plant_of('JobCards', update['job_id']), []).append(i)
+    results = [None] * len(updates)
+    for indexes in groups.values():
+        conn = partitions.connect_for_row('JobCards', updates[indexes[0]]['job_id'])
+        try:
+            mobile_sync.ensure_schema(conn)
+            scope = mobile_sync.employee_scope(conn, session['employee_id'])
+            for i in indexes:
+                results[i] = mobile_sync.apply_progress(conn, session['employee_id'], session['user_id'], updates[i], scope)
+            conn.commit()
+        finally:
+            conn.close()
+    return jsonify({'results': results})
+
+def _device_authorized(token_key):
+    """True if the request carries the bearer token configured as ``token_key``."""
+    token = current_app.config[token_key]
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    return bool(token and supplied and hmac.compare_digest(supplied, token))
+
+@bp.route('/api/telemetry', methods=['POST'])
+def api_telemetry_ingest():
+    # Devices authenticate with TELEMETRY_INGEST_TOKEN; people with their session.
+    if not _device_authorized('TELEMETRY_INGEST_TOKEN') and 'user_id' not in session:
+        return jsonify({'error': 'Authentication required'}), 401
+    points = (request.get_json(silent=True) or {}).get('points')
+    if not isinstance(points, list) or len(points) > 10000:
+        return jsonify({'error': 'Send a list of at most 10000 points'}), 400
+    now = time.time()
+    oldest = telemetry.retention_start(current_app.config['TELEMETRY_RAW_MONTHS'], now)
+    parsed = []
+    for i, point in enumerate(points):
+        try:
+            parsed.append(telemetry.parse_point(point, now, oldest))
+        except ValueError as e:
+            return jsonify({'error': f'points[{i}]: {e}'}), 400
+    app = current_app._get_current_object()
+    telemetry.start_flusher(app)
+    try:
+        due = telemetry.buffer.add(parsed)
+    except telemetry.BufferFull:
+        response = jsonify({'error': 'Telemetry buffer is full; retry later'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    if due:
+        # The points are buffered either way; a failed flush must not make
+        # the device send them again.
+        try:
+            telemetry.flush(app.extensions['storage'].connect)
+        except Exception:
+            app.logger.exception('Inline telemetry flush failed')
+    return jsonify({'accepted': len(parsed), 'buffered': len(telemetry.buffer)}), 202
+
+@bp.route('/api/telemetry/<asset>/<int:asset_id>')
+@login_required
+def api_telemetry_series(asset, asset_id):
+    if asset not in telemetry.ASSET_TYPES:
+        return jsonify({'error': 'Unknown asset type'}), 404
+    end = request.args.get('to', time.time(), type=float)
+    start = request.args.get('from', end - 24 * 3600, type=float)
+    conn = get_db_connection()
+    try:
+        metric = request.args.get('metric')
+        if request.args.get('raw') and metric:
+            points = telemetry.raw_points(conn, asset, asset_id, metric, start, end)
+            return jsonify({'asset': asset, 'id': asset_id, 'metric': metric, 'points': points})
+        step = min(max(request.args.get('step', 300, type=int), 60), 7 * 24 * 3600)
+        data = telemetry.series(conn, asset, asset_id, start, end, step, request.args.getlist('metric'))
+    finally:
+        conn.close()
+    return jsonify({'asset': asset, 'id': asset_id, 'from': start, 'to': end, 'step': step // 60 * 60, 'series': data})
+
+@bp.route('/api/attendance/punches', methods=['POST'])
+def api_attendance_punches():
+    # Gate devices authenticate with ATTENDANCE_INGEST_TOKEN; HR can post
+    # an exported batch from their session.
+    if not _device_authorized('ATTENDANCE_INGEST_TOKEN') and session.get('role') not in ('Administrator', 'Human Resources'):
+        return jsonify({'error': 'Authentication required'}), 401
+    punches = (request.get_json(silent=True) or {}).get('punches')
+    if not isinstance(punches, list) or len(punches) > attendance.MAX_BATCH:
+        return jsonify({'error': f'Send a list of at most {attendance.MAX_BATCH} punches'}), 400
+    parsed = []
+    for i, punch in enumerate(punches):
+        try:
+            parsed.append(attendance.parse_punch(punch))
+        except ValueError as e:
+            return jsonify({'error': f'punches[{i}]: {e}'}), 400
+    conn = get_db_connection()
+    try:
+        result = attendance.ingest(conn, parsed, current_app.config['ATTENDANCE_INGEST_CHUNK'])
+    finally:
+        conn.close()
+    return jsonify(result)
+
+@bp.route('/api/update_job_status', methods=['POST'])
+@login_required
+def update_job_status():
+    data = request.get_json()
+    job_id = data['job_id']
+    status = data['status']
+    notes = data.get('notes', '')
+    conn = partitions.connect_for_row('JobCards', job_id)
+    before = change_log.fetch(conn, 'JobCards', job_id)
+    conn.execute('UPDATE JobCards SET Status = ? WHERE JobCardID = ?', (status, job_id))
+    change_log.record(conn, 'JobCards', job_id, before, change_log.fetch(conn, 'JobCards', job_id), session['user_id'])
+    if before is not None:
+        outbox.publish(conn, 'JobStatusChanged', f"Job card #{job_id} is {status}", order_id=before['RelatedOrderID'], job_card_id=job_id,
+                       data={'JobCardID': job_id, 'Status': status, 'Notes': notes})
+    log_job_progress(conn, job_id, session['employee_id'], datetime.now(), status, notes)
+    conn.commit()
+    conn.close()
+    return jsonify({'success': True})
+
+@bp.route('/api/trips')
+@login_required
+def api_trips():
+    import trip_planner
+    try:
+        day = datetime.strptime(request.args['date'], '%Y-%m-%d').date() if request.args.get('date') else date.today()
+    except ValueError:
+        return jsonify({'error': 'date must be YYYY-MM-DD'}), 400
+    conn = get_db_connection()
+    try:
+        plan = trip_planner.plan_day(conn, day)
+    finally:
+        conn.close()
+    return jsonify(plan)
+
+@bp.route('/api/auto_create_jobs', methods=['POST'])
+@login_required
+def auto_create_jobs():
+    import trip_planner
+    conn = get_db_connection()
+    try:
+        orders_without_jobs = conn.execute("SELECT OrderID, Quantity, DeliverySite, ScheduledDate FROM Orders WHERE Status = 'Confirmed' AND OrderID NOT IN (SELECT RelatedOrderID FROM JobCards WHERE RelatedOrderID IS NOT NULL)").fetchall()
+        # Delivery windows and trucks come from the day's trip plan; orders
+        # it cannot place keep the default 08:00-17:00 window.
+        windows = {}
+        days = {}
+        for order in orders_without_jobs:
+            if order['ScheduledDate']:
+                days.setdefault(str(order['ScheduledDate'])[:10], []).append(order['OrderID'])
+        for day, order_ids in sorted(days.items()):
+            windows.update(trip_planner.order_windows(trip_planner.plan_day(conn, day, order_ids)))
+    finally:
+        conn.close()
+    created_count = 0
+    for order in orders_without_jobs:
+        description = f"Deliver {order['Quantity']} units to {order['DeliverySite']}"
+        if order['OrderID'] in windows:
+            scheduled_start, scheduled_end, vehicles, trips = windows[order['OrderID']]
+            description += f" in {trips} trip{'s' if trips != 1 else ''}"
+        else:
+            scheduled_start = f"{order['ScheduledDate']} 08:00:00"
+            scheduled_end = f"{order['ScheduledDate']} 17:00:00"
+            vehicles = []
+        conn = partitions.connect_for_order(order['OrderID'])
+        try:
+            cursor = conn.cursor()
+            cursor.execute("INSERT INTO JobCards (RelatedOrderID, JobType, Description, AssignedTo, Status, Priority, ScheduledStart, ScheduledEnd) VALUES (?, 'Delivery', ?, 5, 'Open', 'Medium', ?, ?)",
+                           (order['OrderID'], description, scheduled_start, scheduled_end))
+            job_id = cursor.lastrowid
+            after = change_log.fetch(conn, 'JobCards', job_id)
+            change_log.record(conn, 'JobCards', job_id, None, after, session['user_id'])
+            for vehicle_id in vehicles:
+                assign_vehicle(conn, job_id, vehicle_id, 'Delivery', session['user_id'])
+            outbox.publish(conn, 'JobCardCreated', 'Delivery job card created', order_id=order['OrderID'], job_card_id=job_id, data=dict(after))
+            conn.commit()
+        finally:
+            conn.close()
+        created_count += 1
+    return jsonify({'success': True, 'created_jobs': created_count})
+
+@bp.route('/api/sync_inventory', methods=['POST'])
+@login_required
+def sync_inventory():
+    conn = get_db_connection()
+    flash('Inventory sync feature is not yet implemented.', 'info')
+    conn.close()
+    return jsonify({'success': True, 'synced_jobs': 0})
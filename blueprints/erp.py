@@ -0,0 +1,1035 @@
+from flask import Blueprint, abort, current_app, render_template, request, redirect, send_file, url_for, session, flash
+from datetime import datetime, date
+import mimetypes
+import os
+import re
+
+from werkzeug.utils import secure_filename
+
+import change_log
+import document_store
+import fleet
+import http_cache
+import outbox
+import partitions
+import profiler
+import query_cache
+import replenishment
+import sales_cube
+import telemetry
+from auth import admin_required, hash_password, hr_required, login_required
+from db import get_db_connection, log_audit
+from reporting import get_report_connection
+from streaming import iter_rows, stream_page
+
+bp = Blueprint('erp', __name__)
+
+# NumPy-backed engines (mrp, qc_analytics, forecasting) are imported inside
+# the views that use them so a worker only loads them when needed.
+
+# --- ERP Routes ---
+@bp.route('/erp')
+@login_required 
+def erp_home():
+    return render_template('index.html')
+
+# --- Order Management Routes ---
+@bp.route('/erp/orders')
+@login_required
+@http_cache.conditional('Orders', 'Customers', 'Products')
+def erp_orders():
+    conn = get_db_connection()
+    orders = iter_rows(conn, 'SELECT o.*, c.CustomerName, p.ProductName FROM Orders o JOIN Customers c ON o.CustomerID = c.CustomerID JOIN Products p ON o.ProductID = p.ProductID ORDER BY o.OrderDate DESC')
+    return stream_page('erp/orders.html', conn, orders=orders)
+
+@bp.route('/erp/orders/new', methods=['GET', 'POST'])
+@login_required
+def erp_new_order():
+    conn = get_db_connection()
+    if request.method == 'POST':
+        customer_id = request.form['customer_id']
+        product_id = request.form['product_id'] 
+        quantity = request.form['quantity']
+        delivery_site = request.form['delivery_site']
+        scheduled_date = request.form['scheduled_date']
+        
+        sales_cube.ensure_schema(conn)
+        conn.commit()
+        conn.close()
+        conn = partitions.connect_for_site(delivery_site)
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            INSERT INTO Orders (CustomerID, ProductID, Quantity, OrderDate, DeliverySite, ScheduledDate, Status, CreatedBy)
+            VALUES (?, ?, ?, ?, ?, ?, 'Confirmed', ?)
+        ''', (customer_id, product_id, quantity, date.today(), delivery_site, scheduled_date, session['user_id']))
+        order_id = cursor.lastrowid
+        after = change_log.fetch(conn, 'Orders', order_id)
+        sales_cube.apply_order_change(conn, None, after)
+        change_log.record(conn, 'Orders', order_id, None, after, session['user_id'])
+        outbox.publish(conn, 'OrderCreated', f"Order created for quantity {quantity}", order_id=order_id, data=dict(after))
+        
+        log_audit(conn, 'Order', order_id, 'Create', session['user_id'], f"New order created for quantity {quantity}")
+        conn.commit()
+        conn.close()
+        flash('Order created successfully!', 'success')
+        return redirect(url_for('erp.erp_orders'))
+    
+    customers = conn.execute('SELECT * FROM Customers ORDER BY CustomerName').fetchall()
+    products = conn.execute('SELECT * FROM Products ORDER BY ProductName').fetchall()
+    conn.close()
+    return render_template('erp/new_order.html', customers=customers, products=products)
+
+@bp.route('/erp/orders/<int:order_id>')
+@login_required
+def erp_view_order(order_id):
+    conn = get_db_connection()
+    order_query = '''
+        SELECT o.*, c.CustomerName, c.Address, c.Phone, c.Email, p.ProductName, p.MixDesign
+        FROM Orders o
+        JOIN Customers c ON o.CustomerID = c.CustomerID
+        JOIN Products p ON o.ProductID = p.ProductID
+        WHERE o.OrderID = ?
+    '''
+    order = conn.execute(order_query, (order_id,)).fetchone()
+    conn.close()
+    if order is None:
+        flash('Order not found!', 'danger')
+        return redirect(url_for('erp.erp_orders'))
+    return render_template('erp/view_order.html', order=order)
+
+@bp.route('/erp/orders/edit/<int:order_id>', methods=['GET', 'POST'])
+@login_required
+def erp_edit_order(order_id):
+    conn = get_db_connection()
+    if request.method == 'POST':
+        customer_id = request.form['customer_id']
+        product_id = request.form['product_id']
+        quantity = request.form['quantity']
+        delivery_site = request.form['delivery_site']
+        scheduled_date = request.form['scheduled_date']
+        status = request.form['status']
+        
+        sales_cube.ensure_schema(conn)
+        conn.commit()
+        conn.close()
+        conn = partitions.connect_for_row('Orders', order_id)
+        before = conn.execute('SELECT * FROM Orders WHERE OrderID = ?', (order_id,)).fetchone()
+        conn.execute('UPDATE Orders SET CustomerID=?, ProductID=?, Quantity=?, DeliverySite=?, ScheduledDate=?, Status=? WHERE OrderID=?',
+                     (customer_id, product_id, quantity, delivery_site, scheduled_date, status, order_id))
+        after = change_log.fetch(conn, 'Orders', order_id)
+        sales_cube.apply_order_change(conn, before, after)
+        change_log.record(conn, 'Orders', order_id, before, after, session['user_id'])
+        if after is not None:
+            outbox.publish(conn, 'OrderUpdated', f"Order #{order_id} updated, status {status}", order_id=order_id, data=dict(after))
+        log_audit(conn, 'Order', order_id, 'Update', session['user_id'], f"Order #{order_id} updated.")
+        conn.commit()
+        conn.close()
+        flash('Order updated successfully!', 'success')
+        return redirect(url_for('erp.erp_orders'))
+        
+    order = conn.execute('SELECT * FROM Orders WHERE OrderID = ?', (order_id,)).fetchone()
+    customers = conn.execute('SELECT * FROM Customers ORDER BY CustomerName').fetchall()
+    products = conn.execute('SELECT * FROM Products ORDER BY ProductName').fetchall()
+    conn.close()
+    return render_template('erp/edit_order.html', order=order, customers=customers, products=products)
+
+@bp.route('/erp/orders/delete/<int:order_id>', methods=['POST'])
+@login_required
+def erp_delete_order(order_id):
+    conn = get_db_connection()
+    sales_cube.ensure_schema(conn)
+    conn.commit()
+    conn.close()
+    conn = partitions.connect_for_row('Orders', order_id)
+    before = conn.execute('SELECT * FROM Orders WHERE OrderID = ?', (order_id,)).fetchone()
+    conn.execute('DELETE FROM Orders WHERE OrderID = ?', (order_id,))
+    sales_cube.apply_order_change(conn, before, None)
+    change_log.record(conn, 'Orders', order_id, before, None, session['user_id'])
+    if before is not None:
+        outbox.publish(conn, 'OrderDeleted', f"Order #{order_id} deleted", data={'OrderID': order_id})
+    log_audit(conn, 'Order', order_id, 'Delete', session['user_id'], f"Order #{order_id} deleted.")
+    conn.commit()
+    conn.close()
+    flash('Order deleted successfully!', 'danger')
+    return redirect(url_for('erp.erp_orders'))
+
+# --- Inventory Management Routes ---
+@bp.route('/erp/inventory', methods=['GET', 'POST'])
+@login_required
+@http_cache.conditional('Inventory', 'Suppliers')
+def erp_inventory():
+    conn = get_db_connection()
+    if request.method == 'POST':
+        material_id = request.form.get('materialId')
+        name = request.form.get('materialName')
+        supplier_id = request.form.get('supplierId') or None
+        stock = request.form.get('currentStock')
+        unit = request.form.get('unit')
+        threshold = request.form.get('threshold')
+        if material_id:
+            before = change_log.fetch(conn, 'Inventory', material_id)
+            conn.execute('UPDATE Inventory SET MaterialName=?, SupplierID=?, CurrentStock=?, Unit=?, Threshold=?, LastUpdated=? WHERE MaterialID=?', (name, supplier_id, stock, unit, threshold, date.today(), material_id))
+            flash('Material updated!', 'success')
+        else:
+            before = None
+            material_id = conn.execute('INSERT INTO Inventory (MaterialName, SupplierID, CurrentStock, Unit, Threshold, LastUpdated) VALUES (?, ?, ?, ?, ?, ?)', (name, supplier_id, stock, unit, threshold, date.today())).lastrowid
+            flash('New material added!', 'success')
+        change_log.record(conn, 'Inventory', material_id, before, change_log.fetch(conn, 'Inventory', material_id), session['user_id'])
+        conn.commit()
+        conn.close()
+        return redirect(url_for('erp.erp_inventory'))
+    
+    inventory = query_cache.cache.fetchall(conn, "SELECT i.*, s.SupplierName, CASE WHEN i.CurrentStock <= i.Threshold THEN 'Low Stock' ELSE 'In Stock' END as StockStatus FROM Inventory i LEFT JOIN Suppliers s ON i.SupplierID = s.SupplierID ORDER BY i.MaterialName",
+                                           tables=('Inventory', 'Suppliers'))
+    suppliers = query_cache.cache.fetchall(conn, 'SELECT * FROM Suppliers ORDER BY SupplierName', tables=('Suppliers',))
+    conn.close()
+    return render_template('erp/inventory.html', inventory=inventory, suppliers=suppliers)
+
+@bp.route('/erp/mrp')
+@login_required
+def erp_mrp():
+    import mrp
+    horizon = min(max(request.args.get('days', 90, type=int), 1), 365)
+    conn = get_report_connection()
+    projection = mrp.build_projection(conn, horizon)
+    conn.close()
+    return render_template('erp/mrp.html', projection=projection)
+
+# --- Production Management Routes ---
+@bp.route('/erp/production', methods=['GET', 'POST'])
+@login_required
+def erp_production():
+    # Live rows: new batches redirect here and must show up straight away.
+    conn = get_db_connection()
+    batches = iter_rows(conn, 'SELECT pb.*, o.OrderID, c.CustomerName, p.ProductName, l.LocationName, e.Name as CreatedByName FROM ProductionBatch pb LEFT JOIN Orders o ON pb.OrderID = o.OrderID LEFT JOIN Customers c ON o.CustomerID = c.CustomerID LEFT JOIN Products p ON pb.ProductID = p.ProductID LEFT JOIN Locations l ON pb.PlantLocationID = l.LocationID LEFT JOIN Users u ON pb.CreatedBy = u.UserID LEFT JOIN Employees e ON u.EmployeeID = e.EmployeeID ORDER BY pb.BatchTime DESC')
+    return stream_page('erp/production.html', conn, batches=batches)
+
+@bp.route('/erp/production/new', methods=['GET', 'POST'])
+@login_required
+def erp_new_batch():
+    conn = get_db_connection()
+    if request.method == 'POST':
+        order_id = request.form.get('orderId')
+        product_id = request.form.get('productId')
+        quantity = request.form.get('quantity')
+        location_id = request.form.get('locationId')
+        status = request.form.get('status')
+        
+        sales_cube.ensure_schema(conn)
+        conn.commit()
+        conn.close()
+        conn = partitions.connect_for_order(order_id, location_id)
+        order = conn.execute('SELECT * FROM Orders WHERE OrderID = ?', (order_id,)).fetchone() if order_id else None
+        old_plant = sales_cube.order_plant(conn, order) if order is not None else None
+        conn.execute('INSERT INTO ProductionBatch (OrderID, ProductID, QuantityBatch, PlantLocationID, BatchTime, Status, CreatedBy) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                     (order_id, product_id, quantity, location_id, datetime.now(), status, session['user_id']))
+        if order is not None:
+            # The order's volume and revenue now count at the batch's plant.
+            sales_cube.move_order_plant(conn, order, old_plant)
+        conn.commit()
+        conn.close()
+        flash('New production batch created!', 'success')
+        return redirect(url_for('erp.erp_production'))
+    orders = conn.execute("SELECT * FROM Orders WHERE Status IN ('Confirmed', 'In Production')").fetchall()
+    products = conn.execute('SELECT * FROM Products').fetchall()
+    locations = conn.execute('SELECT * FROM Locations').fetchall()
+    conn.close()
+    return render_template('erp/new_batch.html', orders=orders, products=products, locations=locations)
+
+@bp.route('/erp/production/view/<int:batch_id>')
+@login_required
+def erp_view_batch(batch_id):
+    conn = get_db_connection()
+    query = '''
+        SELECT pb.*, o.OrderID, c.CustomerName, p.ProductName, l.LocationName, e.Name as CreatedByName 
+        FROM ProductionBatch pb 
+        LEFT JOIN Orders o ON pb.OrderID = o.OrderID 
+        LEFT JOIN Customers c ON o.CustomerID = c.CustomerID 
+        LEFT JOIN Products p ON pb.ProductID = p.ProductID 
+        LEFT JOIN Locations l ON pb.PlantLocationID = l.LocationID 
+        LEFT JOIN Users u ON pb.CreatedBy = u.UserID 
+        LEFT JOIN Employees e ON u.EmployeeID = e.EmployeeID 
+        WHERE pb.BatchID = ?
+    '''
+    batch = conn.execute(query, (batch_id,)).fetchone()
+    readings = telemetry.summary(conn, 'batch', batch_id)
+    conn.close()
+    if batch is None:
+        flash(f'Batch #{batch_id} not found.', 'danger')
+        return redirect(url_for('erp.erp_production'))
+    return render_template('erp/view_batch.html', batch=batch, readings=readings)
+
+@bp.route('/erp/production/qc/<int:batch_id>', methods=['GET', 'POST'])
+@login_required
+def erp_quality_control(batch_id):
+    conn = get_db_connection()
+    if request.method == 'POST':
+        test_type = request.form['test_type']
+        result = request.form['result']
+        remarks = request.form.get('remarks', '')
+        
+        conn.execute('''
+            INSERT INTO QualityControl (BatchID, TestType, TestDate, Result, TestedBy, Remarks)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (batch_id, test_type, datetime.now(), result, session['employee_id'], remarks))
+        conn.commit()
+        flash('New QC record added successfully!', 'success')
+        conn.close()
+        return redirect(url_for('erp.erp_quality_control', batch_id=batch_id))
+    batch = conn.execute('SELECT * FROM ProductionBatch WHERE BatchID = ?', (batch_id,)).fetchone()
+    qc_records = conn.execute('SELECT qc.*, e.Name as TestedBy FROM QualityControl qc JOIN Employees e ON qc.TestedBy = e.EmployeeID WHERE qc.BatchID = ? ORDER BY qc.TestDate DESC', (batch_id,)).fetchall()
+    conn.close()
+    if batch is None:
+        flash(f'Batch #{batch_id} not found.', 'danger')
+        return redirect(url_for('erp.erp_production'))
+    return render_template('erp/quality_control.html', batch=batch, qc_records=qc_records)
+
+@bp.route('/erp/production/qc_analytics')
+@login_required
+def erp_qc_analytics():
+    import qc_analytics
+    conn = get_db_connection()
+    qc_analytics.ensure_versioned(conn)
+    conn.close()
+    conn = get_report_connection()
+    analytics = qc_analytics.get_analytics(conn, current_app.config['DATABASE_URL'] or current_app.config['DATABASE'])
+    products = {row['ProductID']: row['ProductName'] for row in conn.execute('SELECT ProductID, ProductName FROM Products')}
+    locations = {row['LocationID']: row['LocationName'] for row in conn.execute('SELECT LocationID, LocationName FROM Locations')}
+    conn.close()
+    series = [{'test_type': t, 'product_id': p, 'plant_id': l,
+               'label': f"{t} - {products.get(p, 'Product #%s' % p)} @ {locations.get(l, 'Plant #%s' % l)}"}
+              for t, p, l in analytics.series_keys()]
+    return render_template('erp/qc_analytics.html', series=series)
+
+# --- Vehicle Management Routes ---
+@bp.route('/erp/vehicles', methods=['GET', 'POST'])
+@login_required
+def erp_vehicles():
+    conn = get_db_connection()
+    if request.method == 'POST':
+        vehicle_id = request.form.get('vehicleId')
+        name = request.form.get('vehicleName')
+        reg_no = request.form.get('registrationNo')
+        v_type = request.form.get('type')
+        status = request.form.get('status')
+        capacity = request.form.get('capacity')
+        if vehicle_id:
+            before = change_log.fetch(conn, 'Vehicles', vehicle_id)
+            conn.execute('UPDATE Vehicles SET VehicleName=?, RegistrationNo=?, Type=?, Status=?, Capacity=? WHERE VehicleID=?', (name, reg_no, v_type, status, capacity, vehicle_id))
+            flash('Vehicle updated!', 'success')
+        else:
+            before = None
+            vehicle_id = conn.execute('INSERT INTO Vehicles (VehicleName, RegistrationNo, Type, Status, Capacity) VALUES (?, ?, ?, ?, ?)', (name, reg_no, v_type, status, capacity)).lastrowid
+            flash('New vehicle added!', 'success')
+        change_log.record(conn, 'Vehicles', vehicle_id, before, change_log.fetch(conn, 'Vehicles', vehicle_id), session['user_id'])
+        conn.commit()
+        conn.close()
+        return redirect(url_for('erp.erp_vehicles'))
+    # Utilization comes from fleet's counters, which the background
+    # refresher (or cron) keeps up to date; the page only reads them.
+    fleet.start_refresher(current_app._get_current_object())
+    fleet.ensure_schema(conn)
+    refreshed_at = fleet.refreshed_at(conn)
+    utilization = 'u.Trips, u.Hours, u.Volume, u.TripsSinceService, u.HoursSinceService, u.VolumeSinceService, u.FirstUsed, u.LastUsed, u.LastService, u.CurrentJobID'
+    vehicles = query_cache.cache.fetchall(conn, f"SELECT v.VehicleID, v.VehicleName, v.RegistrationNo, v.Type, v.Status, v.Capacity, {utilization} FROM Vehicles v LEFT JOIN FleetUtilization u ON u.AssetType = 'Vehicle' AND u.AssetID = v.VehicleID ORDER BY v.VehicleName",
+                                          tables=('Vehicles', 'FleetUtilization'))
+    equipment = query_cache.cache.fetchall(conn, f"SELECT e.EquipmentID, e.EquipmentName, e.Description, e.Status, {utilization} FROM Equipment e LEFT JOIN FleetUtilization u ON u.AssetType = 'Equipment' AND u.AssetID = e.EquipmentID ORDER BY e.EquipmentName",
+                                           tables=('Equipment', 'FleetUtilization'))
+    maintenance = conn.execute('''
+        SELECT m.MaintID, m.AssetType, m.AssetID, m.MaintType, m.Description, m.MaintDate, m.Cost, COALESCE(v.VehicleName, e.EquipmentName) AS AssetName
+        FROM Maintenance m
+        LEFT JOIN Vehicles v ON m.AssetType = 'Vehicle' AND v.VehicleID = m.AssetID
+        LEFT JOIN Equipment e ON m.AssetType = 'Equipment' AND e.EquipmentID = m.AssetID
+        ORDER BY m.MaintDate DESC, m.MaintID DESC LIMIT 10
+    ''').fetchall()
+    config = fleet.settings()
+    forecasts = {('Vehicle', row['VehicleID']): fleet.forecast(row, config=config) for row in vehicles}
+    forecasts.update((('Equipment', row['EquipmentID']), fleet.forecast(row, config=config)) for row in equipment)
+    positions = telemetry.latest(conn, 'vehicle', ('lat', 'lon', 'speed'))
+    conn.close()
+    refreshed_age = max(int((datetime.now() - refreshed_at).total_seconds()), 0) if refreshed_at else None
+    return render_template('erp/vehicles.html', vehicles=vehicles, equipment=equipment, maintenance=maintenance, forecasts=forecasts,
+                           positions=positions, today=date.today().isoformat(), refreshed_at=refreshed_at, refreshed_age=refreshed_age)
+
+@bp.route('/erp/maintenance', methods=['POST'])
+@login_required
+def erp_record_maintenance():
+    asset_type = request.form.get('asset_type')
+    asset_id = request.form.get('asset_id', type=int)
+    if asset_type not in fleet.ASSET_TYPES or not asset_id:
+        flash('Choose a vehicle or piece of equipment.', 'danger')
+        return redirect(url_for('erp.erp_vehicles'))
+    maint_type = request.form.get('maint_type') or 'Service'
+    maint_date = request.form.get('maint_date') or date.today().isoformat()
+    conn = get_db_connection()
+    try:
+        maint_id = fleet.record_maintenance(conn, asset_type, asset_id, maint_type, request.form.get('description'), maint_date,
+                                            request.form.get('cost', type=float), session['employee_id'])
+        log_audit(conn, 'Maintenance', maint_id, 'Create', session['user_id'], f"{maint_type} recorded for {asset_type} #{asset_id} on {maint_date}.")
+        conn.commit()
+        flash('Maintenance recorded!', 'success')
+    except Exception as e:
+        flash(f'Error recording maintenance: {e}', 'danger')
+    finally:
+        conn.close()
+    return redirect(url_for('erp.erp_vehicles'))
+
+@bp.route('/erp/vehicles/delete/<int:vehicle_id>', methods=['POST'])
+@login_required
+def erp_delete_vehicle(vehicle_id):
+    conn = get_db_connection()
+    try:
+        before = change_log.fetch(conn, 'Vehicles', vehicle_id)
+        conn.execute('DELETE FROM Vehicles WHERE VehicleID = ?', (vehicle_id,))
+        change_log.record(conn, 'Vehicles', vehicle_id, before, None, session['user_id'])
+        log_audit(conn, 'Vehicle', vehicle_id, 'Delete', session['user_id'], f"Vehicle ID #{vehicle_id} deleted.")
+        conn.commit()
+        flash('Vehicle deleted successfully!', 'danger')
+    except Exception as e:
+        flash(f'Error deleting vehicle: {e}', 'danger')
+    finally:
+        conn.close()
+    return redirect(url_for('erp.erp_vehicles'))
+
+# --- Employee Management Routes ---
+@bp.route('/erp/employees', methods=['GET', 'POST'])
+@login_required
+def erp_employees():
+    conn = get_db_connection()
+    if request.method == 'POST':
+        employee_id = request.form.get('employeeId')
+        name = request.form.get('name')
+        role_id = request.form.get('roleId')
+        dept_id = request.form.get('departmentId')
+        phone = request.form.get('phone')
+        email = request.form.get('email')
+        status = request.form.get('status')
+        if employee_id:
+            before = change_log.fetch(conn, 'Employees', employee_id)
+            conn.execute('UPDATE Employees SET Name=?, RoleID=?, DepartmentID=?, Phone=?, Email=?, Status=? WHERE EmployeeID=?', (name, role_id, dept_id, phone, email, status, employee_id))
+            flash('Employee updated!', 'success')
+        else:
+            before = None
+            employee_id = conn.execute('INSERT INTO Employees (Name, RoleID, DepartmentID, Phone, Email, DateOfJoining, Status) VALUES (?, ?, ?, ?, ?, ?, ?)', (name, role_id, dept_id, phone, email, date.today(), status)).lastrowid
+            flash('New employee added!', 'success')
+        change_log.record(conn, 'Employees', employee_id, before, change_log.fetch(conn, 'Employees', employee_id), session['user_id'])
+        conn.commit()
+        conn.close()
+        return redirect(url_for('erp.erp_employees'))
+    employees = conn.execute('SELECT e.*, r.RoleName, d.DepartmentName FROM Employees e LEFT JOIN Roles r ON e.RoleID = r.RoleID LEFT JOIN Departments d ON e.DepartmentID = d.DepartmentID ORDER BY e.Name').fetchall()
+    roles = conn.execute('SELECT * FROM Roles').fetchall()
+    departments = conn.execute('SELECT * FROM Departments').fetchall()
+    conn.close()
+    return render_template('erp/employees.html', employees=employees, roles=roles, departments=departments)
+
+@bp.route('/erp/employees/delete/<int:employee_id>', methods=['POST'])
+@login_required
+def erp_delete_employee(employee_id):
+    conn = get_db_connection()
+    try:
+        before = change_log.fetch(conn, 'Employees', employee_id)
+        conn.execute('DELETE FROM Users WHERE EmployeeID = ?', (employee_id,))
+        conn.execute('DELETE FROM Employees WHERE EmployeeID = ?', (employee_id,))
+        change_log.record(conn, 'Employees', employee_id, before, None, session['user_id'])
+        log_audit(conn, 'Employee', employee_id, 'Delete', session['user_id'], f"Employee ID #{employee_id} deleted.")
+        conn.commit()
+        flash('Employee deleted successfully!', 'danger')
+    except Exception as e:
+        flash(f'Error deleting employee: {e}', 'danger')
+    finally:
+        conn.close()
+    return redirect(url_for('erp.erp_employees'))
+
+# --- Attendance Management Routes ---
+@bp.route('/erp/attendance', methods=['GET'])
+@login_required
+def erp_attendance():
+    conn = get_db_connection()
+    
+    employee_id_filter = request.args.get('employee_id')
+    date_filter = request.args.get('date', date.today().isoformat())
+    
+    today = date.today().isoformat()
+    
+    is_hr_or_admin = session.get('role') in ['Administrator', 'Human Resources']
+    
+    if is_hr_or_admin:
+        query = f'''
+            SELECT a.*, e.Name, 
+            CAST({conn.dialect.hours_between('a.CheckOutTime', 'a.CheckInTime')} AS REAL) as total_hours 
+            FROM Attendance a
+            JOIN Employees e ON a.EmployeeID = e.EmployeeID
+            WHERE a.AttendanceDate = ?
+        '''
+        params = [date_filter]
+        
+        if employee_id_filter:
+            query += ' AND a.EmployeeID = ?'
+            params.append(employee_id_filter)
+        
+        query += ' ORDER BY e.Name'
+        attendance_records = conn.execute(query, params).fetchall()
+        all_employees = conn.execute('SELECT EmployeeID, Name FROM Employees ORDER BY Name').fetchall()
+        
+        # Add a check for today's attendance, marking absentees
+        if not employee_id_filter and date_filter == today:
+            present_employees = [rec['EmployeeID'] for rec in attendance_records]
+            all_employees_today = conn.execute('SELECT EmployeeID, Name FROM Employees').fetchall()
+            for emp in all_employees_today:
+                if emp['EmployeeID'] not in present_employees:
+                    attendance_records.append({
+                        'AttendanceID': None,
+                        'EmployeeID': emp['EmployeeID'],
+                        'AttendanceDate': today,
+                        'Name': emp['Name'],
+                        'Status': 'Absent',
+                        'CheckInTime': None,
+                        'CheckOutTime': None,
+                        'total_hours': None
+                    })
+            attendance_records = sorted(attendance_records, key=lambda x: x['Name'])
+            
+        conn.close()
+        return render_template('erp/attendance.html', attendance_records=attendance_records, all_employees=all_employees, today=today)
+    else:
+        # Regular employee view
+        query = f'''
+            SELECT *, 
+            CAST({conn.dialect.hours_between('CheckOutTime', 'CheckInTime')} AS REAL) as total_hours 
+            FROM Attendance 
+            WHERE EmployeeID = ?
+            ORDER BY AttendanceDate DESC
+        '''
+        attendance_records = conn.execute(query, (session['employee_id'],)).fetchall()
+        conn.close()
+        return render_template('erp/attendance.html', attendance_records=attendance_records)
+
+@bp.route('/erp/attendance/edit/<int:attendance_id>', methods=['POST'])
+@login_required
+@hr_required
+def erp_edit_attendance(attendance_id):
+    conn = get_db_connection()
+    
+    # HR cannot edit their own attendance
+    record_owner = conn.execute('SELECT EmployeeID FROM Attendance WHERE AttendanceID = ?', (attendance_id,)).fetchone()
+    if session.get('role') == 'Human Resources' and record_owner and record_owner['EmployeeID'] == session.get('employee_id'):
+        flash('You do not have permission to edit your own attendance record.', 'danger')
+        conn.close()
+        return redirect(url_for('erp.erp_attendance'))
+
+    attendance_date = request.form['attendance_date']
+    check_in_time = request.form['check_in_time']
+    check_out_time = request.form['check_out_time']
+    
+    conn.execute('UPDATE Attendance SET CheckInTime = ?, CheckOutTime = ? WHERE AttendanceID = ?', 
+                 (check_in_time, check_out_time, attendance_id))
+    log_audit(conn, 'Attendance', attendance_id, 'Update', session['user_id'], f"Attendance record #{attendance_id} edited.")
+    conn.commit()
+    conn.close()
+    flash('Attendance record updated successfully!', 'success')
+    return redirect(url_for('erp.erp_attendance'))
+
+# --- User Management Routes ---
+@bp.route('/erp/users', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def erp_users():
+    conn = get_db_connection()
+    if request.method == 'POST':
+        employee_id = request.form['employee_id']
+        username = request.form['username']
+        password = request.form['password']
+        hashed_password = hash_password(password)
+        conn.execute('INSERT INTO Users (EmployeeID, Username, PasswordHash) VALUES (?, ?, ?)',
+                     (employee_id, username, hashed_password))
+        conn.commit()
+        flash(f'User account for {username} created successfully!', 'success')
+        conn.close()
+        return redirect(url_for('erp.erp_users'))
+    users = conn.execute('SELECT u.UserID, u.Username, e.Name, r.RoleName FROM Users u JOIN Employees e ON u.EmployeeID = e.EmployeeID JOIN Roles r ON e.RoleID = r.RoleID').fetchall()
+    available_employees = conn.execute('SELECT e.*, r.RoleName FROM Employees e JOIN Roles r ON e.RoleID = r.RoleID WHERE e.EmployeeID NOT IN (SELECT EmployeeID FROM Users WHERE EmployeeID IS NOT NULL)').fetchall()
+    conn.close()
+    return render_template('erp/users.html', users=users, available_employees=available_employees)
+
+@bp.route('/erp/users/delete/<int:user_id>', methods=['POST'])
+@login_required
+@admin_required
+def erp_delete_user(user_id):
+    conn = get_db_connection()
+    conn.execute('DELETE FROM Users WHERE UserID = ?', (user_id,))
+    conn.commit()
+    conn.close()
+    flash('User account deleted successfully.', 'danger')
+    return redirect(url_for('erp.erp_users'))
+
+# --- Finance Management Routes ---
+@bp.route('/erp/finance')
+@login_required
+def erp_finance():
+    conn = get_db_connection()
+    
+    # Create tables if they don't exist
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Invoices (
+            InvoiceID INTEGER PRIMARY KEY AUTOINCREMENT,
+            CustomerID INTEGER,
+            Amount DECIMAL(10,2),
+            DueDate DATE,
+            Status TEXT DEFAULT 'Pending',
+            Date DATETIME DEFAULT CURRENT_TIMESTAMP,
+            OrderID INTEGER,
+            FOREIGN KEY (CustomerID) REFERENCES Customers(CustomerID)
+        )
+    ''')
+    
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Expenses (
+            ExpenseID INTEGER PRIMARY KEY AUTOINCREMENT,
+            Category TEXT,
+            Amount DECIMAL(10,2),
+            Date DATETIME DEFAULT CURRENT_TIMESTAMP,
+            Notes TEXT
+        )
+    ''')
+    conn.commit()
+    conn.close()
+    
+    # Totals scan whole tables and come from the report snapshot; the lists
+    # below are read live so a new invoice or expense shows after redirect.
+    conn = get_report_connection(tables=('Invoices', 'Expenses'))
+    try:
+        total_income = conn.execute("SELECT COALESCE(SUM(Amount), 0) as total FROM Invoices WHERE Status = 'Paid'").fetchone()['total']
+        total_expenses = conn.execute('SELECT COALESCE(SUM(Amount), 0) as total FROM Expenses').fetchone()['total']
+    except:
+        total_income = 0
+        total_expenses = 0
+    conn.close()
+    
+    net_profit = total_income - total_expenses
+    conn = get_db_connection()
+    customers = conn.execute('SELECT CustomerID, CustomerName as Name FROM Customers').fetchall()
+    orders = conn.execute("SELECT OrderID, CustomerID, OrderDate FROM Orders WHERE Status != 'Cancelled' ORDER BY OrderID DESC LIMIT 200").fetchall()
+    
+    try:
+        invoices = conn.execute('SELECT i.*, c.CustomerName FROM Invoices i JOIN Customers c ON i.CustomerID = c.CustomerID ORDER BY i.Date DESC LIMIT 10').fetchall()
+        expenses = conn.execute('SELECT * FROM Expenses ORDER BY Date DESC LIMIT 10').fetchall()
+    except:
+        invoices = []
+        expenses = []
+    
+    conn.close()
+    return render_template('erp/finance.html', 
+        total_income=total_income, total_expenses=total_expenses, net_profit=net_profit,
+        annual_budget=100000, budget_spent=total_expenses, budget_remaining=100000-total_expenses,
+        customers=customers, orders=orders, invoices=invoices, expenses=expenses
+    )
+
+@bp.route('/erp/finance/add_invoice', methods=['POST'])
+@login_required
+def finance_add_invoice():
+    customer_id = request.form['customer_id']
+    amount = request.form['amount']
+    due_date = request.form['due_date']
+    order_id = request.form.get('order_id') or None
+    conn = get_db_connection()
+    try:
+        sales_cube.ensure_schema(conn)
+        order = conn.execute('SELECT * FROM Orders WHERE OrderID = ?', (order_id,)).fetchone() if order_id else None
+        if order_id and (order is None or str(order['CustomerID']) != str(customer_id)):
+            raise ValueError(f"order #{order_id} is not this customer's")
+        invoice_date = datetime.now()
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO Invoices (CustomerID, Amount, DueDate, Status, Date, OrderID) VALUES (?, ?, ?, 'Pending', ?, ?)", 
+                       (customer_id, amount, due_date, invoice_date, order_id))
+        sales_cube.apply_invoice(conn, customer_id, amount, invoice_date, order=order)
+        outbox.publish(conn, 'InvoiceCreated', f"Invoice #{cursor.lastrowid} for {amount}", order_id=order_id,
+                       data={'InvoiceID': cursor.lastrowid, 'CustomerID': customer_id, 'Amount': amount, 'DueDate': due_date, 'Date': invoice_date, 'OrderID': order_id})
+        conn.commit()
+        flash('Invoice created successfully!', 'success')
+    except Exception as e:
+        flash(f'Error creating invoice: {e}', 'danger')
+    finally:
+        conn.close()
+    return redirect(url_for('erp.erp_finance'))
+
+@bp.route('/erp/finance/add_expense', methods=['POST'])
+@login_required
+def finance_add_expense():
+    category = request.form['category']
+    amount = request.form['amount']
+    notes = request.form.get('notes', '')
+    conn = get_db_connection()
+    try:
+        conn.execute('INSERT INTO Expenses (Category, Amount, Date, Notes) VALUES (?, ?, ?, ?)', 
+                     (category, amount, datetime.now(), notes))
+        conn.commit()
+        flash('Expense added successfully!', 'success')
+    except Exception as e:
+        flash(f'Error adding expense: {e}', 'danger')
+    finally:
+        conn.close()
+    return redirect(url_for('erp.erp_finance'))
+
+# --- CRM Management Routes ---
+@bp.route('/erp/crm')
+@login_required
+def erp_crm():
+    conn = get_db_connection()
+    
+    # Create CRM tables if they don't exist
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS CRM_Leads (
+            LeadID INTEGER PRIMARY KEY AUTOINCREMENT,
+            Name TEXT NOT NULL,
+            Email TEXT,
+            Phone TEXT,
+            Source TEXT,
+            Status TEXT DEFAULT 'New',
+            CreatedDate DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS CRM_Opportunities (
+            OpportunityID INTEGER PRIMARY KEY AUTOINCREMENT,
+            CustomerID INTEGER,
+            CustomerName TEXT,
+            Value DECIMAL(10,2),
+            Stage TEXT,
+            CloseDate DATE,
+            CreatedDate DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (CustomerID) REFERENCES Customers(CustomerID)
+        )
+    ''')
+    
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS CRM_Tickets (
+            TicketID INTEGER PRIMARY KEY AUTOINCREMENT,
+            CustomerID INTEGER,
+            CustomerName TEXT,
+            Issue TEXT,
+            Status TEXT DEFAULT 'Open',
+            AssignedTo TEXT,
+            CreatedDate DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (CustomerID) REFERENCES Customers(CustomerID)
+        )
+    ''')
+    conn.commit()
+    conn.close()
+    
+    # Get data for display (live: the add_* forms redirect back here)
+    conn = get_db_connection()
+    customers = conn.execute('SELECT CustomerID, CustomerName as Name, Email, Phone, CustomerName as Company FROM Customers').fetchall()
+    leads = conn.execute('SELECT * FROM CRM_Leads ORDER BY CreatedDate DESC').fetchall()
+    opportunities = conn.execute('SELECT * FROM CRM_Opportunities ORDER BY CreatedDate DESC').fetchall()
+    tickets = conn.execute('SELECT * FROM CRM_Tickets ORDER BY CreatedDate DESC').fetchall()
+    
+    conn.close()
+    return render_template('erp/crm.html', customers=customers, leads=leads, opportunities=opportunities, tickets=tickets)
+
+@bp.route('/erp/crm/add_customer', methods=['POST'])
+@login_required
+def crm_add_customer():
+    name = request.form['name']
+    company = request.form['company']
+    email = request.form['email']
+    phone = request.form['phone']
+    
+    conn = get_db_connection()
+    try:
+        conn.execute('INSERT INTO Customers (CustomerName, Email, Phone, Address) VALUES (?, ?, ?, ?)', 
+                     (name, email, phone, company))
+        conn.commit()
+        flash('Customer added successfully!', 'success')
+    except Exception as e:
+        flash(f'Error adding customer: {e}', 'danger')
+    finally:
+        conn.close()
+    return redirect(url_for('erp.erp_crm'))
+
+@bp.route('/erp/crm/add_lead', methods=['POST'])
+@login_required
+def crm_add_lead():
+    name = request.form['name']
+    email = request.form['email']
+    source = request.form['source']
+    
+    conn = get_db_connection()
+    try:
+        conn.execute("INSERT INTO CRM_Leads (Name, Email, Source, Status) VALUES (?, ?, ?, 'New')", 
+                     (name, email, source))
+        conn.commit()
+        flash('Lead added successfully!', 'success')
+    except Exception as e:
+        flash(f'Error adding lead: {e}', 'danger')
+    finally:
+        conn.close()
+    return redirect(url_for('erp.erp_crm'))
+
+@bp.route('/erp/crm/add_ticket', methods=['POST'])
+@login_required
+def crm_add_ticket():
+    customer_id = request.form['customer_id']
+    issue = request.form['issue']
+    
+    conn = get_db_connection()
+    try:
+        # Get customer name
+        customer = conn.execute('SELECT CustomerName FROM Customers WHERE CustomerID = ?', (customer_id,)).fetchone()
+        customer_name = customer['CustomerName'] if customer else 'Unknown'
+        
+        conn.execute("INSERT INTO CRM_Tickets (CustomerID, CustomerName, Issue, Status, AssignedTo) VALUES (?, ?, ?, 'Open', ?)", 
+                     (customer_id, customer_name, issue, session.get('employee_name', 'System')))
+        conn.commit()
+        flash('Support ticket created successfully!', 'success')
+    except Exception as e:
+        flash(f'Error creating ticket: {e}', 'danger')
+    finally:
+        conn.close()
+    return redirect(url_for('erp.erp_crm'))
+
+@bp.route('/erp/crm/delete_customer/<int:customer_id>', methods=['POST'])
+@login_required
+def crm_delete_customer(customer_id):
+    conn = get_db_connection()
+    try:
+        conn.execute('DELETE FROM Customers WHERE CustomerID = ?', (customer_id,))
+        conn.commit()
+        flash('Customer deleted successfully!', 'danger')
+    except Exception as e:
+        flash(f'Error deleting customer: {e}', 'danger')
+    finally:
+        conn.close()
+    return redirect(url_for('erp.erp_crm'))
+
+# --- Compliance Management Routes ---
+@bp.route('/erp/compliance')
+@login_required
+def erp_compliance():
+    conn = get_db_connection()
+    # Create table if missing
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Compliance_Documents (
+            DocumentID INTEGER PRIMARY KEY AUTOINCREMENT,
+            Title TEXT NOT NULL,
+            Type TEXT NOT NULL,
+            IssueDate DATE,
+            ExpiryDate DATE,
+            FilePath TEXT,
+            UploadedBy INTEGER,
+            CreatedDate DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Query with status logic
+    documents = conn.execute(f'''
+        SELECT DocumentID, Title, Type, IssueDate, ExpiryDate, FilePath,
+        CASE
+            WHEN ExpiryDate < {conn.dialect.date_offset()} THEN 'Expired'
+            WHEN ExpiryDate <= {conn.dialect.date_offset(30)} THEN 'Pending'
+            ELSE 'Valid'
+        END AS Status
+        FROM Compliance_Documents
+        ORDER BY ExpiryDate ASC
+    ''').fetchall()
+    conn.close()
+    # Build summary
+    summary = {'total': len(documents)}
+    summary['valid'] = sum(1 for d in documents if d['Status']=='Valid')
+    summary['pending'] = sum(1 for d in documents if d['Status']=='Pending')
+    summary['expired'] = sum(1 for d in documents if d['Status']=='Expired')
+    return render_template('erp/compliance.html', documents=documents, summary=summary)
+
+@bp.route('/erp/compliance/add_document', methods=['POST'])
+@login_required
+def compliance_add_document():
+    title = request.form.get('title','').strip()
+    doc_type = request.form.get('type','').strip()
+    issue_date = request.form.get('issue_date') or None
+    expiry_date = request.form.get('expiry_date') or None
+    conn = get_db_connection()
+    digest = None
+    try:
+        # File upload: streamed into the document store, deduplicated by content
+        file_path = None
+        f = request.files.get('file')
+        if f and f.filename:
+            digest = document_store.store(conn, f.stream)
+            file_path = document_store.document_path(digest, secure_filename(f.filename) or 'document')
+        conn.execute('''
+            INSERT INTO Compliance_Documents
+            (Title, Type, IssueDate, ExpiryDate, FilePath, UploadedBy)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (title, doc_type, issue_date, expiry_date, file_path, session['user_id']))
+        conn.commit()
+        flash('Document added successfully!', 'success')
+    except Exception as e:
+        conn.rollback()
+        if digest:
+            document_store.release(conn, digest)
+        flash(f'Error adding document: {e}', 'danger')
+    finally:
+        conn.close()
+    return redirect(url_for('erp.erp_compliance'))
+
+@bp.route('/erp/documents/<digest>/<path:filename>')
+@login_required
+def document_download(digest, filename):
+    if not re.fullmatch(r'[0-9a-f]{64}', digest):
+        abort(404)
+    path = document_store.blob_path(digest)
+    if not os.path.exists(path):
+        abort(404)
+    # Content never changes under a hash: conditional and Range requests
+    # are answered from the file without reading it into memory.
+    response = send_file(path, mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+                         download_name=filename, conditional=True, etag=digest, max_age=365 * 24 * 3600)
+    response.cache_control.private = True
+    response.cache_control.public = False
+    response.cache_control.immutable = True
+    return response
+
+@bp.route('/erp/compliance/delete_document/<int:doc_id>', methods=['POST'])
+@login_required
+def compliance_delete_document(doc_id):
+    conn = get_db_connection()
+    # Remove file if exists
+    doc = conn.execute('SELECT FilePath FROM Compliance_Documents WHERE DocumentID=?', (doc_id,)).fetchone()
+    conn.execute('DELETE FROM Compliance_Documents WHERE DocumentID = ?', (doc_id,))
+    conn.commit()
+    stored = document_store.parse_path(doc['FilePath']) if doc else None
+    if stored:
+        document_store.release(conn, stored[0])
+    conn.close()
+    if doc and doc['FilePath'] and not stored:
+        path = os.path.join('static', doc['FilePath'])
+        if os.path.exists(path):
+            os.remove(path)
+    flash('Document deleted successfully!', 'danger')
+    return redirect(url_for('erp.erp_compliance'))
+
+# --- Procurement Management Routes ---
+@bp.route('/erp/procurement')
+@login_required
+def erp_procurement():
+    conn = get_db_connection()
+    
+    replenishment.ensure_schema(conn)
+    
+    purchase_orders = conn.execute(f'''
+        SELECT po.*, po.OrderID as POID, po.TotalAmount as Cost, s.SupplierName,
+               {conn.dialect.group_concat('i.MaterialName')} as Material, SUM(poi.Quantity) as Quantity
+        FROM Purchase_Orders po
+        LEFT JOIN Suppliers s ON po.SupplierID = s.SupplierID
+        LEFT JOIN Purchase_Order_Items poi ON poi.OrderID = po.OrderID
+        LEFT JOIN Inventory i ON poi.MaterialID = i.MaterialID
+        GROUP BY po.OrderID, s.SupplierName
+        ORDER BY po.OrderDate DESC, po.OrderID DESC
+    ''').fetchall()
+    suppliers = conn.execute('SELECT SupplierID, SupplierName as Name FROM Suppliers').fetchall()
+    conn.close()
+    return render_template('erp/procurement.html', purchase_orders=purchase_orders, suppliers=suppliers)
+
+@bp.route('/erp/procurement/replenish', methods=['POST'])
+@login_required
+def procurement_replenish():
+    conn = get_db_connection()
+    try:
+        replenishment.ensure_schema(conn)
+        created = replenishment.create_purchase_orders(conn, session['user_id'])
+        for po_id, supplier_id, items in created:
+            log_audit(conn, 'PurchaseOrder', po_id, 'Create', session['user_id'],
+                      f"Auto-replenishment PO for {len(items)} material(s): " + ', '.join(item['MaterialName'] for item in items))
+        conn.commit()
+        if created:
+            flash(f'Replenishment created {len(created)} purchase order(s) covering {sum(len(items) for _, _, items in created)} material(s).', 'success')
+        else:
+            flash('All materials are above threshold or already on order.', 'info')
+    except Exception as e:
+        conn.rollback()
+        flash(f'Error running replenishment: {e}', 'danger')
+    finally:
+        conn.close()
+    return redirect(url_for('erp.erp_procurement'))
+
+# --- Settings Management Routes ---
+@bp.route('/erp/settings')
+@login_required
+@admin_required
+def erp_settings():
+    conn = get_db_connection()
+    try:
+        triggers = profiler.triggers(conn)
+        conn.commit()
+    finally:
+        conn.close()
+    endpoints = sorted({rule.endpoint for rule in current_app.url_map.iter_rules()
+                        if 'GET' in rule.methods and rule.endpoint != 'static' and not rule.endpoint.startswith('erp.erp_profile')})
+    return render_template('erp/settings.html', profiler_triggers=triggers, profiles=profiler.list_profiles(),
+                           profiler_endpoints=endpoints, profiler_enabled=current_app.config['PROFILER_ENABLED'])
+
+@bp.route('/erp/settings/profiler', methods=['POST'])
+@login_required
+@admin_required
+def erp_profiler_arm():
+    endpoint = request.form.get('endpoint', '').strip()
+    try:
+        count = int(request.form.get('count', 1))
+        sample_rate = float(request.form.get('sample_percent', 100)) / 100
+        minutes = int(request.form.get('minutes', 60))
+    except ValueError:
+        count = 0
+    if endpoint != profiler.ALL_ENDPOINTS and endpoint not in current_app.view_functions:
+        flash(f'Unknown route: {endpoint}', 'danger')
+    elif not (1 <= count <= 100 and 0 < sample_rate <= 1 and minutes > 0):
+        flash('Profile between 1 and 100 requests, with a sample rate above 0% and a positive time limit.', 'danger')
+    else:
+        conn = get_db_connection()
+        try:
+            trigger_id = profiler.arm(conn, endpoint, count, sample_rate, minutes, session.get('username'))
+            log_audit(conn, 'ProfilerTrigger', trigger_id, 'Arm', session['user_id'], f'Profiling next {count} requests to {endpoint}')
+            conn.commit()
+        finally:
+            conn.close()
+        flash(f'Profiling the next {count} requests to {endpoint}.', 'success')
+    return redirect(url_for('erp.erp_settings') + '#profiler')
+
+@bp.route('/erp/settings/profiler/<int:trigger_id>/cancel', methods=['POST'])
+@login_required
+@admin_required
+def erp_profiler_cancel(trigger_id):
+    conn = get_db_connection()
+    try:
+        profiler.cancel(conn, trigger_id)
+        conn.commit()
+    finally:
+        conn.close()
+    flash('Profiling stopped.', 'info')
+    return redirect(url_for('erp.erp_settings') + '#profiler')
+
+@bp.route('/erp/settings/profiles/<profile_id>')
+@login_required
+@admin_required
+def erp_profile(profile_id):
+    loaded = profiler.load(profile_id)
+    if loaded is None:
+        abort(404)
+    summary, trace = loaded
+    by_statement = {}
+    for entry in trace:
+        total = by_statement.setdefault(entry['sql'], {'sql': entry['sql'], 'count': 0, 'execute_ms': 0.0, 'fetch_ms': 0.0, 'rows': 0})
+        total['count'] += entry['count']
+        for key in ('execute_ms', 'fetch_ms', 'rows'):
+            total[key] += entry[key]
+    top = sorted(by_statement.values(), key=lambda total: total['execute_ms'] + total['fetch_ms'], reverse=True)[:20]
+    return render_template('erp/profile.html', profile=summary, trace=trace, top_statements=top)
+
+@bp.route('/erp/settings/profiles/<profile_id>/<kind>')
+@login_required
+@admin_required
+def erp_profile_download(profile_id, kind):
+    path = profiler.profile_path(profile_id, kind)
+    if path is None:
+        abort(404)
+    mimetype = 'text/plain' if kind == 'folded' else 'application/json'
+    return send_file(path, mimetype=mimetype, as_attachment=True, download_name=os.path.basename(path))
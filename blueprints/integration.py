@@ -0,0 +1,40 @@
+from flask import Blueprint, flash, redirect, request, url_for
+
+import outbox
+from auth import admin_required, login_required
+from db import get_db_connection
+from streaming import iter_rows, stream_page
+
+bp = Blueprint('integration', __name__)
+
+# --- Integration Routes ---
+@bp.route('/integration')
+@login_required
+def integration_home():
+    conn = get_db_connection()
+    outbox.ensure_schema(conn)
+    conn.commit()
+    delivery_stats = outbox.stats(conn)
+    events = iter_rows(conn, '''
+        SELECT ie.*, o.OrderID, c.CustomerName, jc.JobType,
+               (SELECT COUNT(*) FROM EventDeliveries d WHERE d.EventID = ie.EventID) AS Deliveries,
+               (SELECT COUNT(*) FROM EventDeliveries d WHERE d.EventID = ie.EventID AND d.Status = 'delivered') AS Delivered,
+               (SELECT COUNT(*) FROM EventDeliveries d WHERE d.EventID = ie.EventID AND d.Status = 'dead') AS Dead
+        FROM (SELECT * FROM IntegrationEvents ORDER BY EventTime DESC LIMIT 20) ie
+        LEFT JOIN Orders o ON ie.RelatedOrderID = o.OrderID LEFT JOIN Customers c ON o.CustomerID = c.CustomerID LEFT JOIN JobCards jc ON ie.JobCardID = jc.JobCardID
+        ORDER BY ie.EventTime DESC
+    ''')
+    return stream_page('integration/events.html', conn, events=events, delivery_stats=delivery_stats)
+
+@bp.route('/integration/deliveries/retry', methods=['POST'])
+@login_required
+@admin_required
+def integration_retry_deliveries():
+    conn = get_db_connection()
+    try:
+        count = outbox.retry_dead(conn, request.form.get('endpoint') or None)
+        conn.commit()
+    finally:
+        conn.close()
+    flash(f'{count} failed deliveries queued for retry.', 'success')
+    return redirect(url_for('integration.integration_home'))
@@ -0,0 +1,209 @@
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash
+from datetime import date, datetime
+
+import change_log
+import http_cache
+import outbox
+import partitions
+from auth import login_required
+from db import delete_job_links, get_db_connection, log_audit
+
+bp = Blueprint('jobkart', __name__)
+
+# --- Job Kart Routes ---
+@bp.route('/jobkart')
+@login_required
+def jobkart_home():
+    return render_template('jobkart/index.html')
+
+@bp.route('/jobkart/board')
+@login_required
+@http_cache.conditional('JobCards', 'Employees')
+def jobkart_board():
+    conn = get_db_connection()
+    
+    # Create board columns and get job data
+    columns = [
+        {'ColumnID': 1, 'Title': 'To Do', 'Count': 0},
+        {'ColumnID': 2, 'Title': 'In Progress', 'Count': 0},
+        {'ColumnID': 3, 'Title': 'Completed', 'Count': 0}
+    ]
+    
+    # Get job cards grouped by status
+    cards = []
+    try:
+        job_cards = conn.execute('SELECT * FROM JobCards ORDER BY ScheduledStart ASC').fetchall()
+        for job in job_cards:
+            status_map = {'Open': 1, 'In Progress': 2, 'Completed': 3, 'Closed': 3}
+            column_id = status_map.get(job['Status'], 1)
+            cards.append({
+                'JobCardID': job['JobCardID'],
+                'Title': job['Description'][:50] + '...' if len(job['Description']) > 50 else job['Description'],
+                'ColumnID': column_id,
+                'Priority': job.get('Priority', 'Medium'),
+                'AssignedTo': job.get('AssignedTo', 'Unassigned')
+            })
+    except:
+        pass
+    
+    # Update column counts
+    for column in columns:
+        column['Count'] = len([c for c in cards if c['ColumnID'] == column['ColumnID']])
+    
+    employees = conn.execute("SELECT EmployeeID, Name FROM Employees WHERE Status='Active'").fetchall()
+    conn.close()
+    return render_template('jobkart/board.html', columns=columns, cards=cards, employees=employees)
+
+@bp.route('/jobkart/jobs')
+@login_required
+@http_cache.conditional('JobCards', 'Employees', 'Orders', 'Customers')
+def jobkart_jobs():
+    conn = get_db_connection()
+    jobs = conn.execute('SELECT jc.*, e.Name as AssignedTo FROM JobCards jc LEFT JOIN Employees e ON jc.AssignedTo = e.EmployeeID ORDER BY jc.ScheduledStart DESC').fetchall()
+    employees = conn.execute("SELECT * FROM Employees WHERE Status='Active'").fetchall()
+    orders = conn.execute("SELECT o.OrderID, c.CustomerName FROM Orders o JOIN Customers c ON o.CustomerID = c.CustomerID WHERE o.Status IN ('Confirmed', 'In Production')").fetchall()
+    conn.close()
+    return render_template('jobkart/jobs.html', jobs=jobs, employees=employees, orders=orders)
+
+@bp.route('/jobkart/trips')
+@login_required
+def jobkart_trips():
+    import trip_planner
+    try:
+        day = datetime.strptime(request.args.get('date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        day = date.today()
+    conn = get_db_connection()
+    try:
+        plan = trip_planner.plan_day(conn, day)
+    finally:
+        conn.close()
+    return render_template('jobkart/trips.html', plan=plan)
+
+@bp.route('/jobkart/jobs/new', methods=['GET', 'POST'])
+@login_required
+def jobkart_new_job():
+    conn = get_db_connection()
+    if request.method == 'POST':
+        job_type = request.form['job_type']
+        description = request.form['description']
+        assigned_to = request.form.get('assigned_to') or None
+        priority = request.form['priority']
+        scheduled_start = request.form['scheduled_start']
+        scheduled_end = request.form['scheduled_end']
+        related_order = request.form.get('related_order') or None
+        
+        conn.close()
+        conn = partitions.connect_for_order(related_order)
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO JobCards (RelatedOrderID, JobType, Description, AssignedTo, Status, Priority, ScheduledStart, ScheduledEnd)
+            VALUES (?, ?, ?, ?, 'Open', ?, ?, ?)
+        ''', (related_order, job_type, description, assigned_to, priority, scheduled_start, scheduled_end))
+        job_id = cursor.lastrowid
+        after = change_log.fetch(conn, 'JobCards', job_id)
+        change_log.record(conn, 'JobCards', job_id, None, after, session['user_id'])
+        outbox.publish(conn, 'JobCardCreated', f"{job_type} job card created", order_id=related_order, job_card_id=job_id, data=dict(after))
+        
+        log_audit(conn, 'JobCard', job_id, 'Create', session['user_id'], f"New job card created: {job_type}")
+        conn.commit()
+        conn.close()
+        flash('Job Card created successfully!', 'success')
+        return redirect(url_for('jobkart.jobkart_jobs'))
+    
+    employees = conn.execute("SELECT * FROM Employees WHERE Status='Active'").fetchall()
+    orders = conn.execute("SELECT o.OrderID, c.CustomerName FROM Orders o JOIN Customers c ON o.CustomerID = c.CustomerID WHERE o.Status IN ('Confirmed', 'In Production')").fetchall()
+    conn.close()
+    return render_template('jobkart/new_job.html', employees=employees, orders=orders)
+
+@bp.route('/jobkart/jobs/<int:job_id>')
+@login_required
+def jobkart_job_detail(job_id):
+    conn = get_db_connection()
+    job = conn.execute('SELECT jc.*, e.Name as AssignedToName FROM JobCards jc LEFT JOIN Employees e ON jc.AssignedTo = e.EmployeeID WHERE jc.JobCardID = ?', (job_id,)).fetchone()
+    if job is None:
+        flash('Job not found!', 'danger')
+        return redirect(url_for('jobkart.jobkart_jobs'))
+    
+    assignments = conn.execute('SELECT ja.*, e.Name as EmployeeName, v.VehicleName FROM JobAssignments ja LEFT JOIN Employees e ON ja.AssignedEmployeeID = e.EmployeeID LEFT JOIN Vehicles v ON ja.AssignedVehicleID = v.VehicleID WHERE ja.JobCardID = ?', (job_id,)).fetchall()
+    progress_logs = conn.execute('SELECT jpl.*, e.Name as UpdatedByName FROM JobProgressLog jpl LEFT JOIN Employees e ON jpl.UpdatedBy = e.EmployeeID WHERE jpl.JobCardID = ? ORDER BY jpl.UpdateTime DESC', (job_id,)).fetchall()
+    conn.close()
+    return render_template('jobkart/job_detail.html', job=job, assignments=assignments, progress_logs=progress_logs)
+
+@bp.route('/jobkart/jobs/delete/<int:job_id>', methods=['POST'])
+@login_required
+def jobkart_delete_job(job_id):
+    conn = partitions.connect_for_row('JobCards', job_id)
+    try:
+        before = change_log.fetch(conn, 'JobCards', job_id)
+        delete_job_links(conn, job_id, session['user_id'])
+        conn.execute('DELETE FROM JobCards WHERE JobCardID = ?', (job_id,))
+        change_log.record(conn, 'JobCards', job_id, before, None, session['user_id'])
+        log_audit(conn, 'JobCard', job_id, 'Delete', session['user_id'], f"Job Card #{job_id} deleted.")
+        conn.commit()
+        flash('Job Card deleted successfully!', 'danger')
+    except Exception as e:
+        flash(f'Error deleting job card: {e}', 'danger')
+    finally:
+        conn.close()
+    return redirect(url_for('jobkart.jobkart_jobs'))
+
+@bp.route('/jobkart/assignments', methods=['GET', 'POST'])
+@login_required
+def jobkart_assignments():
+    conn = get_db_connection()
+    
+    assignments = conn.execute('''
+        SELECT ja.*, jc.Description, jc.JobType, jc.Status as JobStatus, e.Name as EmployeeName, v.VehicleName 
+        FROM JobAssignments ja 
+        JOIN JobCards jc ON ja.JobCardID = jc.JobCardID 
+        LEFT JOIN Employees e ON ja.AssignedEmployeeID = e.EmployeeID 
+        LEFT JOIN Vehicles v ON ja.AssignedVehicleID = v.VehicleID 
+        ORDER BY ja.AssignmentID DESC
+    ''').fetchall()
+    
+    # Data for the edit modal dropdowns
+    employees = conn.execute("SELECT * FROM Employees WHERE Status='Active'").fetchall()
+    vehicles = conn.execute("SELECT * FROM Vehicles WHERE Status='Available'").fetchall()
+    
+    conn.close()
+    return render_template('jobkart/assignments.html', assignments=assignments, employees=employees, vehicles=vehicles)
+
+@bp.route('/jobkart/assignments/edit/<int:assignment_id>', methods=['POST'])
+@login_required
+def jobkart_edit_assignment(assignment_id):
+    conn = get_db_connection()
+    try:
+        employee_id = request.form.get('employee_id') or None
+        role = request.form.get('role_in_job')
+        vehicle_id = request.form.get('vehicle_id') or None
+        before = change_log.fetch(conn, 'JobAssignments', assignment_id)
+        conn.execute('''
+            UPDATE JobAssignments 
+            SET AssignedEmployeeID = ?, RoleInJob = ?, AssignedVehicleID = ?
+            WHERE AssignmentID = ?
+        ''', (employee_id, role, vehicle_id, assignment_id))
+        change_log.record(conn, 'JobAssignments', assignment_id, before, change_log.fetch(conn, 'JobAssignments', assignment_id), session['user_id'])
+        conn.commit()
+        flash('Assignment updated successfully!', 'success')
+    except Exception as e:
+        flash(f'Error updating assignment: {e}', 'danger')
+    finally:
+        conn.close()
+    return redirect(url_for('jobkart.jobkart_assignments'))
+
+@bp.route('/jobkart/assignments/delete/<int:assignment_id>', methods=['POST'])
+@login_required
+def jobkart_delete_assignment(assignment_id):
+    conn = get_db_connection()
+    try:
+        before = change_log.fetch(conn, 'JobAssignments', assignment_id)
+        conn.execute('DELETE FROM JobAssignments WHERE AssignmentID = ?', (assignment_id,))
+        change_log.record(conn, 'JobAssignments', assignment_id, before, None, session['user_id'])
+        conn.commit()
+        flash('Assignment removed successfully!', 'danger')
+    except Exception as e:
+        flash(f'Error removing assignment: {e}', 'danger')
+    finally:
+        conn.close()
+    return redirect(url_for('jobkart.jobkart_assignments'))
@@ -0,0 +1,76 @@
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash
+
+from auth import hash_password, login_required
+from db import get_db_connection, log_audit
+
+bp = Blueprint('main', __name__)
+
+# --- Main Routes ---
+@bp.route('/')
+def index():
+    if 'user_id' in session:
+        return redirect(url_for('main.dashboard'))
+    return redirect(url_for('main.login'))
+
+@bp.route('/login', methods=['GET', 'POST'])
+def login():
+    if request.method == 'POST':
+        username = request.form['username']
+        password = request.form['password']
+        hashed_password = hash_password(password)
+
+        conn = get_db_connection()
+        user = conn.execute('''
+            SELECT u.UserID, u.Username, u.EmployeeID, e.Name, r.RoleName 
+            FROM Users u 
+            JOIN Employees e ON u.EmployeeID = e.EmployeeID 
+            JOIN Roles r ON e.RoleID = r.RoleID
+            WHERE u.Username = ? AND u.PasswordHash = ?
+        ''', (username, hashed_password)).fetchone()
+
+        if user:
+            session['user_id'] = user['UserID']
+            session['username'] = user['Username']
+            session['employee_name'] = user['Name']
+            session['role'] = user['RoleName']
+            session['employee_id'] = user['EmployeeID']
+            
+            log_audit(conn, 'User', user['UserID'], 'Login', user['UserID'], f"User {username} logged in")
+            conn.commit()
+            conn.close()
+            flash(f'Welcome {user["Name"]}!', 'success')
+            return redirect(url_for('main.dashboard'))
+        else:
+            conn.close()
+            flash('Invalid username or password', 'danger')
+
+    return render_template('login.html')
+
+@bp.route('/logout')
+def logout():
+    if 'user_id' in session:
+        conn = get_db_connection()
+        log_audit(conn, 'User', session['user_id'], 'Logout', session['user_id'], f"User {session['username']} logged out")
+        conn.commit()
+        conn.close()
+    session.clear()
+    flash('You have been logged out successfully', 'info')
+    return redirect(url_for('main.login'))
+
+@bp.route('/dashboard')
+@login_required
+def dashboard():
+    conn = get_db_connection()
+    stats = {}
+    stats['total_orders'] = (conn.execute('SELECT COUNT(*) as count FROM Orders').fetchone() or {'count': 0})['count']
+    stats['pending_orders'] = (conn.execute("SELECT COUNT(*) as count FROM Orders WHERE Status IN ('Confirmed', 'Pending')").fetchone() or {'count': 0})['count'] 
+    stats['active_jobs'] = (conn.execute("SELECT COUNT(*) as count FROM JobCards WHERE Status IN ('Open', 'In Progress')").fetchone() or {'count': 0})['count']
+    stats['total_vehicles'] = (conn.execute('SELECT COUNT(*) as count FROM Vehicles').fetchone() or {'count': 0})['count']
+    stats['available_vehicles'] = (conn.execute("SELECT COUNT(*) as count FROM Vehicles WHERE Status = 'Available'").fetchone() or {'count': 0})['count']
+    stats['low_inventory'] = (conn.execute('SELECT COUNT(*) as count FROM Inventory WHERE CurrentStock <= Threshold').fetchone() or {'count': 0})['count']
+    
+    recent_orders = conn.execute('SELECT o.OrderID, c.CustomerName, p.ProductName, o.Quantity, o.OrderDate, o.Status FROM Orders o JOIN Customers c ON o.CustomerID = c.CustomerID JOIN Products p ON o.ProductID = p.ProductID ORDER BY o.OrderDate DESC LIMIT 5').fetchall()
+    recent_jobs = conn.execute('SELECT jc.JobCardID, jc.JobType, jc.Description, jc.Status, jc.Priority, e.Name as AssignedTo FROM JobCards jc LEFT JOIN Employees e ON jc.AssignedTo = e.EmployeeID ORDER BY jc.JobCardID DESC LIMIT 5').fetchall()
+    low_inventory = conn.execute('SELECT MaterialName, CurrentStock, Unit, Threshold FROM Inventory WHERE CurrentStock <= Threshold ORDER BY (CurrentStock/Threshold) ASC').fetchall()
+    conn.close()
+    return render_template('dashboard.html', stats=stats, recent_orders=recent_orders, recent_jobs=recent_jobs, low_inventory=low_inventory)
@@ -0,0 +1,147 @@
+from datetime import datetime, timedelta
+import json
+
+from partitions import bookkeeping, shared_schema
+from storage import dialect
+
+# --- Change-data capture ---
+# Write routes for the tracked tables pass the row before and after their
+# statement to record(), which stores only the columns that changed as
+# {"Column": [old, new]} in ChangeLog, indexed by entity. timeline() reads
+# one entity's changes from that index and state_at() replays them to
+# rebuild the row as it was at a given time. Like sales_cube, the caller
+# commits.
+#
+# Rows that predate ChangeLog get a 'baseline' entry holding their full
+# state the first time they change, so replay always has a starting point.
+#
+# Readers that keep a ChangeID mark (mobile_sync, fleet) move it with
+# settled_mark(). SQLite serializes writers, so ChangeIDs commit in order.
+# On PostgreSQL a transaction can commit after one that drew a later
+# ChangeID. There the mark only moves past changes older than
+# SETTLE_SECONDS, and newer ones are read again next time.
+
+# Tracked table -> primary key.
+TRACKED = {
+    'Orders': 'OrderID',
+    'JobCards': 'JobCardID',
+    'JobAssignments': 'AssignmentID',
+    'Inventory': 'MaterialID',
+    'Employees': 'EmployeeID',
+    'Vehicles': 'VehicleID',
+}
+SETTLE_SECONDS = 30
+
+
+def ensure_schema(conn):
+    if dialect(conn).table_exists(conn, 'ChangeLog'):
+        return
+    schema = shared_schema(conn)
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {schema}ChangeLog (
+            ChangeID INTEGER PRIMARY KEY AUTOINCREMENT,
+            EntityType TEXT NOT NULL,
+            EntityID INTEGER NOT NULL,
+            Operation TEXT NOT NULL,
+            ChangedAt TEXT NOT NULL,
+            ChangedBy INTEGER,
+            Diff TEXT NOT NULL
+        )
+    ''')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS {schema}idx_changelog_entity ON ChangeLog(EntityType, EntityID, ChangeID)')
+
+
+def settled_mark(conn, changes, mark):
+    """Where a reader of ``changes`` (ChangeID order, with ChangedAt) can move its ``mark`` to."""
+    if dialect(conn).name == 'sqlite':
+        return changes[-1]['ChangeID'] if changes else mark
+    cutoff = (datetime.now() - timedelta(seconds=SETTLE_SECONDS)).isoformat()
+    for change in changes:
+        if str(change['ChangedAt']) >= cutoff:
+            break
+        mark = change['ChangeID']
+    return mark
+
+
+def fetch(conn, table, entity_id):
+    """Current row of a tracked table, or None."""
+    return conn.execute(f'SELECT * FROM {table} WHERE {TRACKED[table]} = ?', (entity_id,)).fetchone()
+
+
+def _as_dict(row):
+    return None if row is None else {key: row[key] for key in row.keys()}
+
+
+@bookkeeping
+def record(conn, table, entity_id, before, after, user_id=None):
+    """Log the change of ``table`` row ``entity_id`` from ``before`` to ``after``.
+
+    Either side may be None (insert/delete). Returns the ChangeID, or None
+    when nothing changed or the call was queued on a plant connection.
+    """
+    if table not in TRACKED:
+        raise ValueError(f'Untracked table: {table}')
+    ensure_schema(conn)
+    before, after = _as_dict(before), _as_dict(after)
+    if before is None and after is None:
+        return None
+    now = datetime.now().isoformat()
+    if before is not None and after is not None and not conn.execute('SELECT 1 FROM ChangeLog WHERE EntityType = ? AND EntityID = ? LIMIT 1', (table, entity_id)).fetchone():
+        _insert(conn, table, entity_id, 'baseline', now, user_id, {col: [None, value] for col, value in before.items()})
+
+    if before is None:
+        operation, diff = 'insert', {col: [None, value] for col, value in after.items()}
+    elif after is None:
+        operation, diff = 'delete', {col: [value, None] for col, value in before.items()}
+    else:
+        operation = 'update'
+        diff = {col: [before.get(col), value] for col, value in after.items() if before.get(col) != value}
+        if not diff:
+            return None
+    return _insert(conn, table, entity_id, operation, now, user_id, diff)
+
+
+def _insert(conn, table, entity_id, operation, changed_at, user_id, diff):
+    cursor = conn.cursor()
+    cursor.execute('INSERT INTO ChangeLog (EntityType, EntityID, Operation, ChangedAt, ChangedBy, Diff) VALUES (?, ?, ?, ?, ?, ?)',
+                   (table, entity_id, operation, changed_at, user_id, json.dumps(diff, default=str, separators=(',', ':'))))
+    return cursor.lastrowid
+
+
+def timeline(conn, table, entity_id, limit=None):
+    """Changes to one entity, oldest first, with ``Diff`` decoded."""
+    if not dialect(conn).table_exists(conn, 'ChangeLog'):
+        return []
+    sql = 'SELECT ChangeID, Operation, ChangedAt, ChangedBy, Diff FROM ChangeLog WHERE EntityType = ? AND EntityID = ? ORDER BY ChangeID'
+    params = [table, entity_id]
+    if limit:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    return [dict(row, Diff=json.loads(row['Diff'])) for row in (_as_dict(r) for r in conn.execute(sql, params))]
+
+
+def state_at(conn, table, entity_id, at):
+    """The row as it stood at ``at`` (ISO date or datetime), rebuilt from its diffs.
+
+    None if it did not exist then, or its history does not reach back that
+    far. Raises ValueError if ``at`` is not an ISO date or datetime.
+    """
+    # ChangedAt is compared as text, so spell ``at`` the way it is stored:
+    # '2024-05-01' must not sort before '2024-05-01T09:00'.
+    at = at if isinstance(at, datetime) else datetime.fromisoformat(at)
+    if at.tzinfo is not None:
+        at = at.astimezone().replace(tzinfo=None)
+    at = at.isoformat()
+    if not dialect(conn).table_exists(conn, 'ChangeLog'):
+        return None
+    state = None
+    for row in conn.execute('SELECT Operation, Diff FROM ChangeLog WHERE EntityType = ? AND EntityID = ? AND ChangedAt <= ? ORDER BY ChangeID',
+                            (table, entity_id, at)):
+        diff = json.loads(row['Diff'])
+        if row['Operation'] == 'delete':
+            state = None
+        elif row['Operation'] in ('insert', 'baseline'):
+            state = {col: values[1] for col, values in diff.items()}
+        elif state is not None:
+            state.update((col, values[1]) for col, values in diff.items())
+    return state
@@ -0,0 +1,46 @@
+from flask import current_app
+from datetime import datetime
+
+import change_log
+from partitions import bookkeeping
+
+# --- Database helper functions ---
+def get_db_connection():
+    return current_app.extensions['storage'].connect()
+
+@bookkeeping
+def log_audit(conn, entity_type, entity_id, action, user_id, details=""):
+    conn.execute('''
+        INSERT INTO AuditLog (EntityType, EntityID, Action, PerformedBy, ActionTime, Details)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (entity_type, entity_id, action, user_id, datetime.now().isoformat(), details))
+
+# Job card side rows live in the shared database. On a plant connection
+# these are queued with the rest of the bookkeeping (partitions.py), so a
+# job card write never takes the shared write lock; a queued call returns
+# None.
+
+@bookkeeping
+def log_job_progress(conn, job_id, employee_id, update_time, status, notes=''):
+    """Add a JobProgressLog entry; returns its LogID."""
+    cursor = conn.cursor()
+    cursor.execute('INSERT INTO JobProgressLog (JobCardID, UpdatedBy, UpdateTime, Status, Notes) VALUES (?, ?, ?, ?, ?)',
+                   (job_id, employee_id, update_time, status, notes))
+    return cursor.lastrowid
+
+@bookkeeping
+def assign_vehicle(conn, job_id, vehicle_id, role, user_id):
+    """Add a JobAssignments row for ``vehicle_id`` and log it; returns its AssignmentID."""
+    cursor = conn.cursor()
+    cursor.execute('INSERT INTO JobAssignments (JobCardID, RoleInJob, AssignedVehicleID) VALUES (?, ?, ?)', (job_id, role, vehicle_id))
+    assignment_id = cursor.lastrowid
+    change_log.record(conn, 'JobAssignments', assignment_id, None, change_log.fetch(conn, 'JobAssignments', assignment_id), user_id)
+    return assignment_id
+
+@bookkeeping
+def delete_job_links(conn, job_id, user_id):
+    """Delete a job card's assignments (logged) and progress entries."""
+    for assignment in conn.execute('SELECT * FROM JobAssignments WHERE JobCardID = ?', (job_id,)).fetchall():
+        change_log.record(conn, 'JobAssignments', assignment['AssignmentID'], assignment, None, user_id)
+    conn.execute('DELETE FROM JobAssignments WHERE JobCardID = ?', (job_id,))
+    conn.execute('DELETE FROM JobProgressLog WHERE JobCardID = ?', (job_id,))
@@ -0,0 +1,133 @@
+import hashlib
+import os
+import tempfile
+import uuid
+
+from flask import current_app
+
+from partitions import shared_schema
+from storage import dialect
+
+# --- Content-addressed document store ---
+# Uploaded files are stored once per distinct content, under
+# DOCUMENT_STORE_DIR/<sha256[:2]>/<sha256>, and tracked in the Blobs table
+# with a reference count. Documents keep a 'doc/<sha256>/<filename>' path,
+# so the name a file was uploaded under survives deduplication. An upload
+# is streamed to a temporary file in CHUNK_SIZE pieces while it is hashed,
+# and never held in memory whole. A blob's file is removed once its last
+# reference is released; release() renames it aside and checks the
+# reference count again first, so an upload of the same content racing the
+# removal keeps its file.
+
+CHUNK_SIZE = 1024 * 1024
+PATH_PREFIX = 'doc/'
+
+
+def store_dir(app=None):
+    app = app or current_app
+    return app.config['DOCUMENT_STORE_DIR'] or os.path.join(app.instance_path, 'documents')
+
+
+def blob_path(digest, directory=None):
+    return os.path.join(directory or store_dir(), digest[:2], digest)
+
+
+def ensure_schema(conn):
+    if dialect(conn).table_exists(conn, 'Blobs'):
+        return
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {shared_schema(conn)}Blobs (
+            Hash TEXT PRIMARY KEY,
+            Size INTEGER NOT NULL,
+            RefCount INTEGER NOT NULL DEFAULT 0,
+            CreatedAt DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def document_path(digest, filename):
+    return f'{PATH_PREFIX}{digest}/{filename}'
+
+
+def parse_path(path):
+    """(digest, filename) of a document path, or None for a legacy static upload."""
+    if not path or not path.startswith(PATH_PREFIX):
+        return None
+    digest, _, filename = path[len(PATH_PREFIX):].partition('/')
+    return digest, filename
+
+
+def _spool(stream, directory):
+    """Copy ``stream`` to a temporary file in ``directory``; returns (tmp path, sha256, size)."""
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix='.upload.', suffix='.tmp', dir=directory)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return tmp, digest.hexdigest(), size
+
+
+def store(conn, stream):
+    """Add a reference to the content of ``stream``; returns its sha256. Commits.
+
+    The reference is committed before the file is put in place: a racing
+    release() of the same content either sees the reference and keeps the
+    file, or has already removed it and the file is put back here.
+    """
+    ensure_schema(conn)
+    directory = store_dir()
+    tmp, digest, size = _spool(stream, directory)
+    try:
+        conn.execute('''
+            INSERT INTO Blobs (Hash, Size, RefCount) VALUES (?, ?, 1)
+            ON CONFLICT (Hash) DO UPDATE SET RefCount = Blobs.RefCount + 1
+        ''', (digest, size))
+        conn.commit()
+        target = blob_path(digest, directory)
+        if os.path.exists(target):
+            os.remove(tmp)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(tmp, target)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return digest
+
+
+def release(conn, digest):
+    """Drop a reference to blob ``digest``, removing its file after the last one. Commits."""
+    ensure_schema(conn)
+    conn.execute('UPDATE Blobs SET RefCount = RefCount - 1 WHERE Hash = ?', (digest,))
+    conn.execute('DELETE FROM Blobs WHERE Hash = ? AND RefCount <= 0', (digest,))
+    conn.commit()
+    if conn.execute('SELECT 1 FROM Blobs WHERE Hash = ?', (digest,)).fetchone() is not None:
+        return
+    # Move the file aside before deciding: a store() that commits a new
+    # reference after the re-check below finds no file and puts its own
+    # copy in place, and one that committed before it is seen here.
+    target = blob_path(digest)
+    tombstone = f'{target}.{uuid.uuid4().hex}.released'
+    try:
+        os.rename(target, tombstone)
+    except FileNotFoundError:
+        return
+    if conn.execute('SELECT 1 FROM Blobs WHERE Hash = ?', (digest,)).fetchone() is None:
+        os.remove(tombstone)
+    elif os.path.exists(target):
+        os.remove(tombstone)
+    else:
+        os.replace(tombstone, target)
+
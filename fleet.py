@@ -0,0 +1,495 @@
+from datetime import date, datetime, timedelta
+import json
+import math
+import os
+import threading
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+import change_log
+from db import get_db_connection
+from partitions import shared_schema
+from storage import dialect
+
+# --- Fleet analytics ---
+# Utilization counters for vehicles and plant equipment, kept up to date
+# incrementally instead of being re-joined from history on every page:
+#
+#   FleetUsage        ledger: one row per asset per job card (Source 'job')
+#                     and per order delivered through Dispatch ('order'),
+#                     holding its trips, hours in service and volume, or
+#                     Active=1 while the job card is still open
+#   FleetUtilization  per asset: lifetime and since-last-service totals,
+#                     first/last use, last service date and current job
+#   FleetState        high-water marks: the last ChangeLog entry, Dispatch
+#                     row and Maintenance row folded in
+#
+# refresh() reads only what lies past the marks (ChangeLog entries for
+# JobCards, JobAssignments and Orders, as in mobile_sync, plus new Dispatch
+# and Maintenance rows), recomputes the ledger rows of the job cards and
+# orders they touch and applies the difference to the counters. It runs
+# every FLEET_REFRESH_INTERVAL seconds on a background thread
+# (start_refresher) and from `flask refresh-fleet`; the vehicle page only
+# reads the counters and shows how old they are (refreshed_at). A Dispatch
+# row cancelled after it was first seen is only dropped by
+# `flask refresh-fleet --rebuild`.
+#
+# A completed delivery job card counts one trip per assigned truck, the
+# job's hours (actual times, else scheduled) and an equal share of the
+# order's quantity; other completed jobs count hours only, and maintenance
+# jobs nothing. An open job card is its assets' current job. Dispatch rows
+# count a trip each at dispatch_trip_hours and replace the job card's
+# credit for that truck and order.
+#
+# forecast() projects the next service from one counters row: use since the
+# last service (or first use) over the days elapsed gives a rate, and the
+# service falls due when an hour, trip or volume interval is reached at
+# that rate, or service_days after the last service, whichever is first.
+# FLEET_MAINTENANCE overrides any of DEFAULTS.
+
+DEFAULTS = {
+    'service_hours': 250,         # hours in service between services; None: unused
+    'service_trips': 200,
+    'service_volume': None,       # m3 delivered
+    'service_days': 180,
+    'dispatch_trip_hours': 3.0,   # credited per Dispatch row
+    'min_rate_days': 14,          # rates are taken over at least this many days
+    'due_soon_days': 14,
+}
+ASSET_TYPES = ('Vehicle', 'Equipment')
+ACTIVE_JOB_STATUSES = ('Open', 'In Progress')
+COMPLETED_JOB_STATUSES = ('Completed',)
+NON_USAGE_JOB_TYPES = ('Maintenance',)
+VOID_DISPATCH_STATUSES = ('Cancelled',)
+WATCHED_TABLES = ('JobCards', 'JobAssignments', 'Orders')
+CHUNK = 500
+
+
+def settings(app=None):
+    app = app or current_app
+    return {**DEFAULTS, **app.config['FLEET_MAINTENANCE']}
+
+
+def ensure_schema(conn):
+    change_log.ensure_schema(conn)
+    if dialect(conn).table_exists(conn, 'FleetState'):
+        return
+    schema = shared_schema(conn)
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {schema}FleetUsage (
+            Source TEXT NOT NULL,
+            SourceID INTEGER NOT NULL,
+            AssetType TEXT NOT NULL,
+            AssetID INTEGER NOT NULL,
+            Active INTEGER NOT NULL DEFAULT 0,
+            UsedOn TEXT,
+            Trips INTEGER NOT NULL DEFAULT 0,
+            Hours REAL NOT NULL DEFAULT 0,
+            Volume REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (Source, SourceID, AssetType, AssetID)
+        )
+    ''')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS {schema}idx_fleet_usage_asset ON FleetUsage(AssetType, AssetID, Active, UsedOn)')
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {schema}FleetUtilization (
+            AssetType TEXT NOT NULL,
+            AssetID INTEGER NOT NULL,
+            Trips INTEGER NOT NULL DEFAULT 0,
+            Hours REAL NOT NULL DEFAULT 0,
+            Volume REAL NOT NULL DEFAULT 0,
+            TripsSinceService INTEGER NOT NULL DEFAULT 0,
+            HoursSinceService REAL NOT NULL DEFAULT 0,
+            VolumeSinceService REAL NOT NULL DEFAULT 0,
+            FirstUsed TEXT,
+            LastUsed TEXT,
+            LastService TEXT,
+            CurrentJobID INTEGER,
+            PRIMARY KEY (AssetType, AssetID)
+        )
+    ''')
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {schema}FleetState (
+            StateID INTEGER PRIMARY KEY,
+            LastChangeID INTEGER NOT NULL,
+            LastDispatchID INTEGER NOT NULL,
+            LastMaintID INTEGER NOT NULL,
+            RefreshedAt TEXT
+        )
+    ''')
+    rebuild(conn)
+    conn.commit()
+
+
+def _chunks(ids):
+    ids = sorted(ids)
+    for i in range(0, len(ids), CHUNK):
+        yield ids[i:i + CHUNK]
+
+
+def _when(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value)[:19])
+    except ValueError:
+        return None
+
+
+# --- Ledger rows ---
+# Each source yields (AssetType, AssetID, Active, UsedOn, Trips, Hours, Volume).
+
+def _dispatched(conn, order_ids):
+    """(OrderID, VehicleID) pairs covered by Dispatch rows."""
+    pairs = set()
+    for chunk in _chunks(order_ids):
+        pairs.update((row[0], row[1]) for row in conn.execute(f'''
+            SELECT DISTINCT OrderID, VehicleID FROM Dispatch
+            WHERE OrderID IN ({', '.join('?' for _ in chunk)}) AND VehicleID IS NOT NULL
+              AND COALESCE(DeliveryStatus, '') NOT IN ({', '.join('?' for _ in VOID_DISPATCH_STATUSES)})
+        ''', (*chunk, *VOID_DISPATCH_STATUSES)))
+    return pairs
+
+
+def _job_entries(conn, job_ids):
+    """{JobCardID: ledger rows} for ``job_ids``; deleted job cards map to []."""
+    entries = {job_id: [] for job_id in job_ids}
+    for chunk in _chunks(entries):
+        placeholders = ', '.join('?' for _ in chunk)
+        jobs = conn.execute(f'''
+            SELECT jc.JobCardID, jc.RelatedOrderID, jc.JobType, jc.Status, jc.ScheduledStart, jc.ScheduledEnd,
+                   jc.ActualStart, jc.ActualEnd, o.Quantity
+            FROM JobCards jc LEFT JOIN Orders o ON o.OrderID = jc.RelatedOrderID
+            WHERE jc.JobCardID IN ({placeholders})
+        ''', chunk).fetchall()
+        assets = {}
+        for row in conn.execute(f'SELECT JobCardID, AssignedVehicleID, AssignedEquipmentID FROM JobAssignments WHERE JobCardID IN ({placeholders})', chunk):
+            job_assets = assets.setdefault(row['JobCardID'], {})
+            if row['AssignedVehicleID']:
+                job_assets[('Vehicle', row['AssignedVehicleID'])] = None
+            if row['AssignedEquipmentID']:
+                job_assets[('Equipment', row['AssignedEquipmentID'])] = None
+        dispatched = _dispatched(conn, {job['RelatedOrderID'] for job in jobs if job['RelatedOrderID'] is not None})
+
+        for job in jobs:
+            job_id, status = job['JobCardID'], job['Status']
+            active = status in ACTIVE_JOB_STATUSES
+            if active:
+                for asset_type, asset_id in assets.get(job_id, ()):
+                    entries[job_id].append((asset_type, asset_id, 1, job['ScheduledStart'] and str(job['ScheduledStart']), 0, 0.0, 0.0))
+                continue
+            if status not in COMPLETED_JOB_STATUSES or job['JobType'] in NON_USAGE_JOB_TYPES:
+                continue
+
+            start, end = _when(job['ActualStart']), _when(job['ActualEnd'])
+            if start is None or end is None:
+                start, end = _when(job['ScheduledStart']), _when(job['ScheduledEnd'])
+            hours = max((end - start).total_seconds() / 3600, 0.0) if start and end else 0.0
+            used_on = (end or start).isoformat(sep=' ') if (end or start) else None
+            delivery = job['JobType'] == 'Delivery'
+            targets = [asset for asset in assets.get(job_id, ())
+                       if not (asset[0] == 'Vehicle' and (job['RelatedOrderID'], asset[1]) in dispatched)]
+            trucks = sum(asset_type == 'Vehicle' for asset_type, _ in targets)
+            share = float(job['Quantity'] or 0) / trucks if delivery and trucks else 0.0
+            for asset_type, asset_id in targets:
+                truck = delivery and asset_type == 'Vehicle'
+                entries[job_id].append((asset_type, asset_id, 0, used_on, int(truck), hours, share if truck else 0.0))
+    return entries
+
+
+def _dispatch_entries(conn, order_ids, config):
+    """{OrderID: ledger rows} from the order's Dispatch rows, one per truck."""
+    entries = {order_id: [] for order_id in order_ids}
+    for chunk in _chunks(entries):
+        placeholders = ', '.join('?' for _ in chunk)
+        quantities = {row[0]: float(row[1] or 0) for row in conn.execute(f'SELECT OrderID, Quantity FROM Orders WHERE OrderID IN ({placeholders})', chunk)}
+        rows = conn.execute(f'''
+            SELECT OrderID, VehicleID, COUNT(*) AS Trips, MAX(DispatchDate) AS LastDispatch FROM Dispatch
+            WHERE OrderID IN ({placeholders}) AND VehicleID IS NOT NULL
+              AND COALESCE(DeliveryStatus, '') NOT IN ({', '.join('?' for _ in VOID_DISPATCH_STATUSES)})
+            GROUP BY OrderID, VehicleID
+        ''', (*chunk, *VOID_DISPATCH_STATUSES)).fetchall()
+        totals = {}
+        for row in rows:
+            totals[row['OrderID']] = totals.get(row['OrderID'], 0) + row['Trips']
+        for row in rows:
+            order_id, trips = row['OrderID'], row['Trips']
+            entries[order_id].append(('Vehicle', row['VehicleID'], 0, row['LastDispatch'] and str(row['LastDispatch']), trips,
+                                      trips * config['dispatch_trip_hours'], quantities.get(order_id, 0.0) * trips / totals[order_id]))
+    return entries
+
+
+# --- Counters ---
+
+def _bump(conn, asset_type, asset_id, used_on, trips, hours, volume):
+    # Use dated after the last service also counts towards the next one.
+    conn.execute('''
+        INSERT INTO FleetUtilization (AssetType, AssetID, Trips, Hours, Volume, TripsSinceService, HoursSinceService, VolumeSinceService)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (AssetType, AssetID) DO UPDATE SET
+            Trips = FleetUtilization.Trips + excluded.Trips,
+            Hours = FleetUtilization.Hours + excluded.Hours,
+            Volume = FleetUtilization.Volume + excluded.Volume,
+            TripsSinceService = FleetUtilization.TripsSinceService
+                + CASE WHEN FleetUtilization.LastService IS NULL OR ? > FleetUtilization.LastService THEN excluded.Trips ELSE 0 END,
+            HoursSinceService = FleetUtilization.HoursSinceService
+                + CASE WHEN FleetUtilization.LastService IS NULL OR ? > FleetUtilization.LastService THEN excluded.Hours ELSE 0 END,
+            VolumeSinceService = FleetUtilization.VolumeSinceService
+                + CASE WHEN FleetUtilization.LastService IS NULL OR ? > FleetUtilization.LastService THEN excluded.Volume ELSE 0 END
+    ''', (asset_type, asset_id, trips, hours, volume, trips, hours, volume, used_on, used_on, used_on))
+
+
+def _touch(conn, assets):
+    """Recompute first/last use and the current job of ``assets`` from the ledger."""
+    for asset_type, asset_id in assets:
+        used = conn.execute('SELECT MIN(UsedOn), MAX(UsedOn) FROM FleetUsage WHERE AssetType = ? AND AssetID = ? AND Active = 0',
+                            (asset_type, asset_id)).fetchone()
+        current = conn.execute("SELECT SourceID FROM FleetUsage WHERE AssetType = ? AND AssetID = ? AND Active = 1 AND Source = 'job' ORDER BY UsedOn LIMIT 1",
+                               (asset_type, asset_id)).fetchone()
+        conn.execute('''
+            INSERT INTO FleetUtilization (AssetType, AssetID, FirstUsed, LastUsed, CurrentJobID) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (AssetType, AssetID) DO UPDATE SET
+                FirstUsed = excluded.FirstUsed, LastUsed = excluded.LastUsed, CurrentJobID = excluded.CurrentJobID
+        ''', (asset_type, asset_id, used[0], used[1], current[0] if current else None))
+
+
+def _replace(conn, source, entries):
+    """Swap in the ledger rows of ``entries`` ({SourceID: rows}) and apply the difference to the counters."""
+    touched = set()
+    for chunk in _chunks(entries):
+        where = f"Source = ? AND SourceID IN ({', '.join('?' for _ in chunk)})"
+        for row in conn.execute(f'SELECT AssetType, AssetID, Active, UsedOn, Trips, Hours, Volume FROM FleetUsage WHERE {where}', (source, *chunk)).fetchall():
+            touched.add((row['AssetType'], row['AssetID']))
+            if not row['Active']:
+                _bump(conn, row['AssetType'], row['AssetID'], row['UsedOn'], -row['Trips'], -row['Hours'], -row['Volume'])
+        conn.execute(f'DELETE FROM FleetUsage WHERE {where}', (source, *chunk))
+    rows = [(source, source_id, *entry) for source_id, items in entries.items() for entry in items]
+    conn.executemany('INSERT INTO FleetUsage (Source, SourceID, AssetType, AssetID, Active, UsedOn, Trips, Hours, Volume) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    for _, _, asset_type, asset_id, active, used_on, trips, hours, volume in rows:
+        touched.add((asset_type, asset_id))
+        if not active:
+            _bump(conn, asset_type, asset_id, used_on, trips, hours, volume)
+    _touch(conn, touched)
+
+
+def _service(conn, serviced):
+    """Record service dates ({(AssetType, AssetID): 'YYYY-MM-DD'}) and restart the since-service counters."""
+    for (asset_type, asset_id), day in serviced.items():
+        row = conn.execute('SELECT LastService FROM FleetUtilization WHERE AssetType = ? AND AssetID = ?', (asset_type, asset_id)).fetchone()
+        if row is not None and row['LastService'] and row['LastService'] >= day:
+            continue
+        since = conn.execute('''
+            SELECT COALESCE(SUM(Trips), 0), COALESCE(SUM(Hours), 0), COALESCE(SUM(Volume), 0) FROM FleetUsage
+            WHERE AssetType = ? AND AssetID = ? AND Active = 0 AND UsedOn > ?
+        ''', (asset_type, asset_id, day)).fetchone()
+        conn.execute('''
+            INSERT INTO FleetUtilization (AssetType, AssetID, LastService, TripsSinceService, HoursSinceService, VolumeSinceService)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (AssetType, AssetID) DO UPDATE SET
+                LastService = excluded.LastService, TripsSinceService = excluded.TripsSinceService,
+                HoursSinceService = excluded.HoursSinceService, VolumeSinceService = excluded.VolumeSinceService
+        ''', (asset_type, asset_id, day, since[0], since[1], since[2]))
+
+
+def _jobs_for_orders(conn, order_ids):
+    job_ids = set()
+    for chunk in _chunks(order_ids):
+        job_ids.update(row[0] for row in conn.execute(f"SELECT JobCardID FROM JobCards WHERE RelatedOrderID IN ({', '.join('?' for _ in chunk)})", chunk))
+    return job_ids
+
+
+def rebuild(conn):
+    """Recompute the ledger and counters from every job card, Dispatch and Maintenance row (full scan). Does not commit."""
+    for table in ('FleetUsage', 'FleetUtilization', 'FleetState'):
+        conn.execute(f'DELETE FROM {table}')
+    # Marks are read first: a change committed meanwhile is folded in
+    # again by the next refresh rather than missed.
+    marks = [conn.execute(sql).fetchone()[0] for sql in (
+        'SELECT COALESCE(MAX(ChangeID), 0) FROM ChangeLog',
+        'SELECT COALESCE(MAX(DispatchID), 0) FROM Dispatch',
+        'SELECT COALESCE(MAX(MaintID), 0) FROM Maintenance',
+    )]
+    conn.execute('INSERT INTO FleetState (StateID, LastChangeID, LastDispatchID, LastMaintID, RefreshedAt) VALUES (1, ?, ?, ?, ?)',
+                 (*marks, datetime.now().isoformat()))
+    order_ids = {row[0] for row in conn.execute('SELECT DISTINCT OrderID FROM Dispatch WHERE OrderID IS NOT NULL')}
+    job_ids = {row[0] for row in conn.execute('SELECT DISTINCT JobCardID FROM JobAssignments WHERE AssignedVehicleID IS NOT NULL OR AssignedEquipmentID IS NOT NULL')}
+    _replace(conn, 'order', _dispatch_entries(conn, order_ids, settings()))
+    _replace(conn, 'job', _job_entries(conn, job_ids))
+
+    serviced = {('Equipment', row[0]): str(row[1])[:10] for row in conn.execute('SELECT EquipmentID, LastMaintenance FROM Equipment WHERE LastMaintenance IS NOT NULL')}
+    for row in conn.execute('SELECT AssetType, AssetID, MAX(MaintDate) FROM Maintenance WHERE MaintDate IS NOT NULL GROUP BY AssetType, AssetID'):
+        if row[0] in ASSET_TYPES:
+            key = (row[0], row[1])
+            serviced[key] = max(serviced.get(key, ''), str(row[2])[:10])
+    _service(conn, serviced)
+
+
+def refresh(conn):
+    """Fold everything written since the last refresh into the counters. Commits.
+
+    Returns the number of job cards and orders recomputed; 0 also when
+    another process is refreshing the same changes.
+    """
+    ensure_schema(conn)
+    state = conn.execute('SELECT LastChangeID, LastDispatchID, LastMaintID FROM FleetState WHERE StateID = 1').fetchone()
+    if state is None:
+        return 0
+    # Entries of every kind are read, so the mark also moves past changes to
+    # tables the counters do not depend on. Changes not settled yet
+    # (change_log.settled_mark) are folded in now and again next time;
+    # recomputing an entity is idempotent.
+    logged = conn.execute('SELECT ChangeID, EntityType, EntityID, Diff, ChangedAt FROM ChangeLog WHERE ChangeID > ? ORDER BY ChangeID',
+                          (state['LastChangeID'],)).fetchall()
+    last_change = change_log.settled_mark(conn, logged, state['LastChangeID'])
+    changes = [change for change in logged if change['EntityType'] in WATCHED_TABLES]
+    dispatches = conn.execute('SELECT DispatchID, OrderID FROM Dispatch WHERE DispatchID > ? ORDER BY DispatchID', (state['LastDispatchID'],)).fetchall()
+    services = conn.execute('SELECT MaintID, AssetType, AssetID, MaintDate FROM Maintenance WHERE MaintID > ? ORDER BY MaintID', (state['LastMaintID'],)).fetchall()
+    if not (changes or dispatches or services):
+        # Nothing to fold in: the counters are current as of now.
+        conn.execute('UPDATE FleetState SET RefreshedAt = ? WHERE StateID = 1', (datetime.now().isoformat(),))
+        conn.commit()
+        return 0
+    marks = (max(last_change, state['LastChangeID']),
+             dispatches[-1]['DispatchID'] if dispatches else state['LastDispatchID'],
+             services[-1]['MaintID'] if services else state['LastMaintID'])
+    # Moving the marks first claims these changes: a concurrent refresh
+    # that read the same marks updates nothing and backs off.
+    claimed = conn.execute('''
+        UPDATE FleetState SET LastChangeID = ?, LastDispatchID = ?, LastMaintID = ?, RefreshedAt = ?
+        WHERE StateID = 1 AND LastChangeID = ? AND LastDispatchID = ? AND LastMaintID = ?
+    ''', (*marks, datetime.now().isoformat(), state['LastChangeID'], state['LastDispatchID'], state['LastMaintID'])).rowcount
+    if not claimed:
+        conn.rollback()
+        return 0
+
+    job_ids, order_ids = set(), set()
+    for change in changes:
+        table, entity_id = change['EntityType'], change['EntityID']
+        if table == 'JobCards':
+            job_ids.add(entity_id)
+        elif table == 'Orders':
+            order_ids.add(entity_id)
+        else:
+            # An assignment may have moved between job cards; both count.
+            job_ids.update(value for value in json.loads(change['Diff']).get('JobCardID', ()) if value is not None)
+            row = change_log.fetch(conn, 'JobAssignments', entity_id)
+            if row is not None and row['JobCardID'] is not None:
+                job_ids.add(row['JobCardID'])
+    order_ids.update(row['OrderID'] for row in dispatches if row['OrderID'] is not None)
+    if order_ids:
+        _replace(conn, 'order', _dispatch_entries(conn, order_ids, settings()))
+        job_ids |= _jobs_for_orders(conn, order_ids)
+    _replace(conn, 'job', _job_entries(conn, job_ids))
+
+    serviced = {}
+    for row in services:
+        if row['AssetType'] in ASSET_TYPES and row['MaintDate']:
+            key = (row['AssetType'], row['AssetID'])
+            serviced[key] = max(serviced.get(key, ''), str(row['MaintDate'])[:10])
+    _service(conn, serviced)
+    conn.commit()
+    return len(job_ids) + len(order_ids)
+
+
+def refreshed_at(conn):
+    """When the counters were last brought up to date, or None."""
+    row = conn.execute('SELECT RefreshedAt FROM FleetState WHERE StateID = 1').fetchone()
+    return _when(row[0]) if row else None
+
+
+_refresher = {'pid': None}
+_refresher_lock = threading.Lock()
+
+
+def start_refresher(app):
+    """Start this process's background refresh thread once (after fork too); off when FLEET_REFRESH_INTERVAL is 0."""
+    interval = app.config['FLEET_REFRESH_INTERVAL']
+    with _refresher_lock:
+        if not interval or _refresher['pid'] == os.getpid():
+            return
+        _refresher['pid'] = os.getpid()
+        backend = app.extensions['storage']
+
+        def run():
+            while True:
+                try:
+                    with app.app_context():
+                        conn = backend.connect()
+                        try:
+                            refresh(conn)
+                        finally:
+                            conn.close()
+                except Exception:
+                    app.logger.exception('Fleet refresh failed')
+                time.sleep(interval)
+
+        threading.Thread(target=run, name='fleet-refresh', daemon=True).start()
+
+
+def record_maintenance(conn, asset_type, asset_id, maint_type, description, maint_date, cost, performed_by):
+    """Insert a Maintenance row (and keep Equipment.LastMaintenance current); returns its MaintID. Does not commit."""
+    if asset_type not in ASSET_TYPES:
+        raise ValueError(f'Unknown asset type: {asset_type}')
+    cursor = conn.cursor()
+    cursor.execute('INSERT INTO Maintenance (AssetType, AssetID, MaintType, Description, MaintDate, Cost, PerformedBy) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                   (asset_type, asset_id, maint_type, description, maint_date, cost, performed_by))
+    if asset_type == 'Equipment':
+        conn.execute('UPDATE Equipment SET LastMaintenance = ? WHERE EquipmentID = ? AND (LastMaintenance IS NULL OR LastMaintenance < ?)',
+                     (maint_date, asset_id, maint_date))
+    return cursor.lastrowid
+
+
+# --- Forecast ---
+
+def forecast(row, today=None, config=None):
+    """Projected next service for one FleetUtilization row (any mapping with its columns).
+
+    Returns {'due': 'YYYY-MM-DD', 'basis': 'hours'|'trips'|'volume'|'days',
+    'days_left', 'status': 'overdue'|'due soon'|'ok'}, or None while the
+    asset has neither been serviced nor used.
+    """
+    config = config or settings()
+    today = today or date.today()
+    start = _when(row['LastService']) or _when(row['FirstUsed'])
+    if start is None:
+        return None
+    start = start.date()
+    elapsed = max((today - start).days, config['min_rate_days'], 1)
+    candidates = []
+    if config['service_days']:
+        candidates.append((start + timedelta(days=config['service_days']), 'days'))
+    for basis, column in (('hours', 'HoursSinceService'), ('trips', 'TripsSinceService'), ('volume', 'VolumeSinceService')):
+        interval, used = config[f'service_{basis}'], row[column] or 0
+        if interval and used > 0:
+            # Reached after interval / (used / elapsed) days at the current rate.
+            candidates.append((start + timedelta(days=min(math.ceil(interval * elapsed / used), 36500)), basis))
+    if not candidates:
+        return None
+    due, basis = min(candidates)
+    days_left = (due - today).days
+    status = 'overdue' if days_left < 0 else 'due soon' if days_left <= config['due_soon_days'] else 'ok'
+    return {'due': due.isoformat(), 'basis': basis, 'days_left': days_left, 'status': status}
+
+
+@click.command('refresh-fleet')
+@click.option('--rebuild', 'full', is_flag=True, help='Recompute every counter from scratch.')
+@with_appcontext
+def refresh_fleet_command(full):
+    """Bring fleet utilization counters up to date."""
+    conn = get_db_connection()
+    try:
+        ensure_schema(conn)
+        if full:
+            rebuild(conn)
+            conn.commit()
+            click.echo('Fleet counters rebuilt.')
+        else:
+            click.echo(f'{refresh(conn)} job cards and orders recomputed.')
+    finally:
+        conn.close()
+
+
+def init_app(app):
+    app.cli.add_command(refresh_fleet_command)
@@ -0,0 +1,142 @@
+from datetime import date, timedelta
+import threading
+
+import numpy as np
+
+from locations import plant_resolver
+
+# --- Demand forecasting ---
+# Daily ordered volume per (ProductID, plant) is aggregated once into a
+# dense (series x days) matrix and fitted with an additive Holt-Winters
+# model (weekly season) that runs across all series at once. Results are
+# cached per calendar day so planning code never re-scans Orders.
+
+SEASON = 7
+HISTORY_DAYS = 730
+ALPHA = 0.3     # level smoothing
+BETA = 0.05     # trend smoothing
+GAMMA = 0.2     # seasonal smoothing
+COUNTED_STATUSES = ('Confirmed', 'Pending', 'In Production', 'Dispatched', 'Delivered', 'Completed')
+
+
+def load_daily_volume(conn, end, history_days=HISTORY_DAYS):
+    """Return (keys, start, matrix): one row of daily volume per (product, plant).
+
+    The plant is the batching plant of the order when a ProductionBatch
+    exists, else the plant serving the delivery city.
+    """
+    start = end - timedelta(days=history_days)
+    placeholders = ', '.join('?' for _ in COUNTED_STATUSES)
+    rows = conn.execute(f'''
+        SELECT o.ProductID, o.OrderDate, o.DeliverySite, SUM(o.Quantity) AS Volume,
+               (SELECT pb.PlantLocationID FROM ProductionBatch pb WHERE pb.OrderID = o.OrderID
+                ORDER BY pb.BatchID DESC LIMIT 1) AS PlantLocationID
+        FROM Orders o
+        WHERE o.OrderDate >= ? AND o.OrderDate < ? AND o.Status IN ({placeholders})
+        GROUP BY o.ProductID, o.OrderDate, o.DeliverySite, PlantLocationID
+    ''', (start.isoformat(), end.isoformat(), *COUNTED_STATUSES)).fetchall()
+
+    resolve = plant_resolver(conn)
+    keys = {}
+    series_idx, day_idx, volume = [], [], []
+    for row in rows:
+        plant = row['PlantLocationID'] or resolve(row['DeliverySite'])
+        key = (row['ProductID'], plant)
+        series_idx.append(keys.setdefault(key, len(keys)))
+        day_idx.append(str(row['OrderDate'])[:10])
+        volume.append(row['Volume'] or 0)
+
+    matrix = np.zeros((len(keys), history_days))
+    if rows:
+        days = (np.array(day_idx, dtype='datetime64[D]') - np.datetime64(start, 'D')).astype(np.int64)
+        np.add.at(matrix, (np.asarray(series_idx), days), np.asarray(volume, dtype=np.float64))
+    return list(keys), start, matrix
+
+
+def holt_winters(matrix, horizon, season=SEASON, alpha=ALPHA, beta=BETA, gamma=GAMMA):
+    """Additive Holt-Winters fitted to every row of ``matrix`` at once.
+
+    Returns (forecast, fitted) where forecast has shape (series, horizon).
+    Series shorter than two seasons fall back to a seasonal mean.
+    """
+    n_series, n_days = matrix.shape
+    if n_series == 0:
+        return np.zeros((0, horizon)), np.zeros((0, n_days))
+    if n_days < 2 * season:
+        profile = np.zeros((n_series, season))
+        if n_days:
+            profile[:, :n_days] = matrix
+        reps = int(np.ceil(horizon / season))
+        return np.tile(profile, reps)[:, :horizon], matrix.copy()
+
+    first, second = matrix[:, :season], matrix[:, season:2 * season]
+    level = first.mean(axis=1)
+    trend = (second.mean(axis=1) - level) / season
+    seasonal = first - level[:, None]
+    fitted = np.zeros_like(matrix)
+    for t in range(n_days):
+        s = t % season
+        fitted[:, t] = level + trend + seasonal[:, s]
+        y = matrix[:, t]
+        prev_level = level
+        level = alpha * (y - seasonal[:, s]) + (1 - alpha) * (level + trend)
+        trend = beta * (level - prev_level) + (1 - beta) * trend
+        seasonal[:, s] = gamma * (y - level) + (1 - gamma) * seasonal[:, s]
+
+    steps = np.arange(1, horizon + 1)
+    season_idx = (n_days + steps - 1) % season
+    forecast = level[:, None] + trend[:, None] * steps[None, :] + seasonal[:, season_idx]
+    return np.clip(forecast, 0, None), fitted
+
+
+class DemandForecaster:
+    """Per-process forecast cache, invalidated when the calendar day changes."""
+
+    def __init__(self, history_days=HISTORY_DAYS):
+        self.history_days = history_days
+        self._lock = threading.Lock()
+        self._day = None
+        self._results = {}
+
+    def forecast(self, conn, horizon=14, today=None):
+        today = today or date.today()
+        with self._lock:
+            if self._day != today:
+                self._day = today
+                self._results = {}
+            cached = self._results.get(horizon)
+            if cached is not None:
+                return cached
+            keys, _, matrix = load_daily_volume(conn, today, self.history_days)
+            forecast, fitted = holt_winters(matrix, horizon)
+            # Mean absolute error over the last eight weeks of in-sample fit.
+            recent = slice(max(matrix.shape[1] - 8 * SEASON, 0), None)
+            mae = np.abs(matrix[:, recent] - fitted[:, recent]).mean(axis=1) if matrix.size else np.zeros(len(keys))
+            result = {
+                'generated_for': today.isoformat(),
+                'horizon_days': horizon,
+                'dates': [(today + timedelta(days=d)).isoformat() for d in range(horizon)],
+                'series': [
+                    {
+                        'product_id': product_id,
+                        'plant_id': plant_id,
+                        'forecast': np.round(forecast[i], 2).tolist(),
+                        'total': round(float(forecast[i].sum()), 2),
+                        'history_total': round(float(matrix[i].sum()), 2),
+                        'mae': round(float(mae[i]), 2),
+                    }
+                    for i, (product_id, plant_id) in enumerate(keys)
+                ],
+            }
+            self._results[horizon] = result
+            return result
+
+    def for_series(self, conn, product_id=None, plant_id=None, horizon=14, today=None):
+        result = self.forecast(conn, horizon, today)
+        series = [s for s in result['series']
+                  if (product_id is None or s['product_id'] == product_id)
+                  and (plant_id is None or s['plant_id'] == plant_id)]
+        return dict(result, series=series)
+
+
+forecaster = DemandForecaster()
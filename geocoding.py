@@ -0,0 +1,210 @@
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from werkzeug.utils import import_string
+
+from db import get_db_connection
+from locations import plants
+from partitions import shared_schema
+from storage import dialect
+
+# --- Geocoding ---
+# Delivery sites are free text. Each distinct site, normalized, is looked
+# up once through the GEOCODER class and the result kept in GeoCache, so
+# planning (trip_planner.py) never waits on a geocoder for a site it has
+# seen. StubGeocoder places sites near the city they name without any
+# network access, for development and tests; NominatimGeocoder queries an
+# OpenStreetMap server. Any class with a ``name`` and a ``geocode(text)``
+# returning (lat, lon) or None can be configured instead.
+#
+# Requests never wait on the geocoder: planning reads the cache only and
+# hands the sites it misses to geocode_later(), one background thread per
+# process. `flask geocode-sites` fills the cache ahead of planning.
+
+
+def normalize_site(site):
+    return ' '.join((site or '').lower().split())
+
+
+class StubGeocoder:
+    """Offline geocoder: a fixed point within SPREAD_KM of the city named in the text, else None."""
+
+    name = 'stub'
+    CITIES = {
+        'mumbai': (19.0760, 72.8777), 'thane': (19.2183, 72.9781), 'pune': (18.5204, 73.8567),
+        'nashik': (19.9975, 73.7898), 'nagpur': (21.1458, 79.0882), 'aurangabad': (19.8762, 75.3433),
+        'delhi': (28.6139, 77.2090), 'bangalore': (12.9716, 77.5946), 'bengaluru': (12.9716, 77.5946),
+        'hyderabad': (17.3850, 78.4867), 'chennai': (13.0827, 80.2707), 'ahmedabad': (23.0225, 72.5714),
+    }
+    SPREAD_KM = 12
+
+    def __init__(self, app=None):
+        pass
+
+    def geocode(self, query):
+        words = set(re.findall(r'[a-z]+', query.lower()))
+        city = next((city for city in self.CITIES if city in words), None)
+        if city is None:
+            return None
+        lat, lon = self.CITIES[city]
+        if words == {city}:
+            return lat, lon
+        digest = hashlib.sha1(query.lower().encode('utf-8')).digest()
+        angle = digest[0] / 256 * 2 * math.pi
+        km = self.SPREAD_KM * math.sqrt(digest[1] / 255)
+        return (lat + km * math.sin(angle) / 111.32,
+                lon + km * math.cos(angle) / (111.32 * math.cos(math.radians(lat))))
+
+
+class NominatimGeocoder:
+    """OpenStreetMap Nominatim, or a compatible server at GEOCODER_URL; at most one request per second."""
+
+    name = 'nominatim'
+
+    def __init__(self, app):
+        self.url = app.config['GEOCODER_URL']
+        self.country = app.config['GEOCODER_COUNTRY']
+        self._lock = threading.Lock()
+        self._last = 0.0
+
+    def geocode(self, query):
+        with self._lock:
+            wait = self._last + 1.0 - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self._last = time.monotonic()
+        params = {'q': query, 'format': 'json', 'limit': 1}
+        if self.country:
+            params['countrycodes'] = self.country
+        request = urllib.request.Request(f'{self.url}?{urllib.parse.urlencode(params)}', headers={'User-Agent': 'rmc-erp trip planner'})
+        with urllib.request.urlopen(request, timeout=10) as response:
+            results = json.load(response)
+        return (float(results[0]['lat']), float(results[0]['lon'])) if results else None
+
+
+def geocoder(app=None):
+    """The app's GEOCODER instance, created on first use."""
+    app = app or current_app
+    instance = app.extensions.get('geocoder')
+    if instance is None:
+        instance = app.extensions['geocoder'] = import_string(app.config['GEOCODER'])(app)
+    return instance
+
+
+def ensure_schema(conn):
+    if dialect(conn).table_exists(conn, 'GeoCache'):
+        return
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {shared_schema(conn)}GeoCache (
+            Query TEXT PRIMARY KEY,
+            Latitude REAL,
+            Longitude REAL,
+            Source TEXT,
+            GeocodedAt REAL NOT NULL
+        )
+    ''')
+
+
+def coordinates(conn, queries, geocode=None, cached_only=False):
+    """{query: (lat, lon) or None}, geocoding only queries not cached yet. Commits.
+
+    A query the geocoder found nothing for is cached as None and retried
+    after GEOCODE_RETRY_DAYS; one that failed (network error) is not cached
+    and is missing from the result, as is every uncached query when
+    ``cached_only``.
+    """
+    ensure_schema(conn)
+    keys = {query: normalize_site(query) for query in queries if query and query.strip()}
+    wanted = sorted(set(keys.values()))
+    retry_before = time.time() - current_app.config['GEOCODE_RETRY_DAYS'] * 86400
+    found = {}
+    for i in range(0, len(wanted), 500):
+        batch = wanted[i:i + 500]
+        for row in conn.execute(f"SELECT Query, Latitude, Longitude, GeocodedAt FROM GeoCache WHERE Query IN ({', '.join('?' for _ in batch)})", batch):
+            if row['Latitude'] is not None:
+                found[row['Query']] = (row['Latitude'], row['Longitude'])
+            elif row['GeocodedAt'] >= retry_before:
+                found[row['Query']] = None
+    if cached_only:
+        return {query: found[key] for query, key in keys.items() if key in found}
+    geocode = geocode or geocoder()
+    rows = []
+    for key in wanted:
+        if key in found:
+            continue
+        try:
+            point = geocode.geocode(key)
+        except (OSError, ValueError, KeyError) as e:
+            current_app.logger.warning('Geocoding %r failed: %s', key, e)
+            continue
+        found[key] = point
+        rows.append((key, *(point or (None, None)), geocode.name, time.time()))
+    if rows:
+        conn.executemany('''
+            INSERT INTO GeoCache (Query, Latitude, Longitude, Source, GeocodedAt) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (Query) DO UPDATE SET Latitude = excluded.Latitude, Longitude = excluded.Longitude,
+                Source = excluded.Source, GeocodedAt = excluded.GeocodedAt
+        ''', rows)
+        conn.commit()
+    return {query: found[key] for query, key in keys.items() if key in found}
+
+
+_pending = set()
+_pending_lock = threading.Lock()
+_worker = {'thread': None}
+
+
+def geocode_later(app, queries):
+    """Queue ``queries`` for this process's background geocoding thread, starting it if idle."""
+    with _pending_lock:
+        _pending.update(query for query in queries if query and query.strip())
+        if not _pending or (_worker['thread'] is not None and _worker['thread'].is_alive()):
+            return
+
+        def run():
+            while True:
+                with _pending_lock:
+                    batch = sorted(_pending)
+                    _pending.clear()
+                    if not batch:
+                        _worker['thread'] = None
+                        return
+                try:
+                    with app.app_context():
+                        conn = get_db_connection()
+                        try:
+                            coordinates(conn, batch)
+                        finally:
+                            conn.close()
+                except Exception:
+                    app.logger.exception('Background geocoding of %d places failed', len(batch))
+
+        _worker['thread'] = threading.Thread(target=run, name='geocode-sites', daemon=True)
+        _worker['thread'].start()
+
+
+@click.command('geocode-sites')
+@with_appcontext
+def geocode_sites_command():
+    """Geocode every delivery site and plant not in GeoCache yet."""
+    conn = get_db_connection()
+    try:
+        sites = [row[0] for row in conn.execute('SELECT DISTINCT DeliverySite FROM Orders WHERE DeliverySite IS NOT NULL')]
+        places = {place for place in sites + [city for _, city in plants(conn).values()] if place.strip()}
+        points = coordinates(conn, places)
+    finally:
+        conn.close()
+    click.echo(f"{sum(point is not None for point in points.values())} of {len(places)} places have coordinates")
+
+
+def init_app(app):
+    app.cli.add_command(geocode_sites_command)
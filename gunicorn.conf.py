@@ -0,0 +1,33 @@
+import multiprocessing
+import os
+
+# --- Production launcher profile ---
+# Run with:  gunicorn -c gunicorn.conf.py wsgi:app
+# Deploying new code: the app is preloaded in the master (below), so HUP
+# only restarts workers on the old code. Either restart gunicorn, or start
+# a new master next to the old one and then retire the old one:
+#   kill -USR2 <master pid>; kill -WINCH <old master pid>; kill -QUIT <old master pid>
+# HUP still reloads this file's settings.
+
+bind = os.environ.get('RMC_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('RMC_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'sync'
+threads = int(os.environ.get('RMC_THREADS', 1))
+
+# Import the app once in the master so workers fork with modules, templates
+# and config already loaded. The app opens no database connections at import
+# time, so nothing is shared across the fork. The trade-off is that code
+# changes need a new master (see above), not just new workers.
+preload_app = True
+
+# Recycle workers periodically to cap memory growth; jitter avoids all
+# workers restarting at once.
+max_requests = int(os.environ.get('RMC_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('RMC_MAX_REQUESTS_JITTER', 100))
+
+timeout = int(os.environ.get('RMC_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('RMC_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+
+accesslog = os.environ.get('RMC_ACCESS_LOG', '-')
+errorlog = os.environ.get('RMC_ERROR_LOG', '-')
@@ -0,0 +1,201 @@
+from collections import OrderedDict
+from functools import wraps
+import gzip
+import hashlib
+import os
+import threading
+import time
+import zlib
+
+from flask import current_app, make_response, request, session, url_for
+
+import query_cache
+from db import get_db_connection
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only without the brotli package
+    brotli = None
+
+# --- HTTP caching and compression ---
+# Views decorated with @conditional(tables...) get a weak ETag built from
+# the TableVersions of the tables they read (bumped by triggers on every
+# write, see query_cache), the request URL and the user. A request whose
+# If-None-Match still matches is answered 304 after that one version
+# lookup, without running the view. Pages showing flashed messages are
+# always rendered, since rendering consumes them.
+#
+# Text responses (HTML, JSON, CSS, JS) are compressed with brotli when the
+# client accepts it and the package is installed, gzip otherwise; streamed
+# pages are compressed chunk by chunk so they still flush early.
+#
+# static_url() adds a content hash to static file URLs; those responses
+# are cacheable for a year, since a changed file gets a new URL.
+
+COMPRESSIBLE_TYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript',
+    'application/javascript', 'application/json', 'image/svg+xml',
+}
+MAX_STATIC_COMPRESS = 1024 * 1024
+STATIC_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+_fingerprints = {}
+_compressed_static = OrderedDict()
+_lock = threading.Lock()
+
+
+# --- Conditional GET ---
+
+def _etag(versions):
+    key = '\0'.join(map(str, (
+        current_app.config['HTTP_CACHE_SALT'], request.full_path,
+        session.get('user_id'), session.get('role'), session.get('employee_id'), versions,
+    )))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def conditional(*tables):
+    """Answer GETs with 304 while none of ``tables`` has changed; list every table the view reads."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+                return view(*args, **kwargs)
+            conn = get_db_connection()
+            try:
+                versions = query_cache.table_versions(conn, tables)
+            finally:
+                conn.close()
+            etag = _etag(versions)
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            response.vary.add('Cookie')
+            return response
+        return wrapper
+    return decorator
+
+
+# --- Static fingerprints ---
+
+def static_url(filename):
+    """URL of a static file with a content hash, served with a one-year cache lifetime."""
+    path = os.path.join(current_app.static_folder, filename)
+    mtime = os.path.getmtime(path)
+    cached = _fingerprints.get(filename)
+    if cached is None or cached[0] != mtime:
+        with open(path, 'rb') as f:
+            cached = (mtime, hashlib.sha256(f.read()).hexdigest()[:12])
+        _fingerprints[filename] = cached
+    return url_for('static', filename=filename, v=cached[1])
+
+
+# --- Compression ---
+
+def _encoding():
+    if brotli is not None and request.accept_encodings['br']:
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def _compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+
+def _compress_stream(chunks, encoding):
+    """Compress an iterable of chunks, flushing after each so nothing waits for the end."""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=5)
+        process, flush = compressor.process, compressor.flush
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        process, flush = compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = process(chunk) + flush()
+            if data:
+                yield data
+        yield compressor.finish() if encoding == 'br' else compressor.flush(zlib.Z_FINISH)
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+def _static_bytes(response, encoding):
+    """Compressed body of a static file response, cached by path, ETag and encoding."""
+    key = (request.path, response.get_etag()[0], encoding)
+    with _lock:
+        data = _compressed_static.get(key)
+        if data is not None:
+            _compressed_static.move_to_end(key)
+            return data
+    data = _compress(b''.join(response.response), encoding)
+    with _lock:
+        _compressed_static[key] = data
+        while len(_compressed_static) > 64:
+            _compressed_static.popitem(last=False)
+    return data
+
+
+def compress_response(response):
+    config = current_app.config
+    if not config['HTTP_COMPRESSION'] or request.method == 'HEAD':
+        return response
+    if not (200 <= response.status_code < 300) or response.status_code in (204, 206):
+        return response
+    if response.mimetype not in COMPRESSIBLE_TYPES or 'Content-Encoding' in response.headers:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = _encoding()
+    if encoding is None:
+        return response
+
+    if response.direct_passthrough:
+        # send_file(): only static assets, which are small and read often.
+        if request.endpoint != 'static' or not response.content_length or response.content_length > MAX_STATIC_COMPRESS:
+            return response
+        data = _static_bytes(response, encoding)
+        response.close()
+        response.direct_passthrough = False
+        response.set_data(data)
+    elif response.is_streamed:
+        response.response = _compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < config['HTTP_COMPRESS_MIN_SIZE']:
+            return response
+        response.set_data(_compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        # The compressed bytes differ from the identity representation.
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def static_cache_headers(response):
+    if request.endpoint == 'static' and request.args.get('v') and response.status_code in (200, 304):
+        response.headers['Cache-Control'] = STATIC_CACHE_CONTROL
+    return response
+
+
+def init_app(app):
+    if app.config['HTTP_CACHE_SALT'] is None:
+        # Pages change with each deploy; preloaded workers share the salt.
+        app.config['HTTP_CACHE_SALT'] = str(time.time())
+    app.jinja_env.globals['static_url'] = static_url
+    app.after_request(static_cache_headers)
+    app.after_request(compress_response)
@@ -0,0 +1,35 @@
+import re
+
+from storage import dialect
+
+# --- Plant lookup ---
+# Orders only carry a free-text DeliverySite; the serving plant is the
+# Locations row whose name ends with the same city.
+
+UNASSIGNED_PLANT = 0
+
+
+def plants(conn):
+    """{LocationID: (LocationName, city)} of the locations whose name contains 'Plant'."""
+    return {row['LocationID']: (row['LocationName'], row['LocationName'].rsplit('-', 1)[-1].strip())
+            for row in conn.execute(f"SELECT LocationID, LocationName FROM Locations WHERE LocationName {dialect(conn).like} '%Plant%'")}
+
+
+def plant_resolver(conn):
+    """Map a DeliverySite to a plant LocationID by the city named in both.
+
+    'Construction Site A, Mumbai' resolves to 'Main Plant - Mumbai'. Only
+    locations whose name contains 'Plant' are considered.
+    """
+    cities = {}
+    for location_id, (_, city) in plants(conn).items():
+        if city:
+            cities[city.lower()] = location_id
+
+    def resolve(site):
+        words = set(re.findall(r'[a-z]+', (site or '').lower()))
+        for city, location_id in cities.items():
+            if city in words:
+                return location_id
+        return UNASSIGNED_PLANT
+    return resolve
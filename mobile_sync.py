@@ -0,0 +1,217 @@
+from datetime import datetime
+
+import json
+
+import change_log
+import outbox
+from db import log_job_progress
+from storage import dialect
+
+# --- Mobile delta sync ---
+# The sync token is a ChangeLog ChangeID: change_log assigns IDs in commit
+# order on every write to the tracked tables, so "rows changed since token"
+# is a primary-key range scan. A client without a token gets the full set
+# of its own job cards, their assignments and orders, plus the current
+# token; afterwards it pulls pages of changes. A page holds the current row
+# of every changed entity in scope and the IDs of those the client held
+# that were deleted or left its scope, judged by the old values in the
+# ChangeLog diff. Changes to anything else are not sent at all. Job cards
+# bring their order along and assignments their job card, so newly
+# assigned work arrives complete.
+#
+# On PostgreSQL ChangeIDs can commit out of order, so the token stays
+# behind changes younger than change_log.SETTLE_SECONDS; they are sent
+# again on the next pull, which clients apply like any other current row.
+#
+# Progress updates recorded offline are uploaded in batches. Each carries a
+# client-generated key, and keys already seen are acknowledged without
+# being applied again, so a retried upload is harmless. Updates to job
+# cards outside the uploader's scope are rejected.
+
+SYNC_TABLES = ('Orders', 'JobCards', 'JobAssignments')
+MAX_UPLOAD_BATCH = 500
+
+
+def ensure_schema(conn):
+    change_log.ensure_schema(conn)
+    # Receipts are written in the same transaction as the job card, so on a
+    # plant connection they live in the plant's file.
+    if getattr(conn, 'plant_id', None) is not None:
+        if conn.execute("SELECT 1 FROM main.sqlite_master WHERE type = 'table' AND name = 'SyncReceipts'").fetchone():
+            return
+        schema = 'main.'
+    elif dialect(conn).table_exists(conn, 'SyncReceipts'):
+        return
+    else:
+        schema = ''
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {schema}SyncReceipts (
+            ClientKey TEXT PRIMARY KEY,
+            EmployeeID INTEGER,
+            LogID INTEGER,
+            ReceivedAt TEXT NOT NULL
+        )
+    ''')
+
+
+def current_token(conn):
+    return conn.execute('SELECT COALESCE(MAX(ChangeID), 0) FROM ChangeLog').fetchone()[0]
+
+
+class _Scope:
+    """The job cards an employee works on, and their orders."""
+
+    def __init__(self, conn, employee_id):
+        self.jobs = {row[0]: row[1] for row in conn.execute('''
+            SELECT JobCardID, RelatedOrderID FROM JobCards WHERE AssignedTo = ?
+            UNION
+            SELECT jc.JobCardID, jc.RelatedOrderID FROM JobCards jc
+            JOIN JobAssignments ja ON ja.JobCardID = jc.JobCardID
+            WHERE ja.AssignedEmployeeID = ?
+        ''', (employee_id, employee_id))}
+        self.orders = {order_id for order_id in self.jobs.values() if order_id is not None}
+        self.employee_id = employee_id
+        self.assigned = {row[0] for row in conn.execute('SELECT JobCardID FROM JobAssignments WHERE AssignedEmployeeID = ?', (employee_id,))}
+
+    def contains(self, table, row):
+        if table in ('JobCards', 'JobAssignments'):
+            return row['JobCardID'] in self.jobs
+        return row['OrderID'] in self.orders
+
+    def held(self, table, entity_id, was):
+        """Whether the client held an entity now gone or out of scope; ``was(column)`` is its old value."""
+        if table == 'JobAssignments':
+            return was('AssignedEmployeeID') == self.employee_id or was('JobCardID') in self.jobs
+        if table == 'JobCards':
+            return was('AssignedTo') == self.employee_id or entity_id in self.assigned
+        return entity_id in self.orders
+
+
+class _Payload:
+    def __init__(self):
+        self.tables = {}
+        self.deleted = {}
+        self._seen = set()
+
+    def add(self, table, row):
+        entity_id = row[change_log.TRACKED[table]]
+        if (table, entity_id) in self._seen:
+            return
+        self._seen.add((table, entity_id))
+        block = self.tables.setdefault(table, {'columns': list(row.keys()), 'rows': []})
+        block['rows'].append(list(row))
+
+    def delete(self, table, entity_id):
+        if (table, entity_id) not in self._seen:
+            self._seen.add((table, entity_id))
+            self.deleted.setdefault(table, []).append(entity_id)
+
+    def as_dict(self, token, full, has_more):
+        return {'token': str(token), 'full': full, 'has_more': has_more, 'tables': self.tables, 'deleted': self.deleted}
+
+
+def employee_scope(conn, employee_id):
+    """The job cards (``.jobs``) and orders (``.orders``) ``employee_id`` may sync and update."""
+    return _Scope(conn, employee_id)
+
+
+def _add_with_parents(conn, payload, table, row):
+    payload.add(table, row)
+    if table == 'JobAssignments':
+        job = change_log.fetch(conn, 'JobCards', row['JobCardID'])
+        if job is not None:
+            _add_with_parents(conn, payload, 'JobCards', job)
+    elif table == 'JobCards' and row['RelatedOrderID'] is not None:
+        order = change_log.fetch(conn, 'Orders', row['RelatedOrderID'])
+        if order is not None:
+            payload.add('Orders', order)
+
+
+def _drop_job(payload, scope, job_id, order_id):
+    """Delete a job card that left the scope, and its order unless another job still holds it."""
+    if job_id is None or job_id in scope.jobs:
+        return
+    payload.delete('JobCards', job_id)
+    if order_id is not None and order_id not in scope.orders:
+        payload.delete('Orders', order_id)
+
+
+def pull(conn, employee_id, token=None, page_size=500):
+    """Sync payload for ``employee_id``: everything when ``token`` is None, else changes after it."""
+    ensure_schema(conn)
+    scope = _Scope(conn, employee_id)
+    payload = _Payload()
+    if token is None:
+        # Read the token first: a change committed meanwhile is sent again
+        # on the next pull rather than missed.
+        token = current_token(conn)
+        if scope.jobs:
+            placeholders = ', '.join('?' for _ in scope.jobs)
+            for job in conn.execute(f'SELECT * FROM JobCards WHERE JobCardID IN ({placeholders}) ORDER BY JobCardID', list(scope.jobs)):
+                _add_with_parents(conn, payload, 'JobCards', job)
+            for assignment in conn.execute(f'SELECT * FROM JobAssignments WHERE JobCardID IN ({placeholders}) ORDER BY AssignmentID', list(scope.jobs)):
+                payload.add('JobAssignments', assignment)
+        return payload.as_dict(token, True, False)
+
+    placeholders = ', '.join('?' for _ in SYNC_TABLES)
+    changes = conn.execute(f'''
+        SELECT ChangeID, EntityType, EntityID, ChangedAt, Diff FROM ChangeLog
+        WHERE ChangeID > ? AND EntityType IN ({placeholders})
+        ORDER BY ChangeID LIMIT ?
+    ''', (int(token), *SYNC_TABLES, page_size)).fetchall()
+    # Each changed entity is sent once, as its current row.
+    for change in changes:
+        table, entity_id = change['EntityType'], change['EntityID']
+        row = change_log.fetch(conn, table, entity_id)
+        if row is not None and scope.contains(table, row):
+            _add_with_parents(conn, payload, table, row)
+            continue
+        diff = json.loads(change['Diff'])
+
+        def was(column):
+            if column in diff:
+                return diff[column][0]
+            return row[column] if row is not None else None
+
+        if not scope.held(table, entity_id, was):
+            continue
+        if table == 'JobCards':
+            _drop_job(payload, scope, entity_id, was('RelatedOrderID'))
+            continue
+        payload.delete(table, entity_id)
+        if table == 'JobAssignments':
+            job = change_log.fetch(conn, 'JobCards', was('JobCardID')) if was('JobCardID') is not None else None
+            _drop_job(payload, scope, was('JobCardID'), job['RelatedOrderID'] if job is not None else None)
+    next_token = change_log.settled_mark(conn, changes, int(token))
+    # A full page the token cannot move past yet is not worth re-pulling at once.
+    return payload.as_dict(next_token, False, len(changes) == page_size and next_token > int(token))
+
+
+def apply_progress(conn, employee_id, user_id, update, scope=None):
+    """Apply one uploaded progress update; returns its result entry. Does not commit.
+
+    ``update`` holds ``key`` (client-generated, unique), ``job_id``,
+    ``status`` and optionally ``notes`` and ``time`` (ISO, when recorded).
+    Job cards outside ``scope`` (the employee's, read from ``conn`` when
+    None) are rejected as 'forbidden'. ``log_id`` is None while the
+    progress entry is queued on a plant connection.
+    """
+    key = str(update['key'])
+    receipt = conn.execute('SELECT LogID FROM SyncReceipts WHERE ClientKey = ?', (key,)).fetchone()
+    if receipt is not None:
+        return {'key': key, 'result': 'duplicate', 'log_id': receipt['LogID']}
+    job_id = int(update['job_id'])
+    before = change_log.fetch(conn, 'JobCards', job_id)
+    if before is None:
+        return {'key': key, 'result': 'missing'}
+    if job_id not in (scope or _Scope(conn, employee_id)).jobs:
+        return {'key': key, 'result': 'forbidden'}
+    status = update['status']
+    conn.execute('UPDATE JobCards SET Status = ? WHERE JobCardID = ?', (status, job_id))
+    log_id = log_job_progress(conn, job_id, employee_id, update.get('time') or datetime.now(), status, update.get('notes', ''))
+    change_log.record(conn, 'JobCards', job_id, before, change_log.fetch(conn, 'JobCards', job_id), user_id)
+    outbox.publish(conn, 'JobStatusChanged', f"Job card #{job_id} is {status}", order_id=before['RelatedOrderID'], job_card_id=job_id,
+                   data={'JobCardID': job_id, 'Status': status, 'Notes': update.get('notes', '')})
+    conn.execute('INSERT INTO SyncReceipts (ClientKey, EmployeeID, LogID, ReceivedAt) VALUES (?, ?, ?, ?)',
+                 (key, employee_id, log_id, datetime.now().isoformat()))
+    return {'key': key, 'result': 'applied', 'log_id': log_id}
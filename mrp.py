@@ -0,0 +1,192 @@
+from datetime import date, timedelta
+from functools import lru_cache
+import re
+
+import numpy as np
+
+# --- Material requirements planning ---
+# Turns Products.MixDesign into per-m³ material coefficients and projects
+# how scheduled Orders draw down Inventory.CurrentStock day by day.
+
+# Materials planned for, with the keywords used to find them in Inventory.
+MATERIALS = ('Cement', 'Sand', 'Aggregate', 'Water', 'Admixture')
+MATERIAL_KEYWORDS = {
+    'Cement': ('cement',),
+    'Sand': ('sand',),
+    'Aggregate': ('aggregate', 'gravel'),
+    'Water': ('water',),
+    'Admixture': ('admixture',),
+}
+
+# Nominal-mix constants: 1 m³ of wet concrete needs ~1.54 m³ of dry material.
+DRY_VOLUME_FACTOR = 1.54
+BULK_DENSITY = {'Cement': 1440.0, 'Sand': 1600.0, 'Aggregate': 1500.0}   # kg/m³
+WATER_CEMENT_RATIO = 0.5        # litres per kg of cement
+ADMIXTURE_PER_KG_CEMENT = 0.008  # litres per kg of cement
+DEFAULT_MORTAR_RATIO = (1.0, 4.0, 0.0)
+
+OPEN_ORDER_STATUSES = ('Confirmed', 'Pending', 'In Production')
+
+_RATIO_RE = re.compile(r'(\d+(?:\.\d+)?)\s*:\s*(\d+(?:\.\d+)?)(?:\s*:\s*(\d+(?:\.\d+)?))?')
+
+
+@lru_cache(maxsize=256)
+def parse_mix_design(mix_design):
+    """Return per-m³ coefficients for ``MATERIALS`` from a MixDesign string.
+
+    Understands nominal ratios such as ``'M20 - 1:1.5:3'`` (cement:sand:
+    aggregate); a mortar mix without a ratio uses 1:4 cement:sand.
+    Unrecognised designs yield zeros.
+    """
+    text = (mix_design or '').strip()
+    match = _RATIO_RE.search(text)
+    if match:
+        ratio = tuple(float(part) if part else 0.0 for part in match.groups())
+    elif 'mortar' in text.lower():
+        ratio = DEFAULT_MORTAR_RATIO
+    else:
+        return (0.0,) * len(MATERIALS)
+
+    cement_part, sand_part, aggregate_part = ratio
+    total = cement_part + sand_part + aggregate_part
+    if total <= 0:
+        return (0.0,) * len(MATERIALS)
+    per_part = DRY_VOLUME_FACTOR / total
+    cement = per_part * cement_part * BULK_DENSITY['Cement']
+    sand = per_part * sand_part * BULK_DENSITY['Sand']
+    aggregate = per_part * aggregate_part * BULK_DENSITY['Aggregate']
+    water = cement * WATER_CEMENT_RATIO
+    admixture = cement * ADMIXTURE_PER_KG_CEMENT
+    return (cement, sand, aggregate, water, admixture)
+
+
+def material_for_inventory_name(name):
+    words = set(re.findall(r'[a-z]+', (name or '').lower()))
+    for material, keywords in MATERIAL_KEYWORDS.items():
+        if words.intersection(keywords):
+            return material
+    return None
+
+
+def load_stock(conn):
+    """Current stock per planned material, summed over matching Inventory rows."""
+    stock = np.zeros(len(MATERIALS))
+    units = [''] * len(MATERIALS)
+    for row in conn.execute('SELECT MaterialName, CurrentStock, Unit FROM Inventory'):
+        material = material_for_inventory_name(row['MaterialName'])
+        if material is None:
+            continue
+        idx = MATERIALS.index(material)
+        stock[idx] += row['CurrentStock'] or 0
+        units[idx] = units[idx] or (row['Unit'] or '')
+    return stock, units
+
+
+def load_scheduled_orders(conn, start, end):
+    # Plant comes from the order's production batch when one exists;
+    # orders not yet batched are planned as 'Unassigned'.
+    placeholders = ', '.join('?' for _ in OPEN_ORDER_STATUSES)
+    return conn.execute(f'''
+        SELECT o.OrderID, o.ProductID, o.Quantity, o.ScheduledDate, p.MixDesign,
+               (SELECT pb.PlantLocationID FROM ProductionBatch pb WHERE pb.OrderID = o.OrderID
+                ORDER BY pb.BatchID DESC LIMIT 1) AS PlantLocationID
+        FROM Orders o
+        JOIN Products p ON o.ProductID = p.ProductID
+        WHERE o.Status IN ({placeholders}) AND o.ScheduledDate >= ? AND o.ScheduledDate < ?
+    ''', (*OPEN_ORDER_STATUSES, start.isoformat(), end.isoformat())).fetchall()
+
+
+def project_requirements(orders, stock, start, horizon_days, plants=None):
+    """Vectorised demand and stock projection.
+
+    ``orders`` is an iterable of mappings with ScheduledDate, Quantity,
+    MixDesign and PlantLocationID. Returns a dict with:
+
+    - ``plants``: plant ids along axis 0 of ``demand``
+    - ``demand``: array (plants, days, materials) of daily consumption
+    - ``projected_stock``: array (days, materials) of end-of-day stock
+    - ``shortage``: array (days, materials), positive where stock runs out
+    """
+    rows = list(orders)
+    n = len(rows)
+    scheduled = np.array([str(row['ScheduledDate'])[:10] for row in rows], dtype='datetime64[D]')
+    day_idx = (scheduled - np.datetime64(start, 'D')).astype(np.int64)
+    qty = np.fromiter((row['Quantity'] or 0 for row in rows), dtype=np.float64, count=n)
+
+    # One coefficient row per distinct mix design, gathered per order.
+    designs = {}
+    design_idx = np.fromiter((designs.setdefault(row['MixDesign'], len(designs)) for row in rows), dtype=np.int64, count=n)
+    coef_table = np.array([parse_mix_design(design) for design in designs], dtype=np.float64).reshape(-1, len(MATERIALS))
+    coef = coef_table[design_idx]
+    plant_keys = [row['PlantLocationID'] for row in rows]
+
+    plants = list(plants) if plants is not None else sorted(set(plant_keys), key=lambda p: (p is None, p or 0))
+    plant_lookup = {plant: i for i, plant in enumerate(plants)}
+    plant_idx = np.fromiter((plant_lookup.get(p, -1) for p in plant_keys), dtype=np.int64, count=n)
+
+    keep = (day_idx >= 0) & (day_idx < horizon_days) & (plant_idx >= 0)
+    demand = np.zeros((len(plants), horizon_days, len(MATERIALS)))
+    np.add.at(demand, (plant_idx[keep], day_idx[keep]), qty[keep, None] * coef[keep])
+
+    projected = np.asarray(stock, dtype=np.float64) - np.cumsum(demand.sum(axis=0), axis=0)
+    return {
+        'plants': plants,
+        'demand': demand,
+        'projected_stock': projected,
+        'shortage': np.clip(-projected, 0, None),
+    }
+
+
+def build_projection(conn, horizon_days=90, today=None):
+    """Load orders and stock and return a JSON-friendly shortage projection."""
+    start = today or date.today()
+    end = start + timedelta(days=horizon_days)
+    stock, units = load_stock(conn)
+    orders = load_scheduled_orders(conn, start, end)
+    result = project_requirements(orders, stock, start, horizon_days)
+
+    plant_names = {row['LocationID']: row['LocationName'] for row in conn.execute('SELECT LocationID, LocationName FROM Locations')}
+    days = [(start + timedelta(days=d)).isoformat() for d in range(horizon_days)]
+    projected = result['projected_stock']
+    shortage = result['shortage']
+
+    materials = []
+    for m, material in enumerate(MATERIALS):
+        short_days = np.flatnonzero(shortage[:, m] > 0)
+        materials.append({
+            'material': material,
+            'unit': units[m],
+            'current_stock': round(float(stock[m]), 2),
+            'required': round(float(result['demand'][:, :, m].sum()), 2),
+            'first_shortage_date': days[short_days[0]] if short_days.size else None,
+            'max_shortage': round(float(shortage[:, m].max()), 2) if horizon_days else 0.0,
+            'per_plant': {
+                plant_names.get(plant, 'Unassigned'): round(float(result['demand'][p, :, m].sum()), 2)
+                for p, plant in enumerate(result['plants'])
+            },
+        })
+
+    daily = []
+    for d in range(horizon_days):
+        if not result['demand'][:, d, :].any():
+            continue
+        daily.append({
+            'date': days[d],
+            'plants': {
+                plant_names.get(plant, 'Unassigned'): {
+                    material: round(float(result['demand'][p, d, m]), 2)
+                    for m, material in enumerate(MATERIALS) if result['demand'][p, d, m]
+                }
+                for p, plant in enumerate(result['plants']) if result['demand'][p, d, :].any()
+            },
+            'projected_stock': {material: round(float(projected[d, m]), 2) for m, material in enumerate(MATERIALS)},
+            'shortage': {material: round(float(shortage[d, m]), 2) for m, material in enumerate(MATERIALS) if shortage[d, m]},
+        })
+
+    return {
+        'start': start.isoformat(),
+        'horizon_days': horizon_days,
+        'order_count': len(orders),
+        'materials': materials,
+        'daily': daily,
+    }
@@ -0,0 +1,427 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hashlib
+import hmac
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from partitions import bookkeeping, shared_schema
+from storage import dialect
+
+# --- Integration outbox ---
+# Write routes call publish() inside their own transaction: it appends the
+# IntegrationEvents row and one EventDeliveries row per endpoint in
+# INTEGRATION_ENDPOINTS that subscribes to the event type, so an event is
+# queued exactly when the change that caused it commits.
+#
+# `flask deliver-events` runs the dispatcher: each endpoint gets its own
+# pool of `concurrency` worker threads, which caps the requests in flight
+# to it. A worker claims up to `batch_size` due deliveries (leasing them
+# for LEASE_SECONDS, so rows of a crashed dispatcher come back), POSTs them
+# as one JSON batch without holding a connection open, and records the
+# outcome:
+#
+#   2xx                      delivered
+#   408, 425, 429, 5xx,      retried after an exponential backoff with
+#   network errors           jitter (or the receiver's Retry-After), until
+#                            INTEGRATION_MAX_ATTEMPTS
+#   other 4xx, max attempts  dead, until retried from the integration page
+#
+# Delivery is at least once; receivers deduplicate on the event id.
+# stats() reports backlog and lag per endpoint, and `flask
+# integration-stub` runs a local receiver to deliver against.
+
+PENDING, DELIVERED, DEAD = 'pending', 'delivered', 'dead'
+LEASE_SECONDS = 120
+ENDPOINT_DEFAULTS = {'events': '*', 'token': None, 'secret': None, 'concurrency': 2, 'batch_size': 50, 'timeout': 10}
+
+
+def endpoints(app=None):
+    """INTEGRATION_ENDPOINTS with defaults filled in: {name: settings}."""
+    app = app or current_app
+    return {name: {**ENDPOINT_DEFAULTS, **settings} for name, settings in app.config['INTEGRATION_ENDPOINTS'].items()}
+
+
+def ensure_schema(conn):
+    if dialect(conn).table_exists(conn, 'EventDeliveries'):
+        return
+    schema = shared_schema(conn)
+    columns = [name.lower() for name, *_ in conn.execute('SELECT * FROM IntegrationEvents LIMIT 0').description]
+    if 'payload' not in columns:
+        conn.execute(f'ALTER TABLE {schema}IntegrationEvents ADD COLUMN Payload TEXT')
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {schema}EventDeliveries (
+            DeliveryID INTEGER PRIMARY KEY AUTOINCREMENT,
+            EventID INTEGER NOT NULL,
+            Endpoint TEXT NOT NULL,
+            Status TEXT NOT NULL DEFAULT 'pending',
+            Attempts INTEGER NOT NULL DEFAULT 0,
+            NextAttemptAt REAL NOT NULL,
+            ClaimToken TEXT,
+            CreatedAt REAL NOT NULL,
+            DeliveredAt REAL,
+            LastError TEXT
+        )
+    ''')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS {schema}idx_eventdeliveries_due ON EventDeliveries(Endpoint, Status, NextAttemptAt)')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS {schema}idx_eventdeliveries_event ON EventDeliveries(EventID)')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS {schema}idx_eventdeliveries_claim ON EventDeliveries(ClaimToken)')
+
+
+def _iso(epoch):
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(epoch))
+
+
+def _subscribes(settings, event_type):
+    return settings['events'] == '*' or event_type in settings['events']
+
+
+@bookkeeping
+def publish(conn, event_type, details='', order_id=None, job_card_id=None, data=None):
+    """Append an event and queue it for every subscribed endpoint; returns its EventID.
+
+    Runs in the caller's transaction and does not commit. On a plant
+    connection the event is published when the partition is merged
+    (partitions.merge) and None is returned.
+    """
+    ensure_schema(conn)
+    now = time.time()
+    cursor = conn.cursor()
+    cursor.execute('INSERT INTO IntegrationEvents (RelatedOrderID, JobCardID, EventType, EventTime, Details, Payload) VALUES (?, ?, ?, ?, ?, ?)',
+                   (order_id, job_card_id, event_type, _iso(now), details,
+                    None if data is None else json.dumps(data, default=str, separators=(',', ':'))))
+    event_id = cursor.lastrowid
+    targets = [name for name, settings in endpoints().items() if _subscribes(settings, event_type)]
+    conn.executemany('INSERT INTO EventDeliveries (EventID, Endpoint, NextAttemptAt, CreatedAt) VALUES (?, ?, ?, ?)',
+                     [(event_id, name, now, now) for name in targets])
+    return event_id
+
+
+def _row_payload(row):
+    return {
+        'id': row['EventID'], 'type': row['EventType'], 'time': str(row['EventTime']),
+        'order_id': row['RelatedOrderID'], 'job_card_id': row['JobCardID'], 'details': row['Details'],
+        'data': json.loads(row['Payload']) if row['Payload'] else None,
+    }
+
+
+# --- Delivery state ---
+
+def claim(conn, endpoint, limit, lease=LEASE_SECONDS):
+    """Lease up to ``limit`` due deliveries to ``endpoint``. Commits.
+
+    Returns the lease's claim token and [(DeliveryID, Attempts, event
+    payload)]; the outcome is recorded under that token.
+    """
+    now = time.time()
+    token = uuid.uuid4().hex
+    # The outer NextAttemptAt test is re-checked on rows another dispatcher
+    # claimed meanwhile, so no delivery is leased twice.
+    conn.execute('''
+        UPDATE EventDeliveries SET ClaimToken = ?, NextAttemptAt = ?
+        WHERE Status = 'pending' AND NextAttemptAt <= ? AND DeliveryID IN (
+            SELECT DeliveryID FROM EventDeliveries
+            WHERE Endpoint = ? AND Status = 'pending' AND NextAttemptAt <= ?
+            ORDER BY NextAttemptAt, DeliveryID LIMIT ?)
+    ''', (token, now + lease, now, endpoint, now, limit))
+    rows = conn.execute('''
+        SELECT d.DeliveryID, d.Attempts, e.* FROM EventDeliveries d
+        JOIN IntegrationEvents e ON e.EventID = d.EventID
+        WHERE d.ClaimToken = ? ORDER BY d.EventID
+    ''', (token,)).fetchall()
+    conn.commit()
+    return token, [(row['DeliveryID'], row['Attempts'], _row_payload(row)) for row in rows]
+
+
+def backoff(attempts, base, cap):
+    """Seconds before retry number ``attempts``: exponential with full jitter."""
+    return random.uniform(0, min(cap, base * 2 ** (attempts - 1)))
+
+
+# Both record the outcome only on rows still leased under ``token``: once a
+# lease expires and another dispatcher claims the row, the late result of
+# the first attempt must not overwrite the second. They return the number
+# of rows recorded.
+
+def record_success(conn, token, delivery_ids):
+    now = time.time()
+    delivery_ids = list(delivery_ids)
+    if not delivery_ids:
+        return 0
+    return conn.execute(f"""
+        UPDATE EventDeliveries SET Status = 'delivered', Attempts = Attempts + 1, DeliveredAt = ?, LastError = NULL, ClaimToken = NULL
+        WHERE ClaimToken = ? AND DeliveryID IN ({', '.join('?' for _ in delivery_ids)})
+    """, (now, token, *delivery_ids)).rowcount
+
+
+def record_failure(conn, token, claimed, error, permanent=False, retry_after=None, max_attempts=10, base=2.0, cap=600.0):
+    """Reschedule the ``(DeliveryID, Attempts, ...)`` entries of a failed batch, or mark them dead."""
+    now = time.time()
+    rows = []
+    for delivery_id, attempts, _ in claimed:
+        attempts += 1
+        dead = permanent or attempts >= max_attempts
+        delay = retry_after if retry_after is not None else backoff(attempts, base, cap)
+        rows.append((DEAD if dead else PENDING, attempts, now + delay, str(error)[:500], delivery_id, token))
+    # One statement per row: executemany() has no reliable total rowcount.
+    return sum(conn.execute('UPDATE EventDeliveries SET Status = ?, Attempts = ?, NextAttemptAt = ?, LastError = ?, ClaimToken = NULL WHERE DeliveryID = ? AND ClaimToken = ?', row).rowcount
+               for row in rows)
+
+
+def retry_dead(conn, endpoint=None):
+    """Put dead deliveries back in the queue; returns how many. Does not commit."""
+    ensure_schema(conn)
+    sql = "UPDATE EventDeliveries SET Status = 'pending', Attempts = 0, NextAttemptAt = ? WHERE Status = 'dead'"
+    params = [time.time()]
+    if endpoint:
+        sql += ' AND Endpoint = ?'
+        params.append(endpoint)
+    return conn.execute(sql, params).rowcount
+
+
+def stats(conn):
+    """Per endpoint: counts by status, age of the oldest pending delivery and the last hour's latency."""
+    ensure_schema(conn)
+    now = time.time()
+    result = {}
+    for row in conn.execute('''
+        SELECT Endpoint, Status, COUNT(*) AS Count, MIN(CreatedAt) AS Oldest, MAX(DeliveredAt) AS LastDelivered
+        FROM EventDeliveries GROUP BY Endpoint, Status
+    '''):
+        entry = result.setdefault(row['Endpoint'], {PENDING: 0, DELIVERED: 0, DEAD: 0, 'lag_seconds': 0.0, 'last_delivered': None, 'avg_latency_seconds': None})
+        entry[row['Status']] = row['Count']
+        if row['Status'] == PENDING:
+            entry['lag_seconds'] = max(entry['lag_seconds'], round(now - row['Oldest'], 1))
+        elif row['LastDelivered']:
+            entry['last_delivered'] = _iso(row['LastDelivered'])
+    for row in conn.execute('''
+        SELECT Endpoint, AVG(DeliveredAt - CreatedAt) AS Latency FROM EventDeliveries
+        WHERE Status = 'delivered' AND DeliveredAt >= ? GROUP BY Endpoint
+    ''', (now - 3600,)):
+        result[row['Endpoint']]['avg_latency_seconds'] = round(row['Latency'], 3)
+    return result
+
+
+# --- Dispatcher ---
+
+class DeliveryError(Exception):
+    def __init__(self, message, permanent=False, retry_after=None):
+        super().__init__(message)
+        self.permanent = permanent
+        self.retry_after = retry_after
+
+
+def _retry_after(headers):
+    try:
+        return max(float(headers.get('Retry-After')), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def send(name, settings, events):
+    """POST one batch to an endpoint; raises DeliveryError on failure."""
+    body = json.dumps({'endpoint': name, 'events': events}, default=str, separators=(',', ':')).encode('utf-8')
+    request = urllib.request.Request(settings['url'], data=body, method='POST', headers={'Content-Type': 'application/json'})
+    if settings['token']:
+        request.add_header('Authorization', f"Bearer {settings['token']}")
+    if settings['secret']:
+        signature = hmac.new(settings['secret'].encode('utf-8'), body, hashlib.sha256).hexdigest()
+        request.add_header('X-RMC-Signature', f'sha256={signature}')
+    try:
+        with urllib.request.urlopen(request, timeout=settings['timeout']) as response:
+            response.read()
+    except urllib.error.HTTPError as e:
+        permanent = 400 <= e.code < 500 and e.code not in (408, 425, 429)
+        raise DeliveryError(f'HTTP {e.code}', permanent, _retry_after(e.headers)) from None
+    except (urllib.error.URLError, OSError) as e:
+        raise DeliveryError(getattr(e, 'reason', None) or e) from None
+
+
+class Dispatcher:
+    """Worker threads delivering queued events, ``concurrency`` per endpoint."""
+
+    def __init__(self, connect, endpoints, max_attempts=10, retry_base=2.0, retry_max=600.0, poll_interval=1.0, logger=None):
+        self.connect = connect
+        self.endpoints = endpoints
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.poll_interval = poll_interval
+        self.logger = logger
+        self.stop = threading.Event()
+        self._lock = threading.Lock()
+        self.counters = {name: {'batches': 0, 'delivered': 0, 'failed': 0} for name in endpoints}
+
+    def _count(self, name, key, n=1):
+        with self._lock:
+            self.counters[name][key] += n
+
+    def deliver_batch(self, name):
+        """Claim and deliver one batch for endpoint ``name``; returns the number of events claimed."""
+        settings = self.endpoints[name]
+        conn = self.connect()
+        try:
+            token, claimed = claim(conn, name, settings['batch_size'])
+        finally:
+            conn.close()
+        if not claimed:
+            return 0
+        try:
+            send(name, settings, [event for _, _, event in claimed])
+            error = None
+        except DeliveryError as e:
+            error = e
+        conn = self.connect()
+        try:
+            if error is None:
+                recorded = record_success(conn, token, [delivery_id for delivery_id, _, _ in claimed])
+            else:
+                recorded = record_failure(conn, token, claimed, error, error.permanent, error.retry_after, self.max_attempts, self.retry_base, self.retry_max)
+            conn.commit()
+        finally:
+            conn.close()
+        self._count(name, 'batches')
+        if recorded < len(claimed) and self.logger:
+            self.logger.warning('%d of %d deliveries to %s outlived their lease and were claimed again', len(claimed) - recorded, len(claimed), name)
+        if error is None:
+            self._count(name, 'delivered', len(claimed))
+        else:
+            self._count(name, 'failed', len(claimed))
+            if self.logger:
+                self.logger.warning('Delivery of %d events to %s failed: %s', len(claimed), name, error)
+        return len(claimed)
+
+    def _work(self, name, until_idle):
+        while not self.stop.is_set():
+            try:
+                claimed = self.deliver_batch(name)
+            except Exception:
+                if self.logger:
+                    self.logger.exception('Event dispatcher error for %s', name)
+                claimed = 0
+            if not claimed:
+                if until_idle:
+                    return
+                self.stop.wait(self.poll_interval)
+
+    def run(self, until_idle=False):
+        """Run the workers; returns when stopped, or once nothing is due with ``until_idle``."""
+        conn = self.connect()
+        try:
+            ensure_schema(conn)
+            conn.commit()
+        finally:
+            conn.close()
+        threads = [threading.Thread(target=self._work, args=(name, until_idle), name=f'outbox-{name}-{i}', daemon=True)
+                   for name, settings in self.endpoints.items() for i in range(max(int(settings['concurrency']), 1))]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(0.5)
+        finally:
+            self.stop.set()
+        return self.counters
+
+
+def dispatcher(app):
+    return Dispatcher(app.extensions['storage'].connect, endpoints(app), app.config['INTEGRATION_MAX_ATTEMPTS'],
+                      app.config['INTEGRATION_RETRY_BASE'], app.config['INTEGRATION_RETRY_MAX'],
+                      app.config['INTEGRATION_POLL_INTERVAL'], app.logger)
+
+
+@click.command('deliver-events')
+@click.option('--once', is_flag=True, help='Deliver what is due and exit instead of running continuously.')
+@with_appcontext
+def deliver_events_command(once):
+    """Deliver queued integration events to INTEGRATION_ENDPOINTS."""
+    app = current_app._get_current_object()
+    if not app.config['INTEGRATION_ENDPOINTS']:
+        raise click.ClickException('No INTEGRATION_ENDPOINTS configured.')
+    worker = dispatcher(app)
+    try:
+        counters = worker.run(until_idle=once)
+    except KeyboardInterrupt:
+        worker.stop.set()
+        counters = worker.counters
+    for name, counts in counters.items():
+        click.echo(f"{name}: {counts['delivered']} delivered, {counts['failed']} failed in {counts['batches']} batches")
+
+
+# --- Stub receiver ---
+
+class StubReceiver(ThreadingHTTPServer):
+    """Local HTTP receiver for testing delivery: records batches, fails ``fail_rate`` of them with 503."""
+
+    daemon_threads = True
+
+    def __init__(self, port=0, fail_rate=0.0, host='127.0.0.1'):
+        self.fail_rate = fail_rate
+        self.batches = []
+        self.event_ids = set()
+        self.lock = threading.Lock()
+        super().__init__((host, port), _StubHandler)
+
+    @property
+    def url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}/events'
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if random.random() < self.server.fail_rate:
+            self.send_response(503)
+            self.send_header('Retry-After', '1')
+            self.end_headers()
+            return
+        try:
+            events = json.loads(body)['events']
+        except (ValueError, KeyError):
+            self.send_response(400)
+            self.end_headers()
+            return
+        with self.server.lock:
+            self.server.batches.append(events)
+            self.server.event_ids.update(event['id'] for event in events)
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@click.command('integration-stub')
+@click.option('--port', type=int, default=8765)
+@click.option('--fail-rate', type=float, default=0.0, help='Share of batches answered with 503.')
+def integration_stub_command(port, fail_rate):
+    """Run a local receiver that accepts delivered event batches and prints them."""
+    server = StubReceiver(port, fail_rate)
+    click.echo(f'Receiving at {server.url}')
+    seen = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        while True:
+            time.sleep(1)
+            with server.lock:
+                batches = server.batches[seen:]
+                seen = len(server.batches)
+            for events in batches:
+                click.echo(f'batch of {len(events)}: ' + ', '.join(f"#{event['id']} {event['type']}" for event in events))
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+def init_app(app):
+    app.cli.add_command(deliver_events_command)
+    app.cli.add_command(integration_stub_command)
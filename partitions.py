@@ -0,0 +1,549 @@
+from datetime import datetime
+from functools import wraps
+import atexit
+import json
+import os
+from pathlib import Path
+import re
+import sqlite3
+import threading
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+import query_cache
+from locations import UNASSIGNED_PLANT, plant_resolver
+from storage.sqlite import SQLiteBackend, connect
+
+# --- Per-plant partitions ---
+# With PLANT_PARTITIONS on (SQLite backend only), Orders, ProductionBatch and
+# JobCards rows live in one database file per plant, PARTITION_DIR/
+# plant_<LocationID>.db. An order belongs to the plant its DeliverySite
+# resolves to (plant_0.db when none matches); batches and job cards follow
+# their order, or the batch's PlantLocationID. Every other table stays in
+# the shared database.
+#
+# get_db_connection() opens the shared database, ATTACHes every partition
+# and shadows the three tables with TEMP views that UNION ALL the
+# partitions, so cross-plant pages and reports read them unchanged. Writes
+# go through connect_plant()/connect_for_row(), which open the plant's file
+# as main with the shared database attached: the row write locks that
+# plant's file only. Each partition numbers its rows from
+# (LocationID + 1) * ID_STRIDE, so IDs stay unique across plants and name
+# their partition. `flask partition-plants` moves existing rows out of the
+# shared database.
+#
+# A plant write never takes the shared file's write lock for bookkeeping:
+#
+#   - the partitioned tables' query_cache versions live in the plant file's
+#     own TableVersions; the TEMP view AllTableVersions adds them to the
+#     shared ones for readers
+#   - functions decorated with @bookkeeping (change_log.record,
+#     outbox.publish, sales_cube.apply_order_change, and in db.py
+#     log_audit and the job card's assignments and progress entries) are
+#     queued in the plant file's SharedQueue by the same transaction, and
+#     merge() replays them against the shared database, in order, every
+#     PARTITION_MERGE_INTERVAL seconds (`flask merge-partitions` on demand)
+#
+# So ChangeLog, outbox events, SalesCube, AuditLog, JobAssignments and
+# JobProgressLog trail plant writes by up to a merge interval, and are
+# stamped when merged. PartitionMerges records how far each queue has been
+# replayed, so a merge interrupted between the shared commit and the queue
+# cleanup never replays twice. A call that raises is moved to
+# MergeFailures instead of blocking the queue behind it; `flask
+# merge-partitions --retry-failed` replays those once the cause is fixed.
+#
+# Every connection ATTACHes all partitions, so SQLite's limit on attached
+# databases (10 unless SQLite is built with a larger SQLITE_MAX_ATTACHED)
+# caps the number of plants; creating one more fails with an error.
+
+# Partitioned table -> primary key.
+PARTITIONED_TABLES = {'Orders': 'OrderID', 'ProductionBatch': 'BatchID', 'JobCards': 'JobCardID'}
+ID_STRIDE = 1_000_000_000
+MERGE_BATCH = 500
+_FILE_RE = re.compile(r'^plant_(\d+)\.db$')
+
+
+class PartitionedBackend(SQLiteBackend):
+    """SQLite backend that spreads plant-scoped tables over one file per plant."""
+
+    def __init__(self, database, directory, timeout=5.0, wal=False):
+        super().__init__(database, timeout, wal)
+        self.directory = directory
+        self._lock = threading.RLock()
+        self._shared_ready = False
+        # (directory mtime, plant ids); listed again only when the directory changes.
+        self._plants = (None, [])
+        self._prepared = set()
+
+    def path(self, plant_id):
+        return os.path.join(self.directory, f'plant_{int(plant_id)}.db')
+
+    def plant_ids(self):
+        try:
+            stamp = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            return []
+        cached_stamp, plant_ids = self._plants
+        if cached_stamp != stamp:
+            plant_ids = sorted(int(m.group(1)) for m in map(_FILE_RE.match, os.listdir(self.directory)) if m)
+            for plant_id in plant_ids:
+                self._prepare(plant_id)
+            self._plants = (stamp, plant_ids)
+        return plant_ids
+
+    def _prepare(self, plant_id):
+        """Bring a partition made by an older version up to date (once per process)."""
+        if plant_id in self._prepared:
+            return
+        with self._lock:
+            if plant_id in self._prepared:
+                return
+            self._prepare_shared()
+            conn = connect(self.path(plant_id), self.timeout)
+            try:
+                _partition_tables(conn)
+            finally:
+                conn.close()
+            self._prepared.add(plant_id)
+
+    def _prepare_shared(self):
+        if not self._shared_ready:
+            conn = self.connect_shared()
+            try:
+                _shared_tables(conn)
+            finally:
+                conn.close()
+            self._shared_ready = True
+
+    def connect(self, read_only=False):
+        conn = super().connect(read_only)
+        attach_partitions(conn, {plant_id: self.path(plant_id) for plant_id in self.plant_ids()}, read_only)
+        return conn
+
+    def connect_shared(self, read_only=False):
+        """Shared database alone; plant-scoped tables are its own (unmigrated) rows."""
+        return super().connect(read_only)
+
+    def connect_plant(self, plant_id):
+        """Connection whose plant-scoped tables are ``plant_id``'s partition."""
+        self.ensure_partition(plant_id)
+        conn = connect(self.path(plant_id), self.timeout)
+        self._ensure_wal(conn, self.path(plant_id))
+        conn.execute('ATTACH DATABASE ? AS shared', (self.database,))
+        conn.plant_id = int(plant_id)
+        return conn
+
+    def connect_for_row(self, table, row_id):
+        """Connection that can write row ``row_id`` of ``table`` where it lives."""
+        plant_id = self.plant_of(table, row_id)
+        return self.connect_shared() if plant_id is None else self.connect_plant(plant_id)
+
+    def plant_of(self, table, row_id):
+        """Partition holding ``table`` row ``row_id``; None if it is in the shared database."""
+        row_id = int(row_id)
+        if row_id >= ID_STRIDE:
+            return row_id // ID_STRIDE - 1
+        key = PARTITIONED_TABLES[table]
+        conn = self.connect_shared(read_only=True)
+        try:
+            for plant_id in self.plant_ids():
+                conn.execute('ATTACH DATABASE ? AS part', (self.path(plant_id),))
+                found = conn.execute(f'SELECT 1 FROM part.{table} WHERE {key} = ?', (row_id,)).fetchone()
+                conn.execute('DETACH DATABASE part')
+                if found:
+                    return plant_id
+        finally:
+            conn.close()
+        return None
+
+    def ensure_partition(self, plant_id):
+        """Create ``plant_id``'s file with the shared schema of the partitioned tables."""
+        path = self.path(plant_id)
+        if os.path.exists(path):
+            self._prepare(int(plant_id))
+            return
+        with self._lock:
+            if os.path.exists(path):
+                return
+            limit = _attach_limit()
+            if len(self.plant_ids()) >= limit:
+                raise RuntimeError(f'Cannot add a partition for plant {plant_id}: SQLite attaches at most {limit} databases '
+                                   'per connection (SQLITE_MAX_ATTACHED). Rebuild SQLite with a higher limit, '
+                                   'or map more locations onto existing plants.')
+            os.makedirs(self.directory, exist_ok=True)
+            shared = connect(self.database, self.timeout, read_only=True)
+            try:
+                placeholders = ', '.join('?' for _ in PARTITIONED_TABLES)
+                ddl = shared.execute(f"SELECT type, sql FROM sqlite_master WHERE type IN ('table', 'index') AND tbl_name IN ({placeholders}) AND sql IS NOT NULL ORDER BY type DESC", tuple(PARTITIONED_TABLES)).fetchall()
+            finally:
+                shared.close()
+            # Built under a temporary name so no reader ever attaches half a file.
+            tmp = f'{path}.{os.getpid()}.tmp'
+            part = sqlite3.connect(tmp)
+            try:
+                for row in ddl:
+                    part.execute(row[1])
+                part.executemany('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)',
+                                 [(table, (int(plant_id) + 1) * ID_STRIDE) for table in PARTITIONED_TABLES])
+                part.commit()
+                _partition_tables(part)
+            finally:
+                part.close()
+            self._prepare_shared()
+            os.replace(tmp, path)
+            self._prepared.add(int(plant_id))
+
+
+def _shared_tables(conn):
+    """Tables the shared database needs for partitions; commits."""
+    query_cache.ensure_tables(conn, ())
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS PartitionMerges (
+            PlantID INTEGER PRIMARY KEY,
+            LastQueueID INTEGER NOT NULL,
+            MergedAt TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS MergeFailures (
+            FailureID INTEGER PRIMARY KEY AUTOINCREMENT,
+            PlantID INTEGER NOT NULL,
+            QueueID INTEGER NOT NULL,
+            Operation TEXT NOT NULL,
+            Args TEXT NOT NULL,
+            QueuedAt TEXT NOT NULL,
+            Error TEXT NOT NULL,
+            FailedAt TEXT NOT NULL
+        )
+    ''')
+    conn.commit()
+
+
+def _partition_tables(conn):
+    """A partition's own SharedQueue and TableVersions (with triggers); commits."""
+    # AUTOINCREMENT: ids must never be reused once merged and deleted.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS SharedQueue (
+            QueueID INTEGER PRIMARY KEY AUTOINCREMENT,
+            Operation TEXT NOT NULL,
+            Args TEXT NOT NULL,
+            QueuedAt TEXT NOT NULL
+        )
+    ''')
+    query_cache.ensure_tables(conn, tuple(PARTITIONED_TABLES), edits=True)
+
+
+_attach = {}
+
+
+def _attach_limit():
+    if 'limit' not in _attach:
+        probe = sqlite3.connect(':memory:')
+        _attach['limit'] = probe.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+        probe.close()
+    return _attach['limit']
+
+
+def attach_partitions(conn, paths, read_only=False):
+    """ATTACH ``paths`` ({plant_id: file}) to ``conn`` and view the partitioned tables across all of them."""
+    if len(paths) > _attach_limit():
+        raise RuntimeError(f'{len(paths)} plant partitions exceed SQLite\'s limit of {_attach_limit()} attached databases (SQLITE_MAX_ATTACHED)')
+    for plant_id, path in paths.items():
+        target = os.path.abspath(path)
+        if read_only:
+            target = Path(target).as_uri() + '?mode=ro'
+        conn.execute(f'ATTACH DATABASE ? AS plant_{int(plant_id)}', (target,))
+    for table in PARTITIONED_TABLES:
+        selects = [f'SELECT * FROM main.{table}'] + [f'SELECT * FROM plant_{int(plant_id)}.{table}' for plant_id in paths]
+        conn.execute(f"CREATE TEMP VIEW {table} AS {' UNION ALL '.join(selects)}")
+    if paths:
+        plants = ' UNION ALL '.join(f'SELECT TableName, Version FROM plant_{int(plant_id)}.TableVersions' for plant_id in paths)
+        conn.execute(f'''
+            CREATE TEMP VIEW AllTableVersions AS
+            SELECT s.TableName, s.Version + COALESCE(p.Version, 0) AS Version
+            FROM main.TableVersions s
+            LEFT JOIN (SELECT TableName, SUM(Version) AS Version FROM ({plants}) GROUP BY TableName) p ON p.TableName = s.TableName
+        ''')
+        conn.versions_source = 'AllTableVersions'
+        # Reads through the views cover the partitions too (query_cache keys).
+        conn.database = (getattr(conn, 'database', None), *sorted(os.path.abspath(path) for path in paths.values()))
+
+
+# --- Shared bookkeeping ---
+
+_bookkeeping = {}
+
+
+def bookkeeping(func):
+    """Queue calls made on a plant connection for merge() instead of writing the shared file.
+
+    For engine functions taking ``conn`` first that only write shared
+    bookkeeping tables. Arguments must be JSON-serializable (rows become
+    dicts); a queued call returns None.
+    """
+    name = f'{func.__module__}.{func.__qualname__}'
+    _bookkeeping[name] = func
+
+    @wraps(func)
+    def wrapper(conn, *args, **kwargs):
+        if getattr(conn, 'plant_id', None) is None:
+            return func(conn, *args, **kwargs)
+        conn.execute('INSERT INTO main.SharedQueue (Operation, Args, QueuedAt) VALUES (?, ?, ?)',
+                     (name, json.dumps([args, kwargs], default=_plain, separators=(',', ':')), datetime.now().isoformat()))
+        return None
+    return wrapper
+
+
+def _plain(value):
+    if isinstance(value, sqlite3.Row):
+        return {key: value[key] for key in value.keys()}
+    return str(value)
+
+
+def merge_plant(backend, plant_id, logger):
+    """Replay up to MERGE_BATCH queued calls of one partition; returns how many were replayed."""
+    shared = backend.connect_shared()
+    part = connect(backend.path(plant_id), backend.timeout)
+    try:
+        mark_sql = 'SELECT LastQueueID FROM PartitionMerges WHERE PlantID = ?'
+        row = shared.execute(mark_sql, (plant_id,)).fetchone()
+        mark = row[0] if row else 0
+        queued = part.execute('SELECT QueueID, Operation, Args, QueuedAt FROM SharedQueue WHERE QueueID > ? ORDER BY QueueID LIMIT ?',
+                              (mark, MERGE_BATCH)).fetchall()
+        replayed = 0
+        if queued:
+            shared.execute('BEGIN IMMEDIATE')
+            # Another process may have merged meanwhile; the mark is only trusted under the write lock.
+            row = shared.execute(mark_sql, (plant_id,)).fetchone()
+            mark = row[0] if row else 0
+            for queue_id, operation, args, queued_at in queued:
+                if queue_id <= mark:
+                    continue
+                shared.execute('SAVEPOINT replay')
+                try:
+                    _replay(shared, operation, args)
+                except Exception as e:
+                    # Set aside rather than retried here: it would block the queue behind it.
+                    logger.exception('Queued %s #%s from plant %s failed; kept in MergeFailures', operation, queue_id, plant_id)
+                    shared.execute('ROLLBACK TO replay')
+                    shared.execute('''
+                        INSERT INTO MergeFailures (PlantID, QueueID, Operation, Args, QueuedAt, Error, FailedAt)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ''', (plant_id, queue_id, operation, args, queued_at, repr(e), datetime.now().isoformat()))
+                shared.execute('RELEASE replay')
+                mark = queue_id
+                replayed += 1
+            shared.execute('''
+                INSERT INTO PartitionMerges (PlantID, LastQueueID, MergedAt) VALUES (?, ?, ?)
+                ON CONFLICT (PlantID) DO UPDATE SET LastQueueID = excluded.LastQueueID, MergedAt = excluded.MergedAt
+            ''', (plant_id, mark, datetime.now().isoformat()))
+            shared.commit()
+        if part.execute('SELECT 1 FROM SharedQueue WHERE QueueID <= ? LIMIT 1', (mark,)).fetchone():
+            part.execute('DELETE FROM SharedQueue WHERE QueueID <= ?', (mark,))
+            part.commit()
+        return replayed
+    finally:
+        part.close()
+        shared.close()
+
+
+def _replay(conn, operation, args):
+    args, kwargs = json.loads(args)
+    _bookkeeping[operation](conn, *args, **kwargs)
+
+
+def retry_failures(backend, logger):
+    """Replay the calls in MergeFailures, oldest first; returns (replayed, still failing)."""
+    shared = backend.connect_shared()
+    try:
+        shared.execute('BEGIN IMMEDIATE')
+        replayed = failing = 0
+        for failure_id, operation, args in shared.execute('SELECT FailureID, Operation, Args FROM MergeFailures ORDER BY QueuedAt, FailureID').fetchall():
+            shared.execute('SAVEPOINT replay')
+            try:
+                _replay(shared, operation, args)
+            except Exception as e:
+                logger.exception('Queued %s (failure #%s) failed again', operation, failure_id)
+                shared.execute('ROLLBACK TO replay')
+                shared.execute('UPDATE MergeFailures SET Error = ?, FailedAt = ? WHERE FailureID = ?',
+                               (repr(e), datetime.now().isoformat(), failure_id))
+                failing += 1
+            else:
+                shared.execute('DELETE FROM MergeFailures WHERE FailureID = ?', (failure_id,))
+                replayed += 1
+            shared.execute('RELEASE replay')
+        shared.commit()
+        return replayed, failing
+    finally:
+        shared.close()
+
+
+def merge(app):
+    """Replay every partition's queue into the shared database; returns the number of calls replayed."""
+    backend = app.extensions['storage']
+    total = 0
+    with app.app_context():
+        for plant_id in backend.plant_ids():
+            while True:
+                replayed = merge_plant(backend, plant_id, app.logger)
+                total += replayed
+                if replayed < MERGE_BATCH:
+                    break
+    return total
+
+
+_merger = {'pid': None}
+_merger_lock = threading.Lock()
+
+
+def start_merger(app):
+    """Start this process's background merge thread once (after fork too)."""
+    with _merger_lock:
+        if _merger['pid'] == os.getpid():
+            return
+        _merger['pid'] = os.getpid()
+
+        def run():
+            while True:
+                time.sleep(app.config['PARTITION_MERGE_INTERVAL'])
+                try:
+                    merge(app)
+                except Exception:
+                    app.logger.exception('Partition merge failed; queued bookkeeping kept for the next attempt')
+
+        threading.Thread(target=run, name='partition-merge', daemon=True).start()
+        atexit.register(lambda: merge(app))
+
+
+# --- Connections for writes ---
+# Without PLANT_PARTITIONS these are plain get_db_connection() connections.
+
+def shared_schema(conn):
+    """Prefix for creating a shared table on ``conn``: 'shared.' on a plant connection, else ''."""
+    return 'shared.' if getattr(conn, 'plant_id', None) is not None else ''
+
+
+def enabled():
+    return isinstance(current_app.extensions['storage'], PartitionedBackend)
+
+
+def plant_of(table, row_id):
+    """Partition holding the row; None without PLANT_PARTITIONS or while the row is shared."""
+    return current_app.extensions['storage'].plant_of(table, row_id) if enabled() else None
+
+
+def connect_plant(plant_id):
+    backend = current_app.extensions['storage']
+    if not enabled():
+        return backend.connect()
+    start_merger(current_app._get_current_object())
+    return backend.connect_plant(plant_id)
+
+
+def connect_for_row(table, row_id):
+    backend = current_app.extensions['storage']
+    if not enabled():
+        return backend.connect()
+    start_merger(current_app._get_current_object())
+    return backend.connect_for_row(table, row_id)
+
+
+def connect_for_site(delivery_site):
+    """Connection for writing a new order delivered to ``delivery_site``."""
+    backend = current_app.extensions['storage']
+    if not enabled():
+        return backend.connect()
+    conn = backend.connect_shared(read_only=True)
+    try:
+        plant_id = plant_resolver(conn)(delivery_site)
+    finally:
+        conn.close()
+    start_merger(current_app._get_current_object())
+    return backend.connect_plant(plant_id)
+
+
+def connect_for_order(order_id, fallback_plant=UNASSIGNED_PLANT):
+    """Connection for writing rows that follow order ``order_id`` (batches, job cards)."""
+    if not order_id:
+        return connect_plant(fallback_plant or UNASSIGNED_PLANT)
+    return connect_for_row('Orders', order_id)
+
+
+# --- Migration ---
+
+@click.command('partition-plants')
+@with_appcontext
+def partition_plants_command():
+    """Move Orders, ProductionBatch and JobCards rows into per-plant files."""
+    backend = current_app.extensions['storage']
+    if not isinstance(backend, PartitionedBackend):
+        raise click.UsageError('Set RMC_PLANT_PARTITIONS=true (SQLite backend) to partition by plant.')
+    conn = backend.connect_shared()
+    try:
+        resolve = plant_resolver(conn)
+        order_plant = {row['OrderID']: resolve(row['DeliverySite']) for row in conn.execute('SELECT OrderID, DeliverySite FROM Orders')}
+
+        def follow(order_id, fallback):
+            if order_id in order_plant:
+                return order_plant[order_id]
+            plant_id = backend.plant_of('Orders', order_id) if order_id else None
+            return plant_id if plant_id is not None else (fallback or UNASSIGNED_PLANT)
+
+        moves = {
+            'Orders': order_plant,
+            'ProductionBatch': {row['BatchID']: follow(row['OrderID'], row['PlantLocationID'])
+                                for row in conn.execute('SELECT BatchID, OrderID, PlantLocationID FROM ProductionBatch')},
+            'JobCards': {row['JobCardID']: follow(row['RelatedOrderID'], None)
+                         for row in conn.execute('SELECT JobCardID, RelatedOrderID FROM JobCards')},
+        }
+        targets = sorted({p for rows in moves.values() for p in rows.values()})
+        needed = len(set(targets) | set(backend.plant_ids()))
+        if needed > _attach_limit():
+            raise click.ClickException(f'{needed} plants need partitions but SQLite attaches at most {_attach_limit()} '
+                                       'databases (SQLITE_MAX_ATTACHED); map more locations onto the same plant first.')
+        for plant_id in targets:
+            backend.ensure_partition(plant_id)
+            conn.execute('ATTACH DATABASE ? AS part', (backend.path(plant_id),))
+            try:
+                counts = []
+                for table, rows in moves.items():
+                    ids = [(row_id,) for row_id, p in rows.items() if p == plant_id]
+                    key = PARTITIONED_TABLES[table]
+                    conn.executemany(f'INSERT INTO part.{table} SELECT * FROM main.{table} WHERE {key} = ?', ids)
+                    conn.executemany(f'DELETE FROM main.{table} WHERE {key} = ?', ids)
+                    counts.append(f'{len(ids)} {table}')
+                # One transaction per plant: rows are either moved or still shared.
+                conn.commit()
+            finally:
+                conn.execute('DETACH DATABASE part')
+            click.echo(f"plant_{plant_id}.db: {', '.join(counts)}")
+    finally:
+        conn.close()
+
+
+@click.command('merge-partitions')
+@click.option('--retry-failed', is_flag=True, help='Also replay the calls kept in MergeFailures.')
+@with_appcontext
+def merge_partitions_command(retry_failed):
+    """Replay bookkeeping queued in the plant files into the shared database now."""
+    if not enabled():
+        raise click.UsageError('Set RMC_PLANT_PARTITIONS=true (SQLite backend) to use partitions.')
+    app = current_app._get_current_object()
+    click.echo(f'{merge(app)} queued call(s) merged')
+    if retry_failed:
+        replayed, failing = retry_failures(app.extensions['storage'], app.logger)
+        click.echo(f'{replayed} failed call(s) replayed, {failing} still failing')
+
+
+def init_app(app):
+    if app.config['PLANT_PARTITIONS']:
+        backend = app.extensions['storage']
+        if type(backend) is not SQLiteBackend:
+            raise RuntimeError('PLANT_PARTITIONS needs the SQLite backend')
+        directory = app.config['PARTITION_DIR'] or os.path.join(app.instance_path, 'partitions')
+        app.extensions['storage'] = PartitionedBackend(backend.database, directory, backend.timeout, backend.wal)
+    app.cli.add_command(partition_plants_command)
+    app.cli.add_command(merge_partitions_command)
@@ -0,0 +1,539 @@
+from collections import defaultdict
+from datetime import datetime
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+
+from flask import current_app, request, session
+
+from db import get_db_connection
+from partitions import shared_schema
+from storage import dialect, hooks
+
+# --- On-demand request profiler ---
+# An administrator arms a route from the settings page ("profile the next N
+# requests to erp.erp_production", optionally only a fraction of them) or
+# adds ?_profile=1 to any URL. Armed routes live in ProfilerTriggers, so
+# every worker sees them; each worker re-reads them at most every
+# PROFILER_POLL_INTERVAL seconds and claims one of the N slots with a
+# conditional UPDATE before profiling, so N is respected across workers.
+#
+# A profiled request runs with
+#
+#   - a sampling thread reading the request thread's Python stack every
+#     PROFILER_INTERVAL seconds (each sample weighted by the time since the
+#     previous one), until the response has been sent; streamed pages are
+#     rendered while they are sent, so Jinja time is included
+#   - its database connections instrumented (through storage.hooks): every
+#     execute and fetch is timed and its rows counted. A sample taken inside
+#     one gets a leaf frame naming the statement, which splits the flame
+#     graph into statement execution, row fetching/materialization (SQLite
+#     does most of a query's work while stepping through rows, so there it
+#     falls under fetch), template rendering and other Python
+#
+# Each profile is written to PROFILER_DIR as <id>.profile.json (summary),
+# <id>.sql.json (statement trace), <id>.speedscope.json (call stacks and a
+# SQL timeline, for https://www.speedscope.app) and <id>.folded (collapsed
+# stacks for flamegraph.pl, weighted in microseconds). Only the newest
+# PROFILER_KEEP are kept. Statement parameters are not recorded.
+#
+# When nothing is armed a request costs one cached dictionary lookup and
+# each new connection one thread-local lookup.
+
+ALL_ENDPOINTS = '*'
+MAX_STATEMENTS = 5000
+MAX_SPANS = 20000
+SQL_LABEL_LENGTH = 80
+FILES = {
+    'profile': '.profile.json',
+    'sql': '.sql.json',
+    'speedscope': '.speedscope.json',
+    'folded': '.folded',
+}
+PROFILE_ID = re.compile(r'^[\w-]+$')
+
+_local = threading.local()
+_sampling = {'active': 0, 'switch_interval': None}
+_sampling_lock = threading.Lock()
+_rules = (0.0, {})  # (monotonic time to re-read at, {endpoint: [(trigger id, sample rate)]})
+_prefixes = ()
+
+
+def profile_dir(app=None):
+    app = app or current_app
+    return app.config['PROFILER_DIR'] or os.path.join(app.instance_path, 'profiles')
+
+
+def ensure_schema(conn):
+    if dialect(conn).table_exists(conn, 'ProfilerTriggers'):
+        return
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {shared_schema(conn)}ProfilerTriggers (
+            TriggerID INTEGER PRIMARY KEY AUTOINCREMENT,
+            Endpoint TEXT NOT NULL,
+            Requested INTEGER NOT NULL,
+            Remaining INTEGER NOT NULL,
+            SampleRate REAL NOT NULL DEFAULT 1,
+            ExpiresAt REAL NOT NULL,
+            CreatedBy TEXT,
+            CreatedAt REAL NOT NULL
+        )
+    ''')
+
+
+# --- Triggers ---
+
+def arm(conn, endpoint, count, sample_rate=1.0, minutes=60, created_by=None):
+    """Profile the next ``count`` requests to ``endpoint`` ('*' for any), each with probability ``sample_rate``."""
+    global _rules
+    ensure_schema(conn)
+    now = time.time()
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO ProfilerTriggers (Endpoint, Requested, Remaining, SampleRate, ExpiresAt, CreatedBy, CreatedAt)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (endpoint, count, count, sample_rate, now + minutes * 60, created_by, now))
+    _rules = (0.0, {})
+    return cursor.lastrowid
+
+
+def cancel(conn, trigger_id):
+    global _rules
+    ensure_schema(conn)
+    conn.execute('UPDATE ProfilerTriggers SET Remaining = 0 WHERE TriggerID = ?', (trigger_id,))
+    _rules = (0.0, {})
+
+
+def triggers(conn, limit=20):
+    """Recent triggers, newest first, with an 'active' flag."""
+    ensure_schema(conn)
+    now = time.time()
+    rows = conn.execute('''
+        SELECT TriggerID, Endpoint, Requested, Remaining, SampleRate, ExpiresAt, CreatedBy
+        FROM ProfilerTriggers ORDER BY TriggerID DESC LIMIT ?
+    ''', (limit,)).fetchall()
+    return [dict(row, active=row['Remaining'] > 0 and row['ExpiresAt'] > now,
+                 Expires=datetime.fromtimestamp(row['ExpiresAt']).strftime('%Y-%m-%d %H:%M')) for row in rows]
+
+
+def _armed(app):
+    """{endpoint: [(trigger id, sample rate)]} of the active triggers, re-read every PROFILER_POLL_INTERVAL."""
+    global _rules
+    refresh_at, rules = _rules
+    now = time.monotonic()
+    if now < refresh_at:
+        return rules
+    rules = {}
+    conn = get_db_connection()
+    try:
+        if dialect(conn).table_exists(conn, 'ProfilerTriggers'):
+            for row in conn.execute('SELECT TriggerID, Endpoint, SampleRate FROM ProfilerTriggers WHERE Remaining > 0 AND ExpiresAt > ?', (time.time(),)):
+                rules.setdefault(row['Endpoint'], []).append((row['TriggerID'], row['SampleRate']))
+    finally:
+        conn.close()
+    _rules = (now + app.config['PROFILER_POLL_INTERVAL'], rules)
+    return rules
+
+
+def _claim(trigger_id):
+    """Take one of the trigger's remaining slots; False once another worker took the last."""
+    global _rules
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('UPDATE ProfilerTriggers SET Remaining = Remaining - 1 WHERE TriggerID = ? AND Remaining > 0 AND ExpiresAt > ?',
+                       (trigger_id, time.time()))
+        conn.commit()
+        claimed = cursor.rowcount == 1
+    finally:
+        conn.close()
+    if not claimed:
+        _rules = (0.0, {})
+    return claimed
+
+
+# --- Recording ---
+
+def _sampling_started(interval):
+    # A thread waiting for the GIL gets it only every switch interval (5 ms
+    # by default), which would cap the sampling rate; shorten it while any
+    # request is being profiled.
+    with _sampling_lock:
+        if not _sampling['active']:
+            _sampling['switch_interval'] = sys.getswitchinterval()
+            sys.setswitchinterval(min(interval, _sampling['switch_interval']))
+        _sampling['active'] += 1
+
+
+def _sampling_stopped():
+    with _sampling_lock:
+        _sampling['active'] -= 1
+        if not _sampling['active']:
+            sys.setswitchinterval(_sampling['switch_interval'])
+
+def _short_path(filename):
+    for prefix in _prefixes:
+        if filename.startswith(prefix):
+            return filename[len(prefix):]
+    return filename
+
+
+class Profile:
+    """Samples and SQL trace of one request, filled in by the request thread and its sampler."""
+
+    def __init__(self, app, trigger_id):
+        self.id = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{request.endpoint.replace('.', '-')}-{uuid.uuid4().hex[:6]}"
+        self.meta = {
+            'id': self.id, 'endpoint': request.endpoint, 'method': request.method,
+            'path': request.full_path.rstrip('?'), 'user': session.get('username'),
+            'trigger_id': trigger_id, 'started': datetime.now().isoformat(timespec='seconds'), 'created': time.time(),
+        }
+        self.directory = profile_dir(app)
+        self.keep = app.config['PROFILER_KEEP']
+        self.interval = app.config['PROFILER_INTERVAL']
+        self.logger = app.logger
+        self.frames = []        # speedscope frames: {'name', 'file', 'line'}
+        self.codes = {}         # code object -> frame index
+        self.labels = {}        # statement label -> frame index
+        self.template_frames = set()
+        self.samples = []       # (stack of frame indexes, root first; weight in seconds)
+        self.statements = []
+        self.spans = []         # (kind, statement index, start, end) for the SQL timeline
+        self.current = None     # (kind, statement index) while inside a traced call
+        self.attached = False
+        self.status = None
+        self.started = time.perf_counter()
+        self.thread_id = threading.get_ident()
+        self.stopped = threading.Event()
+        self.sampler = threading.Thread(target=self._sample, name='rmc-profiler', daemon=True)
+
+    # Samples
+
+    def _frame(self, code):
+        index = len(self.frames)
+        filename = _short_path(code.co_filename)
+        self.frames.append({'name': getattr(code, 'co_qualname', code.co_name), 'file': filename, 'line': code.co_firstlineno})
+        if filename.endswith('.html') or filename.startswith('jinja2' + os.sep):
+            self.template_frames.add(index)
+        self.codes[code] = index
+        return index
+
+    def _label(self, kind, statement):
+        label = f"{kind.upper()} {self.statements[statement]['sql'][:SQL_LABEL_LENGTH]}"
+        index = self.labels.get(label)
+        if index is None:
+            index = self.labels[label] = len(self.frames)
+            self.frames.append({'name': label})
+        return index
+
+    def _sample(self):
+        last = time.perf_counter()
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            current = self.current
+            now = time.perf_counter()
+            stack = []
+            while frame is not None:
+                index = self.codes.get(frame.f_code)
+                stack.append(self._frame(frame.f_code) if index is None else index)
+                frame = frame.f_back
+            stack.reverse()
+            if current is not None:
+                stack.append(self._label(*current))
+            self.samples.append((tuple(stack), now - last))
+            last = now
+
+    # SQL trace
+
+    def statement(self, sql, batch=None):
+        if len(self.statements) >= MAX_STATEMENTS:
+            if len(self.statements) == MAX_STATEMENTS:
+                self.statements.append(self._entry('(further statements not traced individually)', None))
+            entry = self.statements[-1]
+            entry['count'] += 1
+            return len(self.statements) - 1
+        self.statements.append(self._entry(' '.join(sql.split()), batch))
+        return len(self.statements) - 1
+
+    def _entry(self, sql, batch):
+        return {'sql': sql, 'batch': batch, 'count': 1, 'start_ms': round((time.perf_counter() - self.started) * 1000, 3),
+                'execute_ms': 0.0, 'fetch_ms': 0.0, 'rows': 0}
+
+    def call(self, kind, statement, func, *args):
+        self.current = (kind, statement)
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            end = time.perf_counter()
+            self.current = None
+            self.statements[statement][f'{kind}_ms'] += (end - start) * 1000
+            if len(self.spans) < MAX_SPANS:
+                self.spans.append((kind, statement, start, end))
+
+    # Output
+
+    def start(self):
+        _local.profile = self
+        _sampling_started(self.interval)
+        self.sampler.start()
+
+    def finish(self, error=None):
+        _local.profile = None
+        self.stopped.set()
+        self.sampler.join()
+        _sampling_stopped()
+        duration = time.perf_counter() - self.started
+        try:
+            self._write(duration, error)
+        except Exception:
+            self.logger.exception('Could not write profile %s', self.id)
+
+    def _breakdown(self):
+        labels = {index: name.split(' ', 1)[0].lower() for name, index in self.labels.items()}
+        totals = defaultdict(float)
+        for stack, weight in self.samples:
+            if stack and stack[-1] in labels:
+                category = labels[stack[-1]]
+            elif not self.template_frames.isdisjoint(stack):
+                category = 'template'
+            else:
+                category = 'python'
+            totals[category] += weight * 1000
+        return {category: round(totals[category], 1) for category in ('execute', 'fetch', 'template', 'python')}
+
+    def _write(self, duration, error):
+        duration_ms = duration * 1000
+        for entry in self.statements:
+            entry['execute_ms'] = round(entry['execute_ms'], 3)
+            entry['fetch_ms'] = round(entry['fetch_ms'], 3)
+        summary = dict(
+            self.meta,
+            status=self.status or 500, error=None if error is None else repr(error),
+            duration_ms=round(duration_ms, 1), samples=len(self.samples), interval_ms=self.interval * 1000,
+            breakdown=self._breakdown(), statements=sum(entry['count'] for entry in self.statements),
+            sql_execute_ms=round(sum(entry['execute_ms'] for entry in self.statements), 1),
+            sql_fetch_ms=round(sum(entry['fetch_ms'] for entry in self.statements), 1),
+            rows=sum(entry['rows'] for entry in self.statements),
+        )
+        title = f"{self.meta['method']} {self.meta['path']}"
+        events = []
+        for kind, statement, start, end in self.spans:
+            frame = self._label(kind, statement)
+            events.append({'type': 'O', 'frame': frame, 'at': (start - self.started) * 1000})
+            events.append({'type': 'C', 'frame': frame, 'at': (end - self.started) * 1000})
+        speedscope = {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': title, 'exporter': 'rmc-erp profiler', 'activeProfileIndex': 0,
+            'shared': {'frames': self.frames},
+            'profiles': [
+                {'type': 'sampled', 'name': f'{title} (call stacks)', 'unit': 'milliseconds',
+                 'startValue': 0, 'endValue': duration_ms,
+                 'samples': [list(stack) for stack, _ in self.samples],
+                 'weights': [weight * 1000 for _, weight in self.samples]},
+                {'type': 'evented', 'name': f'{title} (SQL)', 'unit': 'milliseconds',
+                 'startValue': 0, 'endValue': duration_ms, 'events': events},
+            ],
+        }
+        folded = defaultdict(int)
+        names = [_folded_name(frame) for frame in self.frames]
+        for stack, weight in self.samples:
+            folded[';'.join(names[i] for i in stack)] += round(weight * 1e6)
+
+        os.makedirs(self.directory, exist_ok=True)
+        _write_file(self.directory, self.id + FILES['speedscope'], json.dumps(speedscope))
+        _write_file(self.directory, self.id + FILES['folded'], ''.join(f'{stack} {weight}\n' for stack, weight in folded.items() if weight))
+        _write_file(self.directory, self.id + FILES['sql'], json.dumps(self.statements))
+        _write_file(self.directory, self.id + FILES['profile'], json.dumps(summary))
+        _prune(self.directory, self.keep)
+
+
+def _folded_name(frame):
+    name = frame['name'] if 'file' not in frame else f"{frame['name']} ({frame['file']}:{frame['line']})"
+    return name.replace(';', ',')
+
+
+def _write_file(directory, name, text):
+    tmp = os.path.join(directory, f'.{name}.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp, os.path.join(directory, name))
+
+
+def _prune(directory, keep):
+    for profile in list_profiles(directory)[keep:]:
+        for suffix in FILES.values():
+            try:
+                os.remove(os.path.join(directory, profile['id'] + suffix))
+            except FileNotFoundError:
+                pass
+
+
+class TracedCursor:
+    """Cursor of a profiled request's connection; times execute and fetch calls and counts rows."""
+
+    def __init__(self, cursor, profile):
+        self._cursor = cursor
+        self._profile = profile
+        self._statement = None
+        self._rows = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def execute(self, sql, params=()):
+        self._statement = self._profile.statement(sql)
+        self._rows = None
+        self._profile.call('execute', self._statement, self._cursor.execute, sql, params)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        if not hasattr(seq_of_params, '__len__'):
+            seq_of_params = list(seq_of_params)
+        self._statement = self._profile.statement(sql, batch=len(seq_of_params))
+        self._rows = None
+        self._profile.call('execute', self._statement, self._cursor.executemany, sql, seq_of_params)
+        return self
+
+    def _fetched(self, rows):
+        if self._statement is not None:
+            self._profile.statements[self._statement]['rows'] += rows
+
+    def fetchone(self):
+        row = self._profile.call('fetch', self._statement, self._cursor.fetchone)
+        self._fetched(row is not None)
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._profile.call('fetch', self._statement, self._cursor.fetchmany, *args)
+        self._fetched(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._profile.call('fetch', self._statement, self._cursor.fetchall)
+        self._fetched(len(rows))
+        return rows
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._rows is None:
+            self._rows = iter(self._cursor)
+        row = self._profile.call('fetch', self._statement, next, self._rows)
+        self._fetched(1)
+        return row
+
+
+def _instrument(conn):
+    """Connection hook: trace ``conn`` when it is opened by a profiled request."""
+    profile = getattr(_local, 'profile', None)
+    if profile is None:
+        return conn
+    make_cursor = conn.cursor
+
+    def cursor(*args):
+        return TracedCursor(make_cursor(*args), profile)
+
+    conn.cursor = cursor
+    conn.execute = lambda sql, params=(): cursor().execute(sql, params)
+    conn.executemany = lambda sql, seq_of_params: cursor().executemany(sql, seq_of_params)
+    return conn
+
+
+# --- Stored profiles ---
+
+def list_profiles(directory=None):
+    """Summaries of the stored profiles, newest first."""
+    directory = directory or profile_dir()
+    try:
+        names = [name for name in os.listdir(directory) if name.endswith(FILES['profile'])]
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for name in names:
+        try:
+            with open(os.path.join(directory, name), encoding='utf-8') as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    profiles.sort(key=lambda profile: profile['created'], reverse=True)
+    return profiles
+
+
+def profile_path(profile_id, kind):
+    """Path of one of a profile's files, or None if ``profile_id`` or ``kind`` is invalid or missing."""
+    if kind not in FILES or not PROFILE_ID.match(profile_id):
+        return None
+    path = os.path.join(profile_dir(), profile_id + FILES[kind])
+    return path if os.path.exists(path) else None
+
+
+def load(profile_id):
+    """(summary, statement trace) of a stored profile, or None."""
+    summary, trace = profile_path(profile_id, 'profile'), profile_path(profile_id, 'sql')
+    if summary is None or trace is None:
+        return None
+    with open(summary, encoding='utf-8') as f, open(trace, encoding='utf-8') as g:
+        return json.load(f), json.load(g)
+
+
+# --- Request hooks ---
+
+def _start(app, trigger_id=None):
+    Profile(app, trigger_id).start()
+
+
+def start_profile():
+    stale = getattr(_local, 'profile', None)
+    if stale is not None:
+        # The previous response on this thread was never closed.
+        stale.finish()
+    endpoint = request.endpoint
+    if endpoint is None or endpoint == 'static' or endpoint.startswith('erp.erp_profile'):
+        return
+    app = current_app._get_current_object()
+    if b'_profile=' in request.query_string and request.args.get('_profile') and session.get('role') == 'Administrator':
+        _start(app)
+        return
+    rules = _armed(app)
+    if not rules:
+        return
+    for trigger_id, sample_rate in rules.get(endpoint, []) + rules.get(ALL_ENDPOINTS, []):
+        if (sample_rate >= 1 or random.random() < sample_rate) and _claim(trigger_id):
+            _start(app, trigger_id)
+            return
+
+
+def attach_profile(response):
+    profile = getattr(_local, 'profile', None)
+    if profile is not None and not profile.attached:
+        # Finished once the body has been sent, which for streamed pages
+        # is when their templates have rendered.
+        profile.attached = True
+        profile.status = response.status_code
+        response.call_on_close(profile.finish)
+    return response
+
+
+def finish_unattached(error):
+    profile = getattr(_local, 'profile', None)
+    if profile is not None and not profile.attached:
+        profile.finish(error)
+
+
+def init_app(app):
+    global _prefixes
+    if not app.config['PROFILER_ENABLED']:
+        return
+    _prefixes = tuple(sorted({os.path.join(path, '') for path in [app.root_path, *sys.path] if path}, key=len, reverse=True))
+    if _instrument not in hooks.on_connect:
+        hooks.on_connect.append(_instrument)
+    app.before_request(start_profile)
+    app.after_request(attach_profile)
+    app.teardown_request(finish_unattached)
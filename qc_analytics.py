@@ -0,0 +1,253 @@
+import re
+import threading
+
+import numpy as np
+
+import query_cache
+
+# --- QC analytics ---
+# QualityControl joined with ProductionBatch, held as columnar NumPy arrays.
+# Control-chart statistics are computed per (TestType, ProductID,
+# PlantLocationID) series and cached. One store is kept per database and
+# brought up to date when the TableVersions of QC_TABLES move (query_cache's
+# triggers bump them on every insert, edit and delete), so a page view
+# without QC changes costs one version lookup. While their edits counters
+# stand still only rows were added: QC rows past the last loaded QCID are
+# appended and only the charts of their series recomputed. An edit or
+# delete, or a QC row whose batch arrived after it was loaded (the count
+# up to that QCID no longer matches), reloads everything.
+
+ROLLING_WINDOW = 10
+CUSUM_K = 0.5   # allowance, in standard deviations
+CUSUM_H = 5.0   # decision interval, in standard deviations
+D2 = 1.128      # moving-range constant for subgroups of two
+QC_TABLES = ('QualityControl', 'ProductionBatch')
+QC_COUNTERS = QC_TABLES + tuple(query_cache.edits_counter(table) for table in QC_TABLES)
+
+_VALUE_RE = re.compile(r'(-?\d+(?:\.\d+)?)')
+
+
+def parse_result(result):
+    """Pull the measured value out of a Result such as 'Pass - 25 MPa'."""
+    match = _VALUE_RE.search(result or '')
+    return float(match.group(1)) if match else np.nan
+
+
+def rolling_stats(values, window=ROLLING_WINDOW):
+    """Trailing rolling mean and standard deviation (population) via cumulative sums."""
+    n = values.size
+    if n == 0:
+        return np.empty(0), np.empty(0)
+    csum = np.concatenate(([0.0], np.cumsum(values)))
+    csq = np.concatenate(([0.0], np.cumsum(values * values)))
+    ends = np.arange(1, n + 1)
+    starts = np.maximum(ends - window, 0)
+    counts = ends - starts
+    mean = (csum[ends] - csum[starts]) / counts
+    var = (csq[ends] - csq[starts]) / counts - mean * mean
+    return mean, np.sqrt(np.clip(var, 0, None))
+
+
+def cusum(values, target, sigma, k=CUSUM_K):
+    """Tabular CUSUM (upper, lower) of ``values`` around ``target``.
+
+    The recursion is inherently sequential; everything else is vectorised.
+    """
+    upper = np.zeros(values.size)
+    lower = np.zeros(values.size)
+    if sigma <= 0:
+        return upper, lower
+    z = (values - target) / sigma
+    hi = lo = 0.0
+    for i, x in enumerate(z):
+        hi = max(0.0, hi + x - k)
+        lo = max(0.0, lo - x - k)
+        upper[i] = hi
+        lower[i] = lo
+    return upper, lower
+
+
+def control_chart(values, window=ROLLING_WINDOW):
+    """Individuals (Shewhart) chart limits, rolling stats and CUSUM for one series."""
+    values = np.asarray(values, dtype=np.float64)
+    if values.size == 0:
+        return None
+    center = float(values.mean())
+    if values.size > 1:
+        sigma = float(np.abs(np.diff(values)).mean() / D2)
+    else:
+        sigma = 0.0
+    roll_mean, roll_std = rolling_stats(values, window)
+    cusum_hi, cusum_lo = cusum(values, center, sigma)
+    ucl, lcl = center + 3 * sigma, center - 3 * sigma
+    return {
+        'center': center,
+        'sigma': sigma,
+        'ucl': ucl,
+        'lcl': lcl,
+        'rolling_mean': roll_mean,
+        'rolling_std': roll_std,
+        'cusum_upper': cusum_hi,
+        'cusum_lower': cusum_lo,
+        'cusum_h': CUSUM_H,
+        'out_of_control': np.flatnonzero((values > ucl) | (values < lcl) if sigma > 0 else np.zeros(values.size, bool)),
+        'cusum_alarms': np.flatnonzero((cusum_hi > CUSUM_H) | (cusum_lo > CUSUM_H)),
+    }
+
+
+class QCAnalytics:
+    """Columnar QC store with per-series chart cache.
+
+    One instance is kept per database and process (see ``get_analytics``);
+    ``refresh`` is cheap while the QC tables are unchanged.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = None
+        self._reset()
+
+    def _reset(self):
+        self.test_types = []
+        self.qcid = np.empty(0, dtype=np.int64)
+        self.batch_id = np.empty(0, dtype=np.int64)
+        self.product_id = np.empty(0, dtype=np.int64)
+        self.plant_id = np.empty(0, dtype=np.int64)
+        self.test_idx = np.empty(0, dtype=np.int64)
+        self.test_time = np.empty(0, dtype='datetime64[s]')
+        self.value = np.empty(0, dtype=np.float64)
+        self._charts = {}
+
+    def _appendable(self, conn, version):
+        """True if only QC rows past the last loaded QCID changed since ``self.version``."""
+        if version is None or self.version is None or version[len(QC_TABLES):] != self.version[len(QC_TABLES):]:
+            return False
+        last = int(self.qcid[-1]) if self.qcid.size else 0
+        loaded = conn.execute('''
+            SELECT COUNT(*) FROM QualityControl qc
+            JOIN ProductionBatch pb ON qc.BatchID = pb.BatchID
+            WHERE qc.QCID <= ?
+        ''', (last,)).fetchone()[0]
+        return loaded == self.qcid.size
+
+    def refresh(self, conn, version):
+        """Bring the store up to ``version`` (QC_COUNTERS); returns the rows read.
+
+        Appends new QC rows when nothing was edited or deleted, else reloads
+        every row. A ``version`` of None (QC tables not versioned on
+        ``conn``) always reloads.
+        """
+        with self._lock:
+            if version is not None and version == self.version:
+                return 0
+            append = self._appendable(conn, version)
+            last = int(self.qcid[-1]) if append and self.qcid.size else 0
+            rows = conn.execute('''
+                SELECT qc.QCID, qc.BatchID, qc.TestType, qc.TestDate, qc.Result,
+                       pb.ProductID, pb.PlantLocationID
+                FROM QualityControl qc
+                JOIN ProductionBatch pb ON qc.BatchID = pb.BatchID
+                WHERE qc.QCID > ?
+                ORDER BY qc.QCID
+            ''', (last,)).fetchall()
+            if not append:
+                self._reset()
+            self.version = version
+            if not rows:
+                return 0
+
+            type_lookup = {name: i for i, name in enumerate(self.test_types)}
+            test_idx = []
+            for row in rows:
+                name = row['TestType'] or 'Unknown'
+                if name not in type_lookup:
+                    type_lookup[name] = len(self.test_types)
+                    self.test_types.append(name)
+                test_idx.append(type_lookup[name])
+
+            n = len(rows)
+            self.qcid = np.concatenate((self.qcid, np.fromiter((r['QCID'] for r in rows), np.int64, n)))
+            self.batch_id = np.concatenate((self.batch_id, np.fromiter((r['BatchID'] or 0 for r in rows), np.int64, n)))
+            self.product_id = np.concatenate((self.product_id, np.fromiter((r['ProductID'] or 0 for r in rows), np.int64, n)))
+            self.plant_id = np.concatenate((self.plant_id, np.fromiter((r['PlantLocationID'] or 0 for r in rows), np.int64, n)))
+            self.test_idx = np.concatenate((self.test_idx, np.asarray(test_idx, dtype=np.int64)))
+            times = np.array([str(r['TestDate'] or '1970-01-01')[:19].replace(' ', 'T') for r in rows], dtype='datetime64[s]')
+            self.test_time = np.concatenate((self.test_time, times))
+            self.value = np.concatenate((self.value, np.fromiter((parse_result(r['Result']) for r in rows), np.float64, n)))
+            # Only the series that gained rows need their charts recomputed.
+            for r, t in zip(rows, test_idx):
+                self._charts.pop((self.test_types[t], r['ProductID'] or 0, r['PlantLocationID'] or 0), None)
+            return n
+
+    def series_keys(self):
+        with self._lock:
+            keys = set(zip(self.test_idx.tolist(), self.product_id.tolist(), self.plant_id.tolist()))
+            return sorted((self.test_types[t], p, l) for t, p, l in keys)
+
+    def chart(self, test_type, product_id, plant_id, window=ROLLING_WINDOW):
+        with self._lock:
+            return self._chart(test_type, product_id, plant_id, window)
+
+    def _chart(self, test_type, product_id, plant_id, window):
+        key = (test_type, int(product_id), int(plant_id))
+        cached = self._charts.get(key)
+        if cached is not None and cached['window'] == window:
+            return cached
+        if test_type not in self.test_types:
+            return None
+        mask = ((self.test_idx == self.test_types.index(test_type))
+                & (self.product_id == key[1]) & (self.plant_id == key[2]) & ~np.isnan(self.value))
+        order = np.argsort(self.test_time[mask], kind='stable')
+        values = self.value[mask][order]
+        stats = control_chart(values, window)
+        if stats is None:
+            return None
+        result = {
+            'test_type': test_type,
+            'product_id': key[1],
+            'plant_id': key[2],
+            'window': window,
+            'qcid': self.qcid[mask][order].tolist(),
+            'batch_id': self.batch_id[mask][order].tolist(),
+            'time': [str(t) for t in self.test_time[mask][order]],
+            'value': values.tolist(),
+        }
+        for name, stat in stats.items():
+            result[name] = stat.tolist() if isinstance(stat, np.ndarray) else stat
+        self._charts[key] = result
+        return result
+
+
+_analytics = {}
+_analytics_lock = threading.Lock()
+
+
+def ensure_versioned(conn):
+    """Install query_cache's version and edits triggers on QC_TABLES; ``conn`` must be writable."""
+    try:
+        installed = query_cache.read_versions(conn, QC_COUNTERS)
+    except Exception:
+        conn.rollback()
+        installed = {}
+    if len(installed) < len(QC_COUNTERS):
+        query_cache.ensure_tables(conn, QC_TABLES, edits=True)
+
+
+def _version(conn):
+    try:
+        versions = query_cache.read_versions(conn, QC_COUNTERS)
+    except Exception:
+        # No TableVersions on this connection (e.g. an old snapshot).
+        conn.rollback()
+        return None
+    return tuple(versions[t] for t in QC_COUNTERS) if len(versions) == len(QC_COUNTERS) else None
+
+
+def get_analytics(conn, database):
+    """Analytics for ``database`` (a key naming it), brought up to date with ``conn``."""
+    with _analytics_lock:
+        analytics = _analytics.get(database)
+        if analytics is None:
+            analytics = _analytics[database] = QCAnalytics()
+    analytics.refresh(conn, _version(conn))
+    return analytics
@@ -0,0 +1,138 @@
+from collections import OrderedDict
+import threading
+
+from storage import dialect
+
+# --- Table-versioned query cache ---
+# Read results are cached per process, keyed by database, SQL and parameters
+# and stamped with the versions of the tables the query reads. Versions live in
+# the TableVersions table and are bumped by AFTER INSERT/UPDATE/DELETE
+# triggers (the dialect's version_triggers), so a commit from any worker (or
+# any other client of the database) invalidates every worker's cached copy
+# without app code having to remember to do it. Triggers are installed the
+# first time a table is named in a cached query.
+#
+# PostgreSQL logs one row per writing transaction instead of updating the
+# TableVersions row, and reads versions through a view (see
+# PostgresDialect.version_triggers).
+#
+# Readers that keep their own incremental state (qc_analytics) can also ask
+# for an edits counter, '<table>.edits', bumped by updates and deletes
+# only: while it stands still, a moved version means rows were appended.
+
+DEFAULT_MAX_ENTRIES = 256
+
+
+def edits_counter(table):
+    return f'{table}.edits'
+
+
+def ensure_tables(conn, tables, edits=False):
+    """Create TableVersions and the version triggers for ``tables`` (and their edits counters); commits."""
+    conn.execute('CREATE TABLE IF NOT EXISTS TableVersions (TableName TEXT PRIMARY KEY, Version INTEGER NOT NULL DEFAULT 0)')
+    known = {name.lower() for name in dialect(conn).table_names(conn)}
+    unknown = [t for t in tables if t.lower() not in known or t == 'TableVersions']
+    if unknown:
+        raise ValueError(f"Cannot version table(s): {', '.join(unknown)}")
+    for table in tables:
+        counters = [(table, ('INSERT', 'UPDATE', 'DELETE'))]
+        if edits:
+            counters.append((edits_counter(table), ('UPDATE', 'DELETE')))
+        for counter, events in counters:
+            conn.execute('INSERT INTO TableVersions (TableName, Version) VALUES (?, 0) ON CONFLICT (TableName) DO NOTHING', (counter,))
+            for ddl in dialect(conn).version_triggers(table, counter, events):
+                conn.execute(ddl)
+    conn.commit()
+
+
+def read_versions(conn, tables):
+    """{table: version} for those of ``tables`` that have a row; raises if TableVersions is missing."""
+    # Connections over plant partitions read a view that adds each plant
+    # file's own versions (partitions.attach_partitions).
+    source = getattr(conn, 'versions_source', None) or dialect(conn).versions_source
+    placeholders = ', '.join('?' for _ in tables)
+    rows = conn.execute(f'SELECT TableName, Version FROM {source} WHERE TableName IN ({placeholders})', tables).fetchall()
+    return {row['TableName']: row['Version'] for row in rows}
+
+
+def table_versions(conn, tables):
+    """Current version of each table in ``tables``, as a tuple in the same order."""
+    try:
+        versions = read_versions(conn, tables)
+    except Exception:
+        # TableVersions not created yet; the failed statement may have
+        # aborted the transaction (PostgreSQL), so start a fresh one.
+        conn.rollback()
+        versions = {}
+    missing = [t for t in tables if t not in versions]
+    if missing:
+        ensure_tables(conn, missing)
+        versions.update((t, 0) for t in missing)
+    return tuple(versions[t] for t in tables)
+
+
+def database_key(conn):
+    """What ``conn`` reads: its database path or URL, plus any attached partitions."""
+    key = getattr(conn, 'database', None)
+    if key is None:
+        # A plain sqlite3 connection: the files of its attached databases.
+        key = tuple(row[2] or f':memory:{id(conn)}' for row in conn.execute('PRAGMA database_list'))
+    return key
+
+
+def bump(conn, *tables):
+    """Invalidate ``tables`` by hand, e.g. after bulk loads with triggers disabled. Does not commit."""
+    conn.executemany('UPDATE TableVersions SET Version = Version + 1 WHERE TableName = ?', [(t,) for t in tables])
+
+
+class QueryCache:
+    """LRU cache of ``fetchall()`` results with hit/miss counters."""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    def fetchall(self, conn, sql, params=(), tables=()):
+        """Rows of ``sql``; ``tables`` must list every table the query reads."""
+        tables = tuple(sorted(tables))
+        params = tuple(params)
+        # Versions are read before the data: a write landing in between only
+        # costs a spurious miss next time, never a stale hit.
+        versions = table_versions(conn, tables)
+        key = (database_key(conn), sql, params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == versions:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        rows = conn.execute(sql, params).fetchall()
+        with self._lock:
+            self._entries[key] = (versions, rows)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return rows
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+cache = QueryCache()
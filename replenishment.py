@@ -0,0 +1,119 @@
+from datetime import date, timedelta
+import math
+
+# --- Automatic reorder engine ---
+# Scans Inventory for materials at or below their Threshold, sizes the
+# replenishment from recent consumption and raises one Purchase_Order per
+# supplier with its Purchase_Order_Items, all inside a single transaction.
+
+LOOKBACK_DAYS = 30      # window used to measure consumption
+COVER_DAYS = 14         # days of stock a replenishment should cover
+OPEN_PO_STATUSES = ('Pending', 'Approved')
+
+
+def ensure_schema(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Purchase_Orders (
+            OrderID INTEGER PRIMARY KEY AUTOINCREMENT,
+            SupplierID INTEGER,
+            OrderDate DATE,
+            Status TEXT DEFAULT 'Pending',
+            TotalAmount DECIMAL(10,2),
+            CreatedBy INTEGER,
+            FOREIGN KEY (SupplierID) REFERENCES Suppliers(SupplierID),
+            FOREIGN KEY (CreatedBy) REFERENCES Users(UserID)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Purchase_Order_Items (
+            ItemID INTEGER PRIMARY KEY AUTOINCREMENT,
+            OrderID INTEGER,
+            MaterialID INTEGER,
+            Quantity DECIMAL(10,2),
+            UnitPrice DECIMAL(10,2),
+            TotalPrice DECIMAL(10,2),
+            FOREIGN KEY (OrderID) REFERENCES Purchase_Orders(OrderID),
+            FOREIGN KEY (MaterialID) REFERENCES Inventory(MaterialID)
+        )
+    ''')
+    # Partial index: only rows that currently need replenishment are indexed,
+    # so the scan below touches just the low-stock materials.
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_inventory_low_stock ON Inventory(SupplierID) WHERE CurrentStock <= Threshold')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_po_items_material ON Purchase_Order_Items(MaterialID, OrderID)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_job_material_usage_material ON JobMaterialUsage(MaterialID, UsageDate)')
+
+
+def find_low_stock(conn, lookback_days=LOOKBACK_DAYS, today=None):
+    """Return low-stock materials with their recent consumption and last known price.
+
+    Materials already on an open purchase order are skipped so repeated runs
+    don't order the same shortage twice.
+    """
+    today = today or date.today()
+    since = (today - timedelta(days=lookback_days)).isoformat()
+    placeholders = ', '.join('?' for _ in OPEN_PO_STATUSES)
+    return conn.execute(f'''
+        SELECT i.MaterialID, i.MaterialName, i.SupplierID, i.CurrentStock, i.Threshold, i.Unit,
+               COALESCE((SELECT SUM(u.QuantityUsed) FROM JobMaterialUsage u
+                         WHERE u.MaterialID = i.MaterialID AND u.UsageDate >= ?), 0) AS Consumed,
+               COALESCE((SELECT poi.UnitPrice FROM Purchase_Order_Items poi
+                         WHERE poi.MaterialID = i.MaterialID
+                         ORDER BY poi.OrderID DESC LIMIT 1), 0) AS UnitPrice
+        FROM Inventory i
+        WHERE i.CurrentStock <= i.Threshold
+          AND i.SupplierID IS NOT NULL
+          AND NOT EXISTS (
+              SELECT 1 FROM Purchase_Order_Items poi
+              JOIN Purchase_Orders po ON poi.OrderID = po.OrderID
+              WHERE poi.MaterialID = i.MaterialID AND po.Status IN ({placeholders})
+          )
+        ORDER BY i.SupplierID, i.MaterialName
+    ''', (since, *OPEN_PO_STATUSES)).fetchall()
+
+
+def reorder_quantity(current_stock, threshold, consumed, lookback_days=LOOKBACK_DAYS, cover_days=COVER_DAYS):
+    # Bring stock back to the threshold plus enough to cover the expected
+    # usage; with no usage history fall back to twice the threshold.
+    daily_usage = (consumed or 0) / lookback_days
+    target = max(2 * (threshold or 0), (threshold or 0) + daily_usage * cover_days)
+    return max(math.ceil(target - (current_stock or 0)), 0)
+
+
+def plan_replenishment(conn, lookback_days=LOOKBACK_DAYS, cover_days=COVER_DAYS, today=None):
+    """Group low-stock materials by supplier into purchase order drafts."""
+    plan = {}
+    for row in find_low_stock(conn, lookback_days, today):
+        qty = reorder_quantity(row['CurrentStock'], row['Threshold'], row['Consumed'], lookback_days, cover_days)
+        if qty <= 0:
+            continue
+        plan.setdefault(row['SupplierID'], []).append({
+            'MaterialID': row['MaterialID'],
+            'MaterialName': row['MaterialName'],
+            'Unit': row['Unit'],
+            'Quantity': qty,
+            'UnitPrice': row['UnitPrice'],
+            'TotalPrice': round(qty * row['UnitPrice'], 2),
+        })
+    return plan
+
+
+def create_purchase_orders(conn, user_id, lookback_days=LOOKBACK_DAYS, cover_days=COVER_DAYS, today=None):
+    """Insert purchase orders and line items for every low-stock material.
+
+    All rows go through the caller's connection without committing, so the
+    whole run (plus any audit entries) lands in one transaction. Returns a
+    list of ``(po_id, supplier_id, items)`` for the orders created.
+    """
+    today = today or date.today()
+    plan = plan_replenishment(conn, lookback_days, cover_days, today)
+    created = []
+    cursor = conn.cursor()
+    for supplier_id, items in plan.items():
+        total = round(sum(item['TotalPrice'] for item in items), 2)
+        cursor.execute('INSERT INTO Purchase_Orders (SupplierID, OrderDate, Status, TotalAmount, CreatedBy) VALUES (?, ?, ?, ?, ?)',
+                       (supplier_id, today, 'Pending', total, user_id))
+        po_id = cursor.lastrowid
+        cursor.executemany('INSERT INTO Purchase_Order_Items (OrderID, MaterialID, Quantity, UnitPrice, TotalPrice) VALUES (?, ?, ?, ?, ?)',
+                           [(po_id, item['MaterialID'], item['Quantity'], item['UnitPrice'], item['TotalPrice']) for item in items])
+        created.append((po_id, supplier_id, items))
+    return created
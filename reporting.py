@@ -0,0 +1,209 @@
+from datetime import datetime
+import os
+import sqlite3
+import threading
+import time
+
+import click
+from flask import current_app, g
+from flask.cli import with_appcontext
+
+from partitions import PartitionedBackend, attach_partitions
+from storage import dialect
+from storage.sqlite import connect
+
+# --- Reporting connections ---
+# Report views read through get_report_connection() instead of
+# get_db_connection(). In 'snapshot' mode (the default) they read a copy of
+# the database made with the online backup API and refreshed once it is
+# older than REPORT_SNAPSHOT_MAX_AGE, so long report scans hold no locks on
+# the operational file. In 'readonly' mode, and on PostgreSQL, they read
+# the live database over a read-only connection instead. Either way the connection is read-only and the data's age
+# is shown on the page (base.html) and sent as X-Data-As-Of. With
+# PLANT_PARTITIONS each plant file is snapshotted alongside the shared one.
+#
+# Only the first snapshot (or one missing a table a report needs) is taken
+# inside a request. Once a snapshot is stale, the request reads it as it
+# is and a background thread copies a fresh one from a read-only
+# connection. With the database in WAL mode (SQLITE_WAL) the copy is one
+# step: it reads a consistent snapshot without blocking writers, and writes
+# cannot restart it. Otherwise it proceeds REPORT_SNAPSHOT_PAGES pages at a
+# time, pausing REPORT_SNAPSHOT_SLEEP seconds between steps so writers are
+# not held off for the whole copy. Every write to the source restarts such
+# a copy, so after REPORT_SNAPSHOT_RESTARTS restarts it is finished in one
+# step instead. The age shown is that of the last successful snapshot;
+# pages warn once it is older than REPORT_SNAPSHOT_WARN_AGE.
+#
+# Pages that users are sent back to after a write (CRM, finance,
+# production) list their rows from the live database. Only their heavy
+# aggregates read the snapshot.
+
+_refresh_lock = threading.Lock()
+_background = None
+_inline_lock = threading.Lock()
+
+
+def snapshot_path(app=None):
+    app = app or current_app
+    return app.config['REPORT_SNAPSHOT_PATH'] or os.path.join(app.instance_path, 'report_snapshot.db')
+
+
+class _Restarted(Exception):
+    pass
+
+
+def refresh_snapshot(database, target, pages=-1, sleep=0.25, restarts=3):
+    """Copy ``database`` to ``target`` with the backup API and swap it in atomically.
+
+    ``pages``/``sleep`` step the copy as in sqlite3's backup(); the default
+    copies in one step, as does a ``database`` in WAL mode. A stepped copy
+    restarted by writes more than ``restarts`` times is redone in one step.
+    Readers holding the previous snapshot open keep reading it undisturbed.
+    Returns the time the copy was taken.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+    tmp = f'{target}.{os.getpid()}.{threading.get_ident()}.tmp'
+    src = connect(database, read_only=True)
+    dst = sqlite3.connect(tmp)
+    try:
+        if pages > 0 and src.execute('PRAGMA journal_mode').fetchone()[0] == 'wal':
+            pages = -1
+        left = [None, 0]  # pages remaining after the last step, restarts seen
+
+        def progress(status, remaining, total):
+            if left[0] is not None and remaining > left[0]:
+                left[1] += 1
+                if left[1] > restarts:
+                    raise _Restarted()
+            left[0] = remaining
+
+        taken = time.time()
+        try:
+            src.backup(dst, pages=pages, sleep=sleep, progress=progress if pages > 0 else None)
+        except _Restarted:
+            taken = time.time()
+            src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+    # The snapshot's mtime records when the copy was taken, for every worker.
+    os.utime(tmp, (taken, taken))
+    os.replace(tmp, target)
+    return taken
+
+
+def _partition_snapshot(target, plant_id):
+    return f'{target}.plant_{plant_id}'
+
+
+def _refresh(backend, target, pages=-1, sleep=0.25, restarts=3):
+    taken = refresh_snapshot(backend.database, target, pages, sleep, restarts)
+    if isinstance(backend, PartitionedBackend):
+        for plant_id in backend.plant_ids():
+            refresh_snapshot(backend.path(plant_id), _partition_snapshot(target, plant_id), pages, sleep, restarts)
+    return taken
+
+
+def _refresh_in_background(app, backend, target):
+    """Start a stepped snapshot refresh in a thread, unless one is already running."""
+    global _background
+    with _refresh_lock:
+        if _background is not None and _background.is_alive():
+            return
+
+        def run():
+            try:
+                _refresh(backend, target, app.config['REPORT_SNAPSHOT_PAGES'], app.config['REPORT_SNAPSHOT_SLEEP'],
+                         app.config['REPORT_SNAPSHOT_RESTARTS'])
+            except Exception:
+                app.logger.exception('Report snapshot refresh failed')
+
+        _background = threading.Thread(target=run, name='report-snapshot', daemon=True)
+        _background.start()
+
+
+def _open_snapshot(backend, target):
+    conn = connect(target, current_app.config['SQLITE_TIMEOUT'], read_only=True)
+    if isinstance(backend, PartitionedBackend):
+        paths = {plant_id: _partition_snapshot(target, plant_id) for plant_id in backend.plant_ids()}
+        attach_partitions(conn, {plant_id: path for plant_id, path in paths.items() if os.path.exists(path)}, read_only=True)
+    return conn
+
+
+def _snapshot_time(target):
+    try:
+        return os.path.getmtime(target)
+    except OSError:
+        return None
+
+
+def _missing_tables(conn, tables):
+    return [t for t in tables if not dialect(conn).table_exists(conn, t)]
+
+
+def get_report_connection(tables=()):
+    """Read-only connection for report views.
+
+    ``tables`` lists tables the report needs; a snapshot taken before they
+    were created is refreshed early. Backends other than SQLite always use
+    a read-only connection to the live database.
+    """
+    config = current_app.config
+    backend = current_app.extensions['storage']
+    if config['REPORTING_MODE'] == 'readonly' or backend.dialect.name != 'sqlite':
+        g.report_as_of = datetime.now()
+        return backend.connect(read_only=True)
+
+    target = snapshot_path()
+    taken = _snapshot_time(target)
+    if taken is None:
+        with _inline_lock:
+            # Another request may have taken it while this one waited.
+            taken = _snapshot_time(target) or _refresh(backend, target)
+    elif time.time() - taken > config['REPORT_SNAPSHOT_MAX_AGE']:
+        _refresh_in_background(current_app._get_current_object(), backend, target)
+    conn = _open_snapshot(backend, target)
+    if _missing_tables(conn, tables):
+        conn.close()
+        with _inline_lock:
+            taken = _refresh(backend, target)
+            conn = _open_snapshot(backend, target)
+    g.report_as_of = datetime.fromtimestamp(taken)
+    return conn
+
+
+def report_age_seconds():
+    as_of = g.get('report_as_of')
+    return None if as_of is None else max(int((datetime.now() - as_of).total_seconds()), 0)
+
+
+def report_is_stale():
+    """True when the report data is older than REPORT_SNAPSHOT_WARN_AGE (refreshes keep failing)."""
+    age = report_age_seconds()
+    return age is not None and age > current_app.config['REPORT_SNAPSHOT_WARN_AGE']
+
+
+@click.command('refresh-report-snapshot')
+@with_appcontext
+def refresh_report_snapshot_command():
+    """Refresh the reporting snapshot now (e.g. from cron)."""
+    backend = current_app.extensions['storage']
+    if backend.dialect.name != 'sqlite':
+        raise click.UsageError('Report snapshots are only used with the SQLite backend.')
+    taken = _refresh(backend, snapshot_path())
+    click.echo(f'Report snapshot written to {snapshot_path()} at {datetime.fromtimestamp(taken):%Y-%m-%d %H:%M:%S}')
+
+
+def init_app(app):
+    @app.context_processor
+    def inject_report_age():
+        return {'report_age_seconds': report_age_seconds, 'report_is_stale': report_is_stale}
+
+    @app.after_request
+    def add_report_header(response):
+        as_of = g.get('report_as_of')
+        if as_of is not None:
+            response.headers['X-Data-As-Of'] = as_of.isoformat(timespec='seconds')
+        return response
+
+    app.cli.add_command(refresh_report_snapshot_command)
@@ -0,0 +1,227 @@
+from locations import plant_resolver
+from partitions import bookkeeping, shared_schema
+from storage import dialect
+
+# --- Sales cube ---
+# SalesCube holds order volume and invoice revenue pre-aggregated by
+# customer, product, plant and month. Order and invoice write paths apply
+# their delta in the same transaction, so reports read the cube instead
+# of scanning Orders and Invoices.
+#
+# An order's plant is that of its latest production batch, else the plant
+# serving its DeliverySite; a new batch moves the order (and its invoices)
+# to the batch's plant. Invoices are booked against their order's product
+# and plant (Invoices.OrderID); invoices without an order against
+# ProductID 0 / PlantID 0, which shows up under 'All' when rolling up.
+#
+# Cells are worked out when the change is made and only the deltas are
+# queued on plant connections: the shared file that replays them holds no
+# partitioned batches to look plants up in.
+
+DIMENSIONS = {
+    'customer': 'CustomerID',
+    'product': 'ProductID',
+    'plant': 'PlantID',
+    'month': 'Month',
+}
+MEASURES = ('OrderCount', 'Volume', 'InvoiceCount', 'Revenue')
+EXCLUDED_ORDER_STATUSES = ('Cancelled',)
+LATEST_BATCH_PLANT = '''
+    SELECT pb.PlantLocationID FROM ProductionBatch pb
+    WHERE pb.OrderID = {order} AND pb.PlantLocationID IS NOT NULL
+    ORDER BY pb.BatchID DESC LIMIT 1
+'''
+
+
+def ensure_schema(conn):
+    """Create SalesCube, built from Orders and Invoices, and Invoices.OrderID. Does not commit."""
+    ensure_invoice_orders(conn)
+    if dialect(conn).table_exists(conn, 'SalesCube'):
+        return
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS SalesCube (
+            CustomerID INTEGER NOT NULL,
+            ProductID INTEGER NOT NULL,
+            PlantID INTEGER NOT NULL,
+            Month TEXT NOT NULL,
+            OrderCount INTEGER NOT NULL DEFAULT 0,
+            Volume REAL NOT NULL DEFAULT 0,
+            InvoiceCount INTEGER NOT NULL DEFAULT 0,
+            Revenue REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (CustomerID, ProductID, PlantID, Month)
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sales_cube_month ON SalesCube(Month)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sales_cube_product ON SalesCube(ProductID, Month)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sales_cube_plant ON SalesCube(PlantID, Month)')
+    rebuild(conn)
+
+
+def ensure_invoice_orders(conn):
+    """Add Invoices.OrderID to databases whose invoices predate it. Does not commit."""
+    if not dialect(conn).table_exists(conn, 'Invoices'):
+        return
+    columns = [name.lower() for name, *_ in conn.execute('SELECT * FROM Invoices LIMIT 0').description]
+    if 'orderid' not in columns:
+        schema = shared_schema(conn)
+        conn.execute(f'ALTER TABLE {schema}Invoices ADD COLUMN OrderID INTEGER')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {schema}idx_invoices_order ON Invoices(OrderID)')
+
+
+def _bump(conn, customer_id, product_id, plant_id, month, order_count=0, volume=0, invoice_count=0, revenue=0):
+    conn.execute('''
+        INSERT INTO SalesCube (CustomerID, ProductID, PlantID, Month, OrderCount, Volume, InvoiceCount, Revenue)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (CustomerID, ProductID, PlantID, Month) DO UPDATE SET
+            OrderCount = SalesCube.OrderCount + excluded.OrderCount,
+            Volume = SalesCube.Volume + excluded.Volume,
+            InvoiceCount = SalesCube.InvoiceCount + excluded.InvoiceCount,
+            Revenue = SalesCube.Revenue + excluded.Revenue
+    ''', (customer_id or 0, product_id or 0, plant_id or 0, month, order_count, volume, invoice_count, revenue))
+
+
+def _prune(conn, customer_id, product_id, plant_id, month):
+    conn.execute('DELETE FROM SalesCube WHERE CustomerID = ? AND ProductID = ? AND PlantID = ? AND Month = ? AND OrderCount = 0 AND InvoiceCount = 0',
+                 (customer_id or 0, product_id or 0, plant_id or 0, month))
+
+
+@bookkeeping
+def _apply(conn, deltas):
+    """Add ``deltas``, [(CustomerID, ProductID, PlantID, Month, OrderCount, Volume, InvoiceCount, Revenue)], to the cube."""
+    for customer_id, product_id, plant_id, month, order_count, volume, invoice_count, revenue in deltas:
+        _bump(conn, customer_id, product_id, plant_id, month, order_count, volume, invoice_count, revenue)
+        if order_count < 0 or invoice_count < 0:
+            _prune(conn, customer_id, product_id, plant_id, month)
+
+
+def order_plant(conn, order):
+    """Plant LocationID of ``order``: its latest batch's, else the one serving its DeliverySite."""
+    row = conn.execute(LATEST_BATCH_PLANT.format(order='?'), (order['OrderID'],)).fetchone()
+    return row[0] if row else plant_resolver(conn)(order['DeliverySite'])
+
+
+def _order_cell(conn, order, plant_id=None):
+    if order is None or order['Status'] in EXCLUDED_ORDER_STATUSES or not order['OrderDate']:
+        return None
+    if plant_id is None:
+        plant_id = order_plant(conn, order)
+    return (order['CustomerID'], order['ProductID'], plant_id, str(order['OrderDate'])[:7], float(order['Quantity'] or 0))
+
+
+def apply_order_change(conn, before, after):
+    """Move an order's contribution from its ``before`` row to its ``after`` row.
+
+    Pass ``before=None`` for inserts and ``after=None`` for deletes. Rows
+    are mappings with OrderID, CustomerID, ProductID, Quantity, OrderDate,
+    DeliverySite and Status. Does not commit.
+    """
+    deltas = []
+    old = _order_cell(conn, before)
+    new = _order_cell(conn, after)
+    if old:
+        deltas.append((*old[:4], -1, -old[4], 0, 0))
+    if new:
+        deltas.append((*new[:4], 1, new[4], 0, 0))
+    if deltas:
+        _apply(conn, deltas)
+
+
+def move_order_plant(conn, order, old_plant):
+    """Move ``order`` and its invoices from ``old_plant`` to the plant it has now (see order_plant). Does not commit."""
+    new_plant = order_plant(conn, order)
+    if new_plant == old_plant:
+        return
+    deltas = []
+    cell = _order_cell(conn, order, old_plant)
+    if cell:
+        deltas.append((*cell[:4], -1, -cell[4], 0, 0))
+        deltas.append((*cell[:2], new_plant, cell[3], 1, cell[4], 0, 0))
+    for row in conn.execute('SELECT Amount, Date FROM Invoices WHERE OrderID = ? AND Date IS NOT NULL', (order['OrderID'],)):
+        month, amount = str(row['Date'])[:7], float(row['Amount'] or 0)
+        deltas.append((order['CustomerID'], order['ProductID'], old_plant, month, 0, 0, -1, -amount))
+        deltas.append((order['CustomerID'], order['ProductID'], new_plant, month, 0, 0, 1, amount))
+    if deltas:
+        _apply(conn, deltas)
+
+
+def apply_invoice(conn, customer_id, amount, invoice_date, sign=1, order=None):
+    """Book (or with ``sign=-1`` reverse) an invoice's revenue, against ``order``'s product and plant if given. Does not commit."""
+    product_id, plant_id = (order['ProductID'], order_plant(conn, order)) if order is not None else (0, 0)
+    _apply(conn, [(customer_id, product_id, plant_id, str(invoice_date)[:7], 0, 0, sign, sign * float(amount or 0))])
+
+
+def rebuild(conn):
+    """Recompute the cube from Orders and Invoices (full scan; used once on creation)."""
+    conn.execute('DELETE FROM SalesCube')
+    resolve = plant_resolver(conn)
+    month = dialect(conn).month
+    placeholders = ', '.join('?' for _ in EXCLUDED_ORDER_STATUSES)
+    cells = {}
+    for row in conn.execute(f'''
+        SELECT CustomerID, ProductID, DeliverySite, ({LATEST_BATCH_PLANT.format(order='o.OrderID')}) AS BatchPlant,
+               {month('OrderDate')} AS Month, COUNT(*) AS OrderCount, SUM(Quantity) AS Volume
+        FROM Orders o
+        WHERE OrderDate IS NOT NULL AND Status NOT IN ({placeholders})
+        GROUP BY CustomerID, ProductID, DeliverySite, BatchPlant, Month
+    ''', EXCLUDED_ORDER_STATUSES):
+        plant_id = row['BatchPlant'] if row['BatchPlant'] is not None else resolve(row['DeliverySite'])
+        key = (row['CustomerID'] or 0, row['ProductID'] or 0, plant_id, row['Month'])
+        cell = cells.setdefault(key, [0, 0.0, 0, 0.0])
+        cell[0] += row['OrderCount']
+        cell[1] += row['Volume'] or 0
+
+    if dialect(conn).table_exists(conn, 'Invoices'):
+        for row in conn.execute(f'''
+            SELECT i.CustomerID, o.OrderID, o.ProductID, o.DeliverySite,
+                   ({LATEST_BATCH_PLANT.format(order='o.OrderID')}) AS BatchPlant,
+                   {month('i.Date')} AS Month, COUNT(*) AS InvoiceCount, SUM(i.Amount) AS Revenue
+            FROM Invoices i
+            LEFT JOIN Orders o ON o.OrderID = i.OrderID
+            WHERE i.Date IS NOT NULL
+            GROUP BY i.CustomerID, o.OrderID, o.ProductID, o.DeliverySite, BatchPlant, Month
+        '''):
+            if row['OrderID'] is None:
+                product_id = plant_id = 0
+            else:
+                product_id = row['ProductID'] or 0
+                plant_id = row['BatchPlant'] if row['BatchPlant'] is not None else resolve(row['DeliverySite'])
+            cell = cells.setdefault((row['CustomerID'] or 0, product_id, plant_id, row['Month']), [0, 0.0, 0, 0.0])
+            cell[2] += row['InvoiceCount']
+            cell[3] += row['Revenue'] or 0
+
+    conn.executemany('INSERT INTO SalesCube (CustomerID, ProductID, PlantID, Month, OrderCount, Volume, InvoiceCount, Revenue) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                     [(*key, *cell) for key, cell in cells.items()])
+
+
+def query(conn, group_by=('month',), filters=None, month_from=None, month_to=None):
+    """Slice, dice and roll up the cube.
+
+    ``group_by`` names the dimensions to keep (any of ``DIMENSIONS``);
+    every other dimension is rolled up. ``filters`` maps dimension names
+    to a value or list of values. Month bounds are inclusive 'YYYY-MM'.
+    """
+    unknown = [d for d in group_by if d not in DIMENSIONS]
+    unknown += [d for d in (filters or {}) if d not in DIMENSIONS]
+    if unknown:
+        raise ValueError(f"Unknown dimension(s): {', '.join(unknown)}")
+
+    columns = [DIMENSIONS[d] for d in group_by]
+    where, params = [], []
+    for dim, value in (filters or {}).items():
+        values = value if isinstance(value, (list, tuple)) else [value]
+        where.append(f"{DIMENSIONS[dim]} IN ({', '.join('?' for _ in values)})")
+        params.extend(values)
+    if month_from:
+        where.append('Month >= ?')
+        params.append(month_from)
+    if month_to:
+        where.append('Month <= ?')
+        params.append(month_to)
+
+    select = ', '.join(columns + [f'SUM({m}) AS {m}' for m in MEASURES])
+    sql = f'SELECT {select} FROM SalesCube'
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    if columns:
+        sql += ' GROUP BY ' + ', '.join(columns) + ' ORDER BY ' + ', '.join(columns)
+    return [dict(row) for row in conn.execute(sql, params).fetchall()]
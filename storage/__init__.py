@@ -0,0 +1,100 @@
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from werkzeug.utils import import_string
+
+from storage.sqlite import SQLiteConnection, connect
+
+# --- Storage backends ---
+# get_db_connection() asks the app's backend for a connection. The SQLite
+# backend (DATABASE, the default) and the pooled PostgreSQL backend
+# (DATABASE_URL=postgresql://...) both hand out connections with the part
+# of the sqlite3 API the app uses: execute/executemany with ? placeholders,
+# rows addressable by column name, cursor.lastrowid, commit/rollback/close.
+# SQL that differs between engines is built through ``conn.dialect`` (or
+# dialect(conn) in engine modules that may be handed a plain sqlite3
+# connection).
+
+BACKENDS = {
+    'sqlite': 'storage.sqlite:SQLiteBackend',
+    'postgresql': 'storage.postgres:PostgresBackend',
+}
+
+# Tables that are per-database bookkeeping rather than data.
+SKIP_ON_COPY = ('sqlite_sequence', 'TableVersions')
+
+
+def dialect(conn):
+    """SQL dialect of ``conn``; plain sqlite3 connections count as SQLite."""
+    return getattr(conn, 'dialect', SQLiteConnection.dialect)
+
+
+def create_backend(config):
+    url = config.get('DATABASE_URL')
+    if not url:
+        return import_string(BACKENDS['sqlite'])(config['DATABASE'], timeout=config['SQLITE_TIMEOUT'], wal=config['SQLITE_WAL'])
+    scheme = url.split(':', 1)[0].split('+', 1)[0]
+    if scheme == 'postgres':
+        scheme = 'postgresql'
+    if scheme not in BACKENDS:
+        raise ValueError(f'Unsupported DATABASE_URL scheme: {scheme}')
+    if scheme == 'sqlite':
+        return import_string(BACKENDS['sqlite'])(url.split(':///', 1)[-1], timeout=config['SQLITE_TIMEOUT'], wal=config['SQLITE_WAL'])
+    return import_string(BACKENDS[scheme])(url, min_size=config['DB_POOL_MIN'], max_size=config['DB_POOL_MAX'])
+
+
+def copy_database(source, target, echo=print):
+    """Copy every table and index of the SQLite connection ``source`` into ``target``.
+
+    Tables that already hold rows in ``target`` are left alone. Commits.
+    """
+    existing = {name.lower() for name in dialect(target).table_names(target)}
+    tables = source.execute("SELECT name, sql FROM sqlite_master WHERE type='table' AND sql IS NOT NULL ORDER BY rowid").fetchall()
+    for table in tables:
+        name = table['name']
+        if name in SKIP_ON_COPY:
+            continue
+        if name.lower() in existing and target.execute(f'SELECT 1 FROM {name} LIMIT 1').fetchone():
+            echo(f'{name}: already has rows, skipped')
+            continue
+        target.execute(table['sql'].replace('CREATE TABLE ', 'CREATE TABLE IF NOT EXISTS ', 1))
+        # SQLite accepts '' in any column; typed columns get NULL instead.
+        columns = source.execute(f'PRAGMA table_info({name})').fetchall()
+        typed = [i for i, col in enumerate(columns) if col['type'].upper() not in ('', 'TEXT')]
+        rows = []
+        for row in source.execute(f'SELECT * FROM {name}'):
+            values = list(row)
+            for i in typed:
+                if values[i] == '':
+                    values[i] = None
+            rows.append(values)
+        if rows:
+            names = ', '.join(col['name'] for col in columns)
+            target.executemany(f"INSERT INTO {name} ({names}) VALUES ({', '.join('?' for _ in columns)})", rows)
+        key = next((col['name'] for col in columns if col['pk']), None)
+        if key and dialect(target).name == 'postgresql':
+            target.execute(f"SELECT setval(pg_get_serial_sequence('{name.lower()}', '{key.lower()}'), COALESCE(MAX({key}), 0) + 1, false) FROM {name}")
+        echo(f'{name}: {len(rows)} rows')
+    for index in source.execute("SELECT sql FROM sqlite_master WHERE type='index' AND sql IS NOT NULL"):
+        target.execute(index['sql'].replace('CREATE INDEX ', 'CREATE INDEX IF NOT EXISTS ', 1))
+    target.commit()
+
+
+@click.command('copy-db')
+@click.argument('url')
+@with_appcontext
+def copy_db_command(url):
+    """Copy the configured SQLite database into the database at URL."""
+    config = current_app.config
+    source = connect(config['DATABASE'], config['SQLITE_TIMEOUT'], read_only=True)
+    target = create_backend(dict(config, DATABASE_URL=url)).connect()
+    try:
+        copy_database(source, target, click.echo)
+    finally:
+        target.close()
+        source.close()
+
+
+def init_app(app):
+    app.extensions['storage'] = create_backend(app.config)
+    app.cli.add_command(copy_db_command)
@@ -0,0 +1,14 @@
+# --- Connection hooks ---
+# Every connection the backends hand out, SQLite or PostgreSQL, is passed
+# through the functions in on_connect, which return it (possibly
+# instrumented). The list is empty unless a module registers a hook; the
+# request profiler (profiler.py) uses one to trace the SQL of profiled
+# requests.
+
+on_connect = []
+
+
+def connected(conn):
+    for hook in on_connect:
+        conn = hook(conn)
+    return conn
@@ -0,0 +1,372 @@
+from functools import lru_cache
+import os
+import re
+import threading
+
+try:
+    import psycopg2
+    import psycopg2.extensions
+    import psycopg2.extras
+    import psycopg2.pool
+except ImportError:  # optional: only needed with DATABASE_URL=postgresql://...
+    psycopg2 = None
+
+from storage.hooks import connected
+
+# --- PostgreSQL backend ---
+# Pooled psycopg2 connections wrapped to look like the sqlite3 connections
+# the app was written against. Statements are translated once per distinct
+# SQL string: ? placeholders become %s, SQLite column types in CREATE TABLE
+# map to PostgreSQL ones, and INSERTs into tables with a serial key get a
+# RETURNING clause so cursor.lastrowid works. Dates, times and NUMERIC come
+# back as strings and floats, as they do from SQLite.
+
+
+class PostgresDialect:
+    name = 'postgresql'
+    like = 'ILIKE'
+
+    def hours_between(self, end, start):
+        return f'(EXTRACT(EPOCH FROM ({end}) - ({start})) / 3600)'
+
+    def date_offset(self, days=0):
+        """Today's date shifted by ``days``, as an SQL expression."""
+        return f'(CURRENT_DATE + {int(days)})' if days else 'CURRENT_DATE'
+
+    def month(self, expr):
+        """'YYYY-MM' of a date/datetime expression."""
+        return f"to_char({expr}, 'YYYY-MM')"
+
+    def group_concat(self, expr, separator=', '):
+        return f"string_agg(CAST({expr} AS TEXT), '{separator}')"
+
+    def least(self, *exprs):
+        return f"LEAST({', '.join(exprs)})"
+
+    def greatest(self, *exprs):
+        return f"GREATEST({', '.join(exprs)})"
+
+    def table_names(self, conn):
+        return {row[0] for row in conn.execute('SELECT table_name FROM information_schema.tables WHERE table_schema = current_schema()')}
+
+    def table_exists(self, conn, name):
+        return name.lower() in {table.lower() for table in self.table_names(conn)}
+
+    # Writers do not update a shared TableVersions row, which would hold
+    # its lock until commit and queue every transaction writing the table
+    # behind the one before. The trigger instead logs (counter, txid_current())
+    # once per transaction, and a counter's version is its TableVersions base
+    # plus its logged transactions. About one transaction in
+    # VERSION_FOLD_ODDS folds the committed log rows into the base.
+    versions_source = 'CurrentTableVersions'
+    VERSION_FOLD_ODDS = 100
+
+    def version_triggers(self, table, counter=None, events=('INSERT', 'UPDATE', 'DELETE')):
+        """DDL bumping the version of TableVersions row ``counter`` (default ``table``) on ``events`` (see query_cache)."""
+        counter = counter or table
+        name = counter.replace('.', '_')
+        return [
+            'CREATE TABLE IF NOT EXISTS TableVersionLog (TableName TEXT NOT NULL, TxID BIGINT NOT NULL, PRIMARY KEY (TableName, TxID))',
+            '''
+            CREATE OR REPLACE VIEW CurrentTableVersions AS
+            SELECT v.TableName, v.Version + (SELECT COUNT(*) FROM TableVersionLog l WHERE l.TableName = v.TableName) AS Version
+            FROM TableVersions v
+            ''',
+            f'''
+            CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+            DECLARE
+                folded BIGINT;
+            BEGIN
+                INSERT INTO TableVersionLog (TableName, TxID) VALUES (TG_ARGV[0], txid_current()) ON CONFLICT DO NOTHING;
+                IF random() * {self.VERSION_FOLD_ODDS} < 1 THEN
+                    WITH gone AS (
+                        DELETE FROM TableVersionLog WHERE TableName = TG_ARGV[0] AND TxID <> txid_current() RETURNING 1
+                    )
+                    SELECT COUNT(*) INTO folded FROM gone;
+                    UPDATE TableVersions SET Version = Version + folded WHERE TableName = TG_ARGV[0];
+                END IF;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+            ''',
+            f'DROP TRIGGER IF EXISTS trg_version_{name} ON {table}',
+            f'''
+            CREATE TRIGGER trg_version_{name}
+            AFTER {' OR '.join(events)} ON {table}
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version('{counter}')
+            ''',
+        ]
+
+
+# --- Statement translation ---
+_TOKEN_RE = re.compile(r"""('(?:[^']|'')*'|"[^"]*"|\$\$.*?\$\$|--[^\n]*|\?|%)""", re.S)
+_IDENT_RE = re.compile(r'\b[A-Za-z_][A-Za-z0-9_]*\b')
+_INSERT_RE = re.compile(r'^\s*INSERT\s+(?:OR\s+IGNORE\s+)?INTO\s+([A-Za-z_][A-Za-z0-9_]*)', re.I)
+_DDL_TYPES = [
+    (re.compile(r'\bINTEGER\s+PRIMARY\s+KEY\s+AUTOINCREMENT\b', re.I), 'SERIAL PRIMARY KEY'),
+    (re.compile(r'\bDATETIME\b', re.I), 'TIMESTAMP'),
+    (re.compile(r'\bREAL\b', re.I), 'DOUBLE PRECISION'),
+    (re.compile(r'\bBOOLEAN\b', re.I), 'INTEGER'),
+    (re.compile(r'\bBLOB\b', re.I), 'BYTEA'),
+    # SQLite does not enforce these here (foreign_keys is off), so neither do we.
+    (re.compile(r',\s*FOREIGN\s+KEY\s*\([^)]*\)\s*REFERENCES\s+\w+\s*\([^)]*\)', re.I), ''),
+]
+
+
+@lru_cache(maxsize=2048)
+def translate(sql):
+    """Return (postgres_sql, insert_table, column_names) for an SQLite-style statement.
+
+    ``column_names`` maps lower-cased identifiers in the statement to their
+    spelling, so row keys keep the case the query asked for.
+    """
+    def swap(match):
+        token = match.group(0)
+        if token == '?':
+            return '%s'
+        # psycopg2 reads % as a placeholder everywhere, literals included.
+        return token.replace('%', '%%')
+
+    text = _TOKEN_RE.sub(swap, sql)
+    head = text.lstrip()[:12].upper()
+    if head.startswith('CREATE TABLE'):
+        for pattern, replacement in _DDL_TYPES:
+            text = pattern.sub(replacement, text)
+    insert = _INSERT_RE.match(text)
+    if re.match(r'\s*INSERT\s+OR\s+REPLACE', text, re.I):
+        # REPLACE deletes the conflicting row first; there is no faithful
+        # rewrite without knowing the key, so make the caller spell it out.
+        raise ValueError('INSERT OR REPLACE is SQLite-only; use INSERT ... ON CONFLICT (...) DO UPDATE')
+    if insert and re.match(r'\s*INSERT\s+OR\s+IGNORE', text, re.I):
+        text = re.sub(r'INSERT\s+OR\s+IGNORE', 'INSERT', text, count=1, flags=re.I).rstrip().rstrip(';') + ' ON CONFLICT DO NOTHING'
+    names = {name.lower(): name for name in _IDENT_RE.findall(sql)}
+    return text, insert.group(1).lower() if insert else None, names
+
+
+class Row:
+    """sqlite3.Row look-alike: index by position or case-insensitive column name."""
+
+    __slots__ = ('_values', '_keys', '_index')
+
+    def __init__(self, values, keys, index):
+        self._values = values
+        self._keys = keys
+        self._index = index
+
+    def keys(self):
+        return list(self._keys)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            try:
+                return self._values[self._index[key.lower()]]
+            except KeyError:
+                raise IndexError('No item with that key') from None
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __eq__(self, other):
+        return isinstance(other, Row) and self._keys == other._keys and self._values == other._values
+
+    def __repr__(self):
+        return f'<Row {dict(zip(self._keys, self._values))!r}>'
+
+
+class PgCursor:
+    def __init__(self, conn):
+        self.connection = conn
+        self._cursor = conn._raw.cursor()
+        self.lastrowid = None
+        self._keys = self._index = None
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def execute(self, sql, params=()):
+        text, table, names = translate(sql)
+        key = self.connection._backend.serial_column(self.connection, table) if table else None
+        if key and ' RETURNING ' not in text.upper():
+            text = f'{text.rstrip().rstrip(";")} RETURNING {key}'
+        self._cursor.execute(text, tuple(params))
+        self.lastrowid = self._cursor.fetchone()[0] if key and self._cursor.rowcount else None
+        self._describe(names)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        text, _, names = translate(sql)
+        psycopg2.extras.execute_batch(self._cursor, text, [tuple(p) for p in seq_of_params], page_size=500)
+        self.lastrowid = None
+        self._describe(names)
+        return self
+
+    def _describe(self, names):
+        if self._cursor.description is None:
+            self._keys = self._index = None
+            return
+        self._keys = tuple(names.get(col.name, col.name) for col in self._cursor.description)
+        self._index = {}
+        for i, key in enumerate(self._keys):
+            self._index.setdefault(key.lower(), i)
+
+    def _wrap(self, values):
+        return Row(values, self._keys, self._index)
+
+    def fetchone(self):
+        values = self._cursor.fetchone() if self._keys else None
+        return self._wrap(values) if values is not None else None
+
+    def fetchmany(self, size=None):
+        if not self._keys:
+            return []
+        return [self._wrap(v) for v in self._cursor.fetchmany(size or self._cursor.arraysize)]
+
+    def fetchall(self):
+        return [self._wrap(v) for v in self._cursor.fetchall()] if self._keys else []
+
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany(200)
+            if not rows:
+                return
+            yield from rows
+
+    def close(self):
+        self._cursor.close()
+
+
+class PgConnection:
+    dialect = PostgresDialect()
+
+    def __init__(self, backend, raw):
+        self._backend = backend
+        self._raw = raw
+        self.database = backend.url
+        self.row_factory = None  # accepted for sqlite3 compatibility; rows are always Row
+
+    def cursor(self):
+        return PgCursor(self)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def close(self):
+        if self._raw is not None:
+            self._backend.release(self._raw)
+            self._raw = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+
+@lru_cache(maxsize=None)
+def _result_types():
+    ext = psycopg2.extensions
+    temporal = ext.PYDATE.values + ext.PYTIME.values + ext.PYDATETIME.values + ext.PYDATETIMETZ.values
+    return (
+        ext.new_type(temporal, 'RMC_TEXT', lambda value, cursor: value),
+        ext.new_type(ext.DECIMAL.values, 'RMC_FLOAT', lambda value, cursor: float(value) if value is not None else None),
+    )
+
+
+class PostgresBackend:
+    """Per-process psycopg2 pool of at most ``max_size`` connections.
+
+    The pool is created lazily in each process, so a gunicorn master that
+    preloads the app never shares sockets with its workers. ``connect()``
+    blocks while every connection is checked out.
+    """
+
+    dialect = PgConnection.dialect
+
+    def __init__(self, url, min_size=1, max_size=10):
+        if psycopg2 is None:
+            raise RuntimeError('DATABASE_URL points at PostgreSQL but psycopg2 is not installed (pip install psycopg2-binary)')
+        self.url = url
+        self.min_size = min_size
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+        self._slots = None
+        self._serial = {}
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = psycopg2.pool.ThreadedConnectionPool(self.min_size, self.max_size, self.url)
+                self._pid = os.getpid()
+                self._slots = threading.BoundedSemaphore(self.max_size)
+            return self._pool, self._slots
+
+    def connect(self, read_only=False):
+        pool, slots = self._get_pool()
+        slots.acquire()
+        try:
+            raw = pool.getconn()
+            for result_type in _result_types():
+                psycopg2.extensions.register_type(result_type, raw)
+            raw.set_session(readonly=read_only)
+        except Exception:
+            slots.release()
+            raise
+        return connected(PgConnection(self, raw))
+
+    def release(self, raw):
+        pool, slots = self._pool, self._slots
+        try:
+            if not raw.closed:
+                raw.rollback()
+            pool.putconn(raw, close=bool(raw.closed))
+        except psycopg2.Error:
+            pool.putconn(raw, close=True)
+        finally:
+            slots.release()
+
+    def serial_column(self, conn, table):
+        """Name of ``table``'s serial key column, or None."""
+        if table in self._serial:
+            return self._serial[table]
+        cursor = conn._raw.cursor()
+        cursor.execute('''
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = %s AND column_default LIKE 'nextval(%%'
+        ''', (table,))
+        row = cursor.fetchone()
+        cursor.execute('SELECT 1 FROM information_schema.tables WHERE table_schema = current_schema() AND table_name = %s', (table,))
+        if cursor.fetchone():
+            # Only remember tables that exist; one created later is looked up again.
+            self._serial[table] = row[0] if row else None
+        cursor.close()
+        return row[0] if row else None
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.closeall()
+            self._pool = None
@@ -0,0 +1,105 @@
+from pathlib import Path
+import sqlite3
+
+from storage.hooks import connected
+
+
+class SQLiteDialect:
+    name = 'sqlite'
+    like = 'LIKE'  # already case-insensitive for ASCII
+    versions_source = 'TableVersions'
+
+    def hours_between(self, end, start):
+        return f'((JULIANDAY({end}) - JULIANDAY({start})) * 24)'
+
+    def date_offset(self, days=0):
+        """Today's date shifted by ``days``, as an SQL expression."""
+        return f"DATE('now', '{int(days):+d} days')" if days else "DATE('now')"
+
+    def month(self, expr):
+        """'YYYY-MM' of a date/datetime expression."""
+        return f'substr({expr}, 1, 7)'
+
+    def group_concat(self, expr, separator=', '):
+        return f"GROUP_CONCAT({expr}, '{separator}')"
+
+    def least(self, *exprs):
+        return f"MIN({', '.join(exprs)})"
+
+    def greatest(self, *exprs):
+        return f"MAX({', '.join(exprs)})"
+
+    # Only the main database is read, plus the shared one a plant connection
+    # (partitions.py) ATTACHes: the other attached files are plant
+    # partitions holding copies of tables main already has.
+
+    def _schemas(self, conn):
+        return ('main', 'shared') if getattr(conn, 'plant_id', None) is not None else ('main',)
+
+    def table_names(self, conn):
+        """Tables of the main database (and of the shared one on plant connections)."""
+        sql = ' UNION ALL '.join(f"SELECT name FROM {schema}.sqlite_master WHERE type='table'" for schema in self._schemas(conn))
+        return {row[0] for row in conn.execute(sql)}
+
+    def table_exists(self, conn, name):
+        sql = ' UNION ALL '.join(f"SELECT 1 FROM {schema}.sqlite_master WHERE type='table' AND name = ? COLLATE NOCASE" for schema in self._schemas(conn))
+        return conn.execute(sql, (name,) * len(self._schemas(conn))).fetchone() is not None
+
+    def version_triggers(self, table, counter=None, events=('INSERT', 'UPDATE', 'DELETE')):
+        """DDL bumping TableVersions row ``counter`` (default ``table``) on ``events`` (see query_cache)."""
+        counter = counter or table
+        name = counter.replace('.', '_')
+        return [f'''
+            CREATE TRIGGER IF NOT EXISTS main.trg_version_{name}_{event.lower()}
+            AFTER {event} ON {table}
+            BEGIN
+                UPDATE TableVersions SET Version = Version + 1 WHERE TableName = '{counter}';
+            END
+        ''' for event in events]
+
+
+class SQLiteConnection(sqlite3.Connection):
+    dialect = SQLiteDialect()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.row_factory = sqlite3.Row
+
+
+def connect(database, timeout=5.0, read_only=False):
+    if read_only:
+        conn = sqlite3.connect(Path(database).resolve().as_uri() + '?mode=ro', uri=True, timeout=timeout, factory=SQLiteConnection)
+    else:
+        conn = sqlite3.connect(database, timeout=timeout, factory=SQLiteConnection)
+    # What the connection reads, for caches shared between connections
+    # (query_cache); every in-memory database is a database of its own.
+    conn.database = f':memory:{id(conn)}' if database == ':memory:' else str(Path(database).resolve())
+    return connected(conn)
+
+
+class SQLiteBackend:
+    """One connection per request; SQLite needs no pool."""
+
+    dialect = SQLiteConnection.dialect
+
+    def __init__(self, database, timeout=5.0, wal=False):
+        self.database = database
+        self.timeout = timeout
+        self.wal = wal
+        self._wal_files = set()
+
+    def _ensure_wal(self, conn, path):
+        """Put ``path`` in WAL mode once per process; the mode is kept in the file."""
+        if not self.wal or path in self._wal_files:
+            return
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+        except sqlite3.OperationalError:
+            return  # busy; tried again on the next write connection
+        self._wal_files.add(path)
+
+    def connect(self, read_only=False):
+        conn = connect(self.database, self.timeout, read_only)
+        if not read_only:
+            self._ensure_wal(conn, self.database)
+        return conn
@@ -0,0 +1,48 @@
+from flask import Response, current_app, get_flashed_messages, stream_with_context
+
+# --- Streaming list pages ---
+# Large list views render through Jinja's template stream instead of
+# building one string: rows are pulled from the cursor as the template
+# loop consumes them and output is flushed every STREAM_BUFFER_SIZE
+# template chunks, so memory stays flat and the first byte goes out early.
+# The connection is closed with the response, not by the row generator,
+# which never finishes if the template skips the loop or the client leaves.
+
+
+def iter_rows(conn, sql, params=(), size=None):
+    """Yield rows of ``sql`` lazily in fetchmany batches.
+
+    Hand ``conn`` to stream_page() as well, which closes it with the response.
+    """
+    size = size or current_app.config['STREAM_FETCH_SIZE']
+    cursor = conn.execute(sql, params)
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            break
+        yield from rows
+
+
+def stream_page(template_name, conn=None, **context):
+    """Render ``template_name`` as a streamed, chunk-buffered HTML response.
+
+    ``conn`` (the connection iter_rows() reads from) is closed when the
+    response is, whether or not the template got to iterate the rows.
+    """
+    app = current_app._get_current_object()
+    try:
+        # Take flashed messages out of the session now: it is saved before the
+        # body streams. The template still reads them from the request context.
+        get_flashed_messages()
+        template = app.jinja_env.get_or_select_template(template_name)
+        app.update_template_context(context)
+        stream = template.stream(context)
+        stream.enable_buffering(app.config['STREAM_BUFFER_SIZE'])
+        response = Response(stream_with_context(stream), mimetype='text/html')
+    except BaseException:
+        if conn is not None:
+            conn.close()
+        raise
+    if conn is not None:
+        response.call_on_close(conn.close)
+    return response
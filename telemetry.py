@@ -0,0 +1,418 @@
+from datetime import datetime, timezone
+import atexit
+import math
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from storage import dialect
+
+# --- Telemetry ---
+# Plant controllers and transit-mixer GPS units post points (asset, id,
+# metric, time, value) to /api/telemetry. Points are buffered per process
+# and written in one transaction once TELEMETRY_BATCH_SIZE have queued or
+# the oldest is TELEMETRY_FLUSH_INTERVAL seconds old (a background thread
+# flushes quiet buffers; exit flushes what is left). A flush writes:
+#
+#   TelemetryBlocks_YYYYMM  raw points, one row per series per flush, with
+#                           times as millisecond deltas and values as
+#                           float32, zlib-compressed; one table per month,
+#                           so old raw data is dropped a table at a time
+#   TelemetryRollup         count/min/max/sum per series per minute
+#   TelemetryLatest         last value per series
+#
+# Charts and pages read the rollups (downsampled to any multiple of a
+# minute) and the latest values; raw blocks are decoded only on request.
+#
+# Point times must lie between the start of raw retention and one day
+# ahead. The buffer holds at most TELEMETRY_BUFFER_MAX points: uploads
+# beyond that are refused with 503 (nothing kept, so a retry is safe),
+# and an upload accepted into the buffer is answered 202 even if its
+# inline flush fails, since the points are still queued. Points a flush
+# fails on for reasons other than the database are dropped, not requeued.
+
+ASSET_TYPES = ('plant', 'batch', 'vehicle')
+BLOCK_PREFIX = 'TelemetryBlocks_'
+MAX_FUTURE_SECONDS = 24 * 3600
+# Errors from the points themselves; retrying the same points cannot help.
+DATA_ERRORS = (ArithmeticError, ValueError, OSError, struct.error)
+_METRIC_RE = re.compile(r'^[A-Za-z0-9_.]{1,64}$')
+
+
+def ensure_schema(conn):
+    if dialect(conn).table_exists(conn, 'TelemetryLatest'):
+        return
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS TelemetryRollup (
+            AssetType TEXT NOT NULL,
+            AssetID INTEGER NOT NULL,
+            Metric TEXT NOT NULL,
+            Minute INTEGER NOT NULL,
+            Count INTEGER NOT NULL,
+            MinValue REAL,
+            MaxValue REAL,
+            SumValue REAL,
+            PRIMARY KEY (AssetType, AssetID, Metric, Minute)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS TelemetryLatest (
+            AssetType TEXT NOT NULL,
+            AssetID INTEGER NOT NULL,
+            Metric TEXT NOT NULL,
+            Time REAL NOT NULL,
+            Value REAL,
+            PRIMARY KEY (AssetType, AssetID, Metric)
+        )
+    ''')
+
+
+def _block_table(conn, month):
+    table = f'{BLOCK_PREFIX}{month}'
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            AssetType TEXT NOT NULL,
+            AssetID INTEGER NOT NULL,
+            Metric TEXT NOT NULL,
+            StartTime REAL NOT NULL,
+            EndTime REAL NOT NULL,
+            Count INTEGER NOT NULL,
+            Points BLOB NOT NULL
+        )
+    ''')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table.lower()}_series ON {table}(AssetType, AssetID, Metric, StartTime)')
+    return table
+
+
+def block_months(conn):
+    prefix = BLOCK_PREFIX.lower()
+    return sorted(name[len(prefix):] for name in (n.lower() for n in dialect(conn).table_names(conn)) if name.startswith(prefix))
+
+
+# --- Encoding ---
+
+def encode(points):
+    """Pack time-sorted (time, value) pairs: ms offsets from the first point and float32 values."""
+    start = points[0][0]
+    offsets = [int(round((t - start) * 1000)) for t, _ in points]
+    values = [v for _, v in points]
+    return zlib.compress(struct.pack(f'<{len(points)}I{len(points)}f', *offsets, *values))
+
+
+def decode(start, count, blob):
+    raw = zlib.decompress(blob)
+    unpacked = struct.unpack(f'<{count}I{count}f', raw)
+    return [(start + unpacked[i] / 1000, unpacked[count + i]) for i in range(count)]
+
+
+# --- Ingestion ---
+
+def retention_start(months, now=None):
+    """Epoch of the first instant of the oldest raw month ``prune-telemetry --months`` keeps."""
+    now = datetime.now(timezone.utc) if now is None else datetime.fromtimestamp(now, timezone.utc)
+    index = max(now.year * 12 + now.month - 1 - (months - 1), 1970 * 12)
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc).timestamp()
+
+
+def parse_point(point, now=None, oldest=0):
+    """(asset_type, asset_id, metric, time, value) from an uploaded point; ValueError if malformed.
+
+    The time must lie between ``oldest`` and MAX_FUTURE_SECONDS after ``now``.
+    """
+    if not isinstance(point, dict):
+        raise ValueError('point must be an object')
+    asset = point.get('asset')
+    if asset not in ASSET_TYPES:
+        raise ValueError(f"asset must be one of {', '.join(ASSET_TYPES)}")
+    metric = point.get('metric')
+    if not isinstance(metric, str) or not _METRIC_RE.match(metric):
+        raise ValueError('metric must be 1-64 letters, digits, _ or .')
+    now = now or time.time()
+    try:
+        asset_id = int(point['id'])
+        value = float(point['v'])
+        at = float(point['t']) if point.get('t') is not None else now
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('id, v and t must be numbers') from None
+    if not (math.isfinite(value) and math.isfinite(at)):
+        raise ValueError('v and t must be finite')
+    if not max(oldest, 0) <= at <= now + MAX_FUTURE_SECONDS:
+        raise ValueError('t must be within raw retention and at most a day ahead')
+    return asset, asset_id, metric, at, value
+
+
+class BufferFull(Exception):
+    pass
+
+
+class TelemetryBuffer:
+    """Points waiting to be written; thread-safe."""
+
+    def __init__(self, batch_size=2000, flush_interval=2.0, max_points=100000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_points = max_points
+        self._lock = threading.Lock()
+        self._points = []
+        self._oldest = None
+        self.flushed = self.flushes = self.dropped = 0
+
+    def add(self, points):
+        """Queue ``points``; True when the buffer is due for a flush. Raises BufferFull, queuing nothing."""
+        with self._lock:
+            if len(self._points) + len(points) > self.max_points:
+                raise BufferFull(f'{len(self._points)} points already waiting')
+            if not self._points:
+                self._oldest = time.monotonic()
+            self._points.extend(points)
+            return len(self._points) >= self.batch_size
+
+    def due(self):
+        with self._lock:
+            return bool(self._points) and time.monotonic() - self._oldest >= self.flush_interval
+
+    def drain(self):
+        with self._lock:
+            points, self._points, self._oldest = self._points, [], None
+            return points
+
+    def requeue(self, points):
+        """Put unwritten points back in front; the newest beyond max_points are dropped."""
+        with self._lock:
+            if not self._points:
+                self._oldest = time.monotonic()
+            self._points[:0] = points
+            excess = len(self._points) - self.max_points
+            if excess > 0:
+                del self._points[-excess:]
+                self.dropped += excess
+
+    def __len__(self):
+        with self._lock:
+            return len(self._points)
+
+
+buffer = TelemetryBuffer()
+
+
+def write(conn, points):
+    """Write parsed points in one transaction. Commits."""
+    if not points:
+        return
+    ensure_schema(conn)
+    series = {}
+    for asset, asset_id, metric, at, value in points:
+        series.setdefault((asset, asset_id, metric), []).append((at, value))
+
+    blocks, rollups, latest = {}, {}, []
+    for key, samples in series.items():
+        samples.sort()
+        by_month = {}
+        for sample in samples:
+            by_month.setdefault(datetime.fromtimestamp(sample[0], timezone.utc).strftime('%Y%m'), []).append(sample)
+        for month, chunk in by_month.items():
+            blocks.setdefault(month, []).append((*key, chunk[0][0], chunk[-1][0], len(chunk), encode(chunk)))
+        for at, value in samples:
+            cell = rollups.setdefault((*key, int(at // 60)), [0, value, value, 0.0])
+            cell[0] += 1
+            cell[1] = min(cell[1], value)
+            cell[2] = max(cell[2], value)
+            cell[3] += value
+        latest.append((*key, *samples[-1]))
+
+    d = dialect(conn)
+    for month, rows in blocks.items():
+        table = _block_table(conn, month)
+        conn.executemany(f'INSERT INTO {table} (AssetType, AssetID, Metric, StartTime, EndTime, Count, Points) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+    conn.executemany(f'''
+        INSERT INTO TelemetryRollup (AssetType, AssetID, Metric, Minute, Count, MinValue, MaxValue, SumValue)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (AssetType, AssetID, Metric, Minute) DO UPDATE SET
+            Count = TelemetryRollup.Count + excluded.Count,
+            MinValue = {d.least('TelemetryRollup.MinValue', 'excluded.MinValue')},
+            MaxValue = {d.greatest('TelemetryRollup.MaxValue', 'excluded.MaxValue')},
+            SumValue = TelemetryRollup.SumValue + excluded.SumValue
+    ''', [(*key, *cell) for key, cell in rollups.items()])
+    conn.executemany('''
+        INSERT INTO TelemetryLatest (AssetType, AssetID, Metric, Time, Value) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (AssetType, AssetID, Metric) DO UPDATE SET Time = excluded.Time, Value = excluded.Value
+        WHERE excluded.Time >= TelemetryLatest.Time
+    ''', latest)
+    conn.commit()
+
+
+def flush(connect):
+    """Write everything buffered using a connection from ``connect()``; returns the point count.
+
+    Points go back to the buffer if the database write fails, and are
+    dropped if the points themselves cannot be written (DATA_ERRORS).
+    """
+    points = buffer.drain()
+    if not points:
+        return 0
+    conn = connect()
+    try:
+        write(conn, points)
+    except DATA_ERRORS:
+        conn.rollback()
+        buffer.dropped += len(points)
+        raise
+    except Exception:
+        buffer.requeue(points)
+        raise
+    finally:
+        conn.close()
+    buffer.flushed += len(points)
+    buffer.flushes += 1
+    return len(points)
+
+
+_flusher = {'pid': None}
+_flusher_lock = threading.Lock()
+
+
+def start_flusher(app):
+    """Start this process's background flush thread once (after fork too)."""
+    with _flusher_lock:
+        if _flusher['pid'] == os.getpid():
+            return
+        _flusher['pid'] = os.getpid()
+        backend = app.extensions['storage']
+
+        def run():
+            while True:
+                time.sleep(max(buffer.flush_interval / 2, 0.1))
+                if buffer.due():
+                    try:
+                        flush(backend.connect)
+                    except Exception:
+                        app.logger.exception('Telemetry flush failed')
+
+        threading.Thread(target=run, name='telemetry-flush', daemon=True).start()
+        atexit.register(lambda: flush(backend.connect))
+
+
+# --- Queries ---
+
+def series(conn, asset, asset_id, start, end, step=60, metrics=None):
+    """Downsampled series {metric: [{t, count, min, max, avg}]} from the minute rollups.
+
+    ``step`` is rounded to whole minutes; ``start``/``end`` are epoch seconds.
+    """
+    if not dialect(conn).table_exists(conn, 'TelemetryRollup'):
+        return {}
+    minutes = max(int(step) // 60, 1)
+    sql = f'''
+        SELECT Metric, (Minute / {minutes}) * {minutes} AS Bucket, SUM(Count) AS Count,
+               MIN(MinValue) AS MinValue, MAX(MaxValue) AS MaxValue, SUM(SumValue) AS SumValue
+        FROM TelemetryRollup
+        WHERE AssetType = ? AND AssetID = ? AND Minute >= ? AND Minute <= ?
+    '''
+    params = [asset, asset_id, int(start // 60), int(end // 60)]
+    if metrics:
+        sql += f" AND Metric IN ({', '.join('?' for _ in metrics)})"
+        params.extend(metrics)
+    sql += ' GROUP BY Metric, Bucket ORDER BY Metric, Bucket'
+    result = {}
+    for row in conn.execute(sql, params):
+        result.setdefault(row['Metric'], []).append({
+            't': row['Bucket'] * 60, 'count': row['Count'], 'min': row['MinValue'],
+            'max': row['MaxValue'], 'avg': row['SumValue'] / row['Count'] if row['Count'] else None,
+        })
+    return result
+
+
+def summary(conn, asset, asset_id):
+    """Per-metric totals over all time: {metric: {count, min, max, avg, last, last_time}}."""
+    if not dialect(conn).table_exists(conn, 'TelemetryRollup'):
+        return {}
+    result = {}
+    for row in conn.execute('''
+        SELECT r.Metric, SUM(r.Count) AS Count, MIN(r.MinValue) AS MinValue, MAX(r.MaxValue) AS MaxValue,
+               SUM(r.SumValue) AS SumValue, l.Value AS LastValue, l.Time AS LastTime
+        FROM TelemetryRollup r
+        LEFT JOIN TelemetryLatest l ON l.AssetType = r.AssetType AND l.AssetID = r.AssetID AND l.Metric = r.Metric
+        WHERE r.AssetType = ? AND r.AssetID = ?
+        GROUP BY r.Metric, l.Value, l.Time
+        ORDER BY r.Metric
+    ''', (asset, asset_id)):
+        result[row['Metric']] = {
+            'count': row['Count'], 'min': row['MinValue'], 'max': row['MaxValue'],
+            'avg': row['SumValue'] / row['Count'] if row['Count'] else None,
+            'last': row['LastValue'], 'last_time': _iso(row['LastTime']),
+        }
+    return result
+
+
+def latest(conn, asset, metrics=None):
+    """{asset_id: {metric: value, ..., 'time': iso of the newest}} for every asset of a type."""
+    if not dialect(conn).table_exists(conn, 'TelemetryLatest'):
+        return {}
+    sql = 'SELECT AssetID, Metric, Time, Value FROM TelemetryLatest WHERE AssetType = ?'
+    params = [asset]
+    if metrics:
+        sql += f" AND Metric IN ({', '.join('?' for _ in metrics)})"
+        params.extend(metrics)
+    result = {}
+    newest = {}
+    for row in conn.execute(sql, params):
+        result.setdefault(row['AssetID'], {})[row['Metric']] = row['Value']
+        newest[row['AssetID']] = max(newest.get(row['AssetID'], 0), row['Time'])
+    for asset_id, at in newest.items():
+        result[asset_id]['time'] = _iso(at)
+    return result
+
+
+def raw_points(conn, asset, asset_id, metric, start, end, limit=10000):
+    """Raw (time, value) points of one series between ``start`` and ``end``."""
+    points = []
+    first = datetime.fromtimestamp(start, timezone.utc).strftime('%Y%m')
+    last = datetime.fromtimestamp(end, timezone.utc).strftime('%Y%m')
+    for month in block_months(conn):
+        if not first <= month <= last:
+            continue
+        for row in conn.execute(f'''
+            SELECT StartTime, Count, Points FROM {BLOCK_PREFIX}{month}
+            WHERE AssetType = ? AND AssetID = ? AND Metric = ? AND EndTime >= ? AND StartTime <= ?
+            ORDER BY StartTime
+        ''', (asset, asset_id, metric, start, end)):
+            points.extend(p for p in decode(row['StartTime'], row['Count'], row['Points']) if start <= p[0] <= end)
+            if len(points) >= limit:
+                return sorted(points)[:limit]
+    return sorted(points)
+
+
+def _iso(epoch):
+    return None if epoch is None else datetime.fromtimestamp(epoch).isoformat(timespec='seconds')
+
+
+@click.command('prune-telemetry')
+@click.option('--months', type=int, default=None, help='Raw months to keep (default TELEMETRY_RAW_MONTHS).')
+@with_appcontext
+def prune_telemetry_command(months):
+    """Drop raw telemetry tables older than the retention window; rollups are kept."""
+    months = current_app.config['TELEMETRY_RAW_MONTHS'] if months is None else months
+    keep_from = datetime.fromtimestamp(retention_start(months), timezone.utc).strftime('%Y%m')
+    conn = current_app.extensions['storage'].connect()
+    try:
+        for month in block_months(conn):
+            if month < keep_from:
+                conn.execute(f'DROP TABLE {BLOCK_PREFIX}{month}')
+                click.echo(f'Dropped {BLOCK_PREFIX}{month}')
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def init_app(app):
+    buffer.batch_size = app.config['TELEMETRY_BATCH_SIZE']
+    buffer.flush_interval = app.config['TELEMETRY_FLUSH_INTERVAL']
+    buffer.max_points = app.config['TELEMETRY_BUFFER_MAX']
+    app.cli.add_command(prune_telemetry_command)
@@ -0,0 +1,33 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def app(tmp_path):
+    """An app on a scratch copy of the bundled database."""
+    from app import create_app
+
+    database = tmp_path / 'rmc.db'
+    shutil.copy(os.path.join(ROOT, 'rmc_erp_system.db'), database)
+    app = create_app({
+        'TESTING': True, 'DATABASE': str(database), 'DATABASE_URL': None, 'PLANT_PARTITIONS': False,
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads'), 'JINJA_CACHE_DIR': '',
+    })
+    app.instance_path = str(tmp_path / 'instance')
+    return app
+
+
+@pytest.fixture
+def conn(app):
+    from db import get_db_connection
+
+    with app.app_context():
+        conn = get_db_connection()
+        yield conn
+        conn.close()
@@ -0,0 +1,151 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import change_log
+import mobile_sync
+
+DRIVER, OTHER = 4, 5
+
+
+def _job(conn, assigned_to, order_id=1):
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO JobCards (RelatedOrderID, JobType, Description, AssignedTo, Status, Priority) VALUES (?, 'Delivery', 'test', ?, 'Open', 'Medium')",
+                   (order_id, assigned_to))
+    job_id = cursor.lastrowid
+    change_log.record(conn, 'JobCards', job_id, None, change_log.fetch(conn, 'JobCards', job_id))
+    conn.commit()
+    return job_id
+
+
+def _update(conn, table, entity_id, **values):
+    before = change_log.fetch(conn, table, entity_id)
+    conn.execute(f"UPDATE {table} SET {', '.join(f'{column} = ?' for column in values)} WHERE {change_log.TRACKED[table]} = ?",
+                 (*values.values(), entity_id))
+    change_log.record(conn, table, entity_id, before, change_log.fetch(conn, table, entity_id))
+    conn.commit()
+
+
+def _ids(payload, table):
+    block = payload['tables'].get(table)
+    if block is None:
+        return set()
+    key = block['columns'].index(change_log.TRACKED[table])
+    return {row[key] for row in block['rows']}
+
+
+def test_full_pull_holds_own_jobs_orders_and_assignments(conn):
+    payload = mobile_sync.pull(conn, DRIVER)
+    jobs = {row[0] for row in conn.execute('''
+        SELECT JobCardID FROM JobCards WHERE AssignedTo = ?
+        UNION SELECT JobCardID FROM JobAssignments WHERE AssignedEmployeeID = ?
+    ''', (DRIVER, DRIVER))}
+    assert payload['full'] and jobs
+    assert _ids(payload, 'JobCards') == jobs
+    assert _ids(payload, 'Orders') == {row[0] for row in conn.execute(
+        f"SELECT RelatedOrderID FROM JobCards WHERE JobCardID IN ({', '.join('?' for _ in jobs)})", list(jobs))}
+    assert payload['token'] == str(mobile_sync.current_token(conn))
+
+
+def test_incremental_pull_sends_changed_rows_in_scope(conn):
+    token = mobile_sync.pull(conn, DRIVER)['token']
+    job_id = _job(conn, DRIVER, order_id=2)
+    payload = mobile_sync.pull(conn, DRIVER, token)
+    assert _ids(payload, 'JobCards') == {job_id}
+    assert _ids(payload, 'Orders') == {2}
+    assert payload['deleted'] == {}
+    assert mobile_sync.pull(conn, DRIVER, payload['token'])['tables'] == {}
+
+
+def test_changes_out_of_scope_are_not_sent(conn):
+    token = mobile_sync.pull(conn, DRIVER)['token']
+    job_id = _job(conn, OTHER)
+    _update(conn, 'JobCards', job_id, Status='In Progress')
+    conn.execute('DELETE FROM JobCards WHERE JobCardID = ?', (job_id,))
+    change_log.record(conn, 'JobCards', job_id, {'JobCardID': job_id, 'AssignedTo': OTHER, 'RelatedOrderID': 1}, None)
+    conn.commit()
+    payload = mobile_sync.pull(conn, DRIVER, token)
+    assert payload['tables'] == {} and payload['deleted'] == {}
+    assert int(payload['token']) > int(token)
+
+
+def test_reassigned_job_is_deleted_for_its_old_holder_only(conn):
+    job_id = _job(conn, DRIVER, order_id=2)
+    token = mobile_sync.pull(conn, DRIVER)['token']
+    other_token = mobile_sync.pull(conn, OTHER)['token']
+    _update(conn, 'JobCards', job_id, AssignedTo=OTHER)
+
+    payload = mobile_sync.pull(conn, DRIVER, token)
+    assert payload['deleted'] == {'JobCards': [job_id], 'Orders': [2]}
+    other = mobile_sync.pull(conn, OTHER, other_token)
+    assert job_id in _ids(other, 'JobCards') and other['deleted'] == {}
+    assert mobile_sync.pull(conn, 3, token)['deleted'] == {}
+
+
+def test_removed_assignment_deletes_the_job(conn):
+    job_id = _job(conn, OTHER, order_id=2)
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO JobAssignments (JobCardID, AssignedEmployeeID, RoleInJob) VALUES (?, ?, 'Driver')", (job_id, DRIVER))
+    assignment_id = cursor.lastrowid
+    change_log.record(conn, 'JobAssignments', assignment_id, None, change_log.fetch(conn, 'JobAssignments', assignment_id))
+    conn.commit()
+    token = mobile_sync.pull(conn, DRIVER)['token']
+    assert job_id in _ids(mobile_sync.pull(conn, DRIVER), 'JobCards')
+
+    before = change_log.fetch(conn, 'JobAssignments', assignment_id)
+    conn.execute('DELETE FROM JobAssignments WHERE AssignmentID = ?', (assignment_id,))
+    change_log.record(conn, 'JobAssignments', assignment_id, before, None)
+    conn.commit()
+    payload = mobile_sync.pull(conn, DRIVER, token)
+    assert payload['deleted'] == {'JobAssignments': [assignment_id], 'JobCards': [job_id], 'Orders': [2]}
+
+
+def test_pages_follow_the_token(conn):
+    token = mobile_sync.pull(conn, DRIVER)['token']
+    jobs = {_job(conn, DRIVER) for _ in range(5)}
+    seen, pages = set(), 0
+    while True:
+        payload = mobile_sync.pull(conn, DRIVER, token, page_size=2)
+        seen |= _ids(payload, 'JobCards')
+        token, pages = payload['token'], pages + 1
+        if not payload['has_more']:
+            break
+    assert seen == jobs and pages == 3
+
+
+def test_token_stays_behind_unsettled_changes(conn, monkeypatch):
+    token = mobile_sync.pull(conn, DRIVER)['token']
+    job_id = _job(conn, DRIVER)
+
+    sqlite = change_log.dialect(conn)
+    postgres = SimpleNamespace(name='postgresql', table_exists=sqlite.table_exists)
+    monkeypatch.setattr(change_log, 'dialect', lambda conn: postgres)
+    payload = mobile_sync.pull(conn, DRIVER, token)
+    assert job_id in _ids(payload, 'JobCards')
+    assert payload['token'] == token and not payload['has_more']
+
+    monkeypatch.setattr(change_log, 'SETTLE_SECONDS', -60)
+    assert int(mobile_sync.pull(conn, DRIVER, token)['token']) > int(token)
+
+
+def test_progress_replay_is_applied_once(conn):
+    mobile_sync.ensure_schema(conn)
+    job_id = _job(conn, DRIVER)
+    update = {'key': 'device-1:1', 'job_id': job_id, 'status': 'In Progress', 'time': datetime(2026, 1, 5, 9).isoformat()}
+    first = mobile_sync.apply_progress(conn, DRIVER, 1, update)
+    conn.commit()
+    again = mobile_sync.apply_progress(conn, DRIVER, 1, dict(update, status='Completed'))
+    conn.commit()
+    assert first['result'] == 'applied'
+    assert again == {'key': 'device-1:1', 'result': 'duplicate', 'log_id': first['log_id']}
+    assert conn.execute('SELECT COUNT(*) FROM JobProgressLog WHERE JobCardID = ?', (job_id,)).fetchone()[0] == 1
+    assert change_log.fetch(conn, 'JobCards', job_id)['Status'] == 'In Progress'
+
+
+def test_progress_outside_scope_is_rejected(conn):
+    mobile_sync.ensure_schema(conn)
+    job_id = _job(conn, OTHER)
+    result = mobile_sync.apply_progress(conn, DRIVER, 1, {'key': 'device-1:2', 'job_id': job_id, 'status': 'Completed'})
+    conn.commit()
+    assert result == {'key': 'device-1:2', 'result': 'forbidden'}
+    assert change_log.fetch(conn, 'JobCards', job_id)['Status'] == 'Open'
+    assert mobile_sync.apply_progress(conn, DRIVER, 1, {'key': 'device-1:3', 'job_id': 999999, 'status': 'Completed'})['result'] == 'missing'
@@ -0,0 +1,440 @@
+from datetime import date, datetime, timedelta
+import math
+import re
+import time
+
+import numpy as np
+from flask import current_app
+
+from geocoding import coordinates, geocode_later
+from locations import UNASSIGNED_PLANT, plant_resolver, plants as plant_locations
+from storage import dialect
+
+# --- Multi-drop trip planning ---
+# Delivery sites, and plants by the city in their name, are placed through
+# the geocoding cache (geocoding.py); sites not in it yet are left unplanned
+# and geocoded in the background. plan_day() turns a day's orders into
+# truck trips:
+#
+#   1. every order is served by the plant its site resolves to (as for
+#      partitions), else by the nearest plant
+#   2. it is split into full truckloads, each a trip of its own, and a
+#      remainder smaller than a truck
+#   3. remainders are clustered per plant with a k-d tree over the sites:
+#      starting from the site farthest from the plant, the nearest
+#      remainders within cluster_radius_km are added while the load fits
+#      the truck and the trip, sequenced nearest-neighbour then 2-opt,
+#      still finishes its last discharge within setting_minutes of loading
+#   4. trips are handed longest first to whichever in-service mixer can
+#      start them earliest, counting its drive over from another plant and
+#      steering clear of the job cards it is already assigned to that day
+#
+# Times are minutes from the start of loading; travel uses straight-line
+# distance times road_factor at speed_kmh. TRIP_PLANNING overrides any of
+# DEFAULTS.
+
+DEFAULTS = {
+    'setting_minutes': 90,          # loading to end of the last discharge
+    'loading_minutes': 10,
+    'site_setup_minutes': 10,       # per drop, before discharge starts
+    'discharge_m3_per_minute': 0.5,
+    'washout_minutes': 15,          # back at the plant, before the next trip
+    'speed_kmh': 25,
+    'road_factor': 1.3,
+    'cluster_radius_km': 8,
+    'max_drops': 4,
+    'truck_capacity': None,         # m3 per trip; None: the smallest in-service mixer
+    'day_start': '08:00',
+    'day_end': '20:00',
+}
+PLANNED_STATUSES = ('Confirmed', 'In Production')
+FALLBACK_CAPACITY = 7.0
+EARTH_RADIUS_KM = 6371.0
+EPSILON = 1e-9
+
+
+def settings(app=None):
+    app = app or current_app
+    return {**DEFAULTS, **app.config['TRIP_PLANNING']}
+
+
+# --- Spatial index ---
+
+class KDTree:
+    """Static k-d tree over an (n, 2) array of planar points."""
+
+    def __init__(self, points, leaf_size=16):
+        self.points = np.asarray(points, dtype=float).reshape(-1, 2)
+        self.order = np.arange(len(self.points))
+        self.leaf_size = leaf_size
+        self._nodes = []    # [start, end, left child, right child] over self.order
+        self._lo = []
+        self._hi = []
+        if len(self.points):
+            self._build(0, len(self.points))
+
+    def _build(self, start, end):
+        node = len(self._nodes)
+        segment = self.order[start:end]
+        points = self.points[segment]
+        lo, hi = points.min(axis=0), points.max(axis=0)
+        self._nodes.append([start, end, -1, -1])
+        self._lo.append(lo)
+        self._hi.append(hi)
+        if end - start > self.leaf_size:
+            dim = int(np.argmax(hi - lo))
+            self.order[start:end] = segment[np.argsort(points[:, dim], kind='stable')]
+            mid = (start + end) // 2
+            self._nodes[node][2] = self._build(start, mid)
+            self._nodes[node][3] = self._build(mid, end)
+        return node
+
+    def _gap(self, node, point):
+        """Distance from ``point`` to the bounding box of ``node``."""
+        d = np.maximum(self._lo[node] - point, 0) + np.maximum(point - self._hi[node], 0)
+        return math.hypot(d[0], d[1])
+
+    def _leaf(self, node, point):
+        start, end = self._nodes[node][:2]
+        index = self.order[start:end]
+        return index, np.hypot(*(self.points[index] - point).T)
+
+    def query_radius(self, point, radius):
+        """Indexes of the points within ``radius`` of ``point``, nearest first."""
+        point = np.asarray(point, dtype=float)
+        found = []
+        stack = [0] if self._nodes else []
+        while stack:
+            node = stack.pop()
+            if self._gap(node, point) > radius:
+                continue
+            left, right = self._nodes[node][2:]
+            if left < 0:
+                index, distance = self._leaf(node, point)
+                keep = distance <= radius
+                found.extend(zip(distance[keep].tolist(), index[keep].tolist()))
+            else:
+                stack += [left, right]
+        found.sort()
+        return [i for _, i in found]
+
+    def nearest(self, point):
+        """(index, distance) of the point nearest to ``point``; (-1, inf) when empty."""
+        point = np.asarray(point, dtype=float)
+        best, best_distance = -1, math.inf
+        stack = [0] if self._nodes else []
+        while stack:
+            node = stack.pop()
+            if self._gap(node, point) >= best_distance:
+                continue
+            left, right = self._nodes[node][2:]
+            if left < 0:
+                index, distance = self._leaf(node, point)
+                i = int(np.argmin(distance))
+                if distance[i] < best_distance:
+                    best, best_distance = int(index[i]), float(distance[i])
+            else:
+                # Visit the nearer child first; it is popped last-in, first-out.
+                stack += sorted([left, right], key=lambda child: -self._gap(child, point))
+        return best, best_distance
+
+
+def project(points, origin):
+    """Planar km coordinates of (lat, lon) ``points`` around ``origin``."""
+    points = np.radians(np.asarray(points, dtype=float).reshape(-1, 2))
+    lat0, lon0 = math.radians(origin[0]), math.radians(origin[1])
+    return np.column_stack([EARTH_RADIUS_KM * (points[:, 1] - lon0) * math.cos(lat0),
+                            EARTH_RADIUS_KM * (points[:, 0] - lat0)])
+
+
+# --- Trips ---
+
+def _distance(a, b):
+    return math.hypot(a[0] - b[0], a[1] - b[1])
+
+
+def _sequence(start, stops):
+    """``stops`` (planar points) in visiting order from ``start``: nearest neighbour, then 2-opt."""
+    remaining = list(range(len(stops)))
+    route, position = [], start
+    while remaining:
+        nearest = min(remaining, key=lambda i: _distance(position, stops[i]))
+        remaining.remove(nearest)
+        route.append(nearest)
+        position = stops[nearest]
+    points = [start] + [stops[i] for i in route]
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, len(points) - 1):
+            for j in range(i + 1, len(points)):
+                after = _distance(points[i], points[j + 1]) if j + 1 < len(points) else 0.0
+                before = _distance(points[j], points[j + 1]) if j + 1 < len(points) else 0.0
+                if _distance(points[i - 1], points[j]) + after < _distance(points[i - 1], points[i]) + before - EPSILON:
+                    points[i:j + 1] = points[i:j + 1][::-1]
+                    route[i - 1:j] = route[i - 1:j][::-1]
+                    improved = True
+    return route
+
+
+class _Timing:
+    def __init__(self, config):
+        self.config = config
+        self.minutes_per_km = config['road_factor'] * 60 / config['speed_kmh']
+
+    def drive(self, km):
+        return km * self.minutes_per_km
+
+    def trip(self, plant, drops):
+        """([(arrive, finish)] per drop, minutes until the truck is ready again) for ``drops`` in order."""
+        config = self.config
+        t, position, times = config['loading_minutes'], plant, []
+        for drop in drops:
+            t += self.drive(_distance(position, drop['xy']))
+            arrive = t
+            t += config['site_setup_minutes'] + drop['quantity'] / config['discharge_m3_per_minute']
+            times.append((arrive, t))
+            position = drop['xy']
+        return times, t + self.drive(_distance(position, plant)) + config['washout_minutes']
+
+    def feasible(self, times):
+        return times[-1][1] <= self.config['setting_minutes'] + EPSILON
+
+
+def fleet(conn):
+    """In-service mixer trucks with a capacity in m3, largest first."""
+    trucks = []
+    for row in conn.execute(f"""
+        SELECT VehicleID, VehicleName, Capacity FROM Vehicles
+        WHERE Type {dialect(conn).like} '%Mixer%' AND COALESCE(Status, '') <> 'Under Maintenance'
+        ORDER BY VehicleID
+    """):
+        match = re.search(r'\d+(?:\.\d+)?', row['Capacity'] or '')
+        if match:
+            trucks.append({'VehicleID': row['VehicleID'], 'VehicleName': row['VehicleName'], 'capacity': float(match.group())})
+    return sorted(trucks, key=lambda truck: -truck['capacity'])
+
+
+def _clock(day, minutes):
+    return (datetime.combine(day, datetime.min.time()) + timedelta(minutes=minutes)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _minutes(hhmm):
+    hours, minutes = hhmm.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def committed(conn, day, config, exclude_orders=()):
+    """{VehicleID: [(start, end)]} minutes of ``day`` the trucks are held by job cards.
+
+    A job card's window runs from the first arrival to the last end of
+    discharge; it is widened by the setting time before and by the setting
+    and washout time after, which covers loading and the drives both ways.
+    Job cards of ``exclude_orders`` (the orders being planned) are skipped.
+    """
+    midnight = datetime.combine(day, datetime.min.time())
+    before = config['setting_minutes']
+    after = config['setting_minutes'] + config['washout_minutes']
+    busy = {}
+    for row in conn.execute("""
+        SELECT jc.RelatedOrderID, jc.ScheduledStart, jc.ScheduledEnd, ja.AssignedVehicleID
+        FROM JobCards jc JOIN JobAssignments ja ON ja.JobCardID = jc.JobCardID
+        WHERE ja.AssignedVehicleID IS NOT NULL AND COALESCE(jc.Status, '') <> 'Cancelled'
+          AND jc.ScheduledStart < ? AND jc.ScheduledEnd >= ?
+    """, ((day + timedelta(days=1)).isoformat(), (day - timedelta(days=1)).isoformat())):
+        if row['RelatedOrderID'] in exclude_orders:
+            continue
+        try:
+            start, end = (datetime.fromisoformat(str(value)[:19]) for value in (row['ScheduledStart'], row['ScheduledEnd']))
+        except ValueError:
+            continue
+        busy.setdefault(row['AssignedVehicleID'], []).append(
+            ((start - midnight).total_seconds() / 60 - before, (end - midnight).total_seconds() / 60 + after))
+    return {vehicle_id: sorted(windows) for vehicle_id, windows in busy.items()}
+
+
+def _fit(ready, cycle, windows):
+    """Earliest start from ``ready`` for a ``cycle``-minute trip clear of the sorted busy ``windows``."""
+    for start, end in windows:
+        if ready < end and ready + cycle > start:
+            ready = end
+    return ready
+
+
+def plan_day(conn, day, order_ids=None, config=None, geocode=None):
+    """Trips delivering the orders scheduled on ``day`` (or just ``order_ids``).
+
+    Returns {'date', 'capacity', 'trips': [...], 'unplanned': [...], ...};
+    each trip lists its drops in delivery order with arrival and
+    end-of-discharge times. Coordinates come from GeoCache only; sites
+    missing from it are unplanned and queued for background geocoding.
+    With a ``geocode`` geocoder they are geocoded inline instead (commits).
+    """
+    started = time.perf_counter()
+    config = config or settings()
+    day = day if isinstance(day, date) else date.fromisoformat(str(day)[:10])
+    timing = _Timing(config)
+
+    if order_ids is None:
+        orders = conn.execute(f'''
+            SELECT OrderID, DeliverySite, Quantity FROM Orders
+            WHERE ScheduledDate = ? AND Status IN ({', '.join('?' for _ in PLANNED_STATUSES)})
+            ORDER BY OrderID
+        ''', (day.isoformat(), *PLANNED_STATUSES)).fetchall()
+    else:
+        orders = []
+        order_ids = list(order_ids)
+        for i in range(0, len(order_ids), 500):
+            batch = order_ids[i:i + 500]
+            orders += conn.execute(f"SELECT OrderID, DeliverySite, Quantity FROM Orders WHERE OrderID IN ({', '.join('?' for _ in batch)})", batch).fetchall()
+
+    trucks = fleet(conn)
+    capacity = float(config['truck_capacity'] or (min(truck['capacity'] for truck in trucks) if trucks else FALLBACK_CAPACITY))
+    plants = plant_locations(conn)
+    resolve = plant_resolver(conn)
+    places = [order['DeliverySite'] for order in orders] + [city for _, city in plants.values()]
+    points = coordinates(conn, places, geocode, cached_only=geocode is None)
+    missing = {place for place in places if place and place.strip() and place not in points}
+    if missing:
+        geocode_later(current_app._get_current_object(), missing)
+    plant_points = {plant_id: points.get(city) for plant_id, (_, city) in plants.items()}
+    plant_points = {plant_id: point for plant_id, point in plant_points.items() if point is not None}
+
+    unplanned = []
+
+    def skip(order, reason):
+        unplanned.append({'order_id': order['OrderID'], 'site': order['DeliverySite'], 'quantity': order['Quantity'], 'reason': reason})
+
+    located = [(order, points.get(order['DeliverySite'])) for order in orders]
+    for order, point in located:
+        if order['DeliverySite'] in missing:
+            skip(order, 'delivery site not geocoded yet')
+        elif point is None:
+            skip(order, 'delivery site could not be geocoded')
+    located = [(order, point) for order, point in located if point is not None]
+    plan = {'date': day.isoformat(), 'capacity': capacity, 'trips': [], 'unplanned': unplanned, 'orders': len(orders)}
+    if not located or not plant_points:
+        for order, _ in located:
+            skip(order, 'no plant with known coordinates')
+        return _finish(plan, started)
+
+    # One planar frame for the day; plants are looked up by nearest site.
+    origin = np.mean([point for _, point in located], axis=0)
+    plant_ids = sorted(plant_points)
+    plant_xy = dict(zip(plant_ids, project([plant_points[p] for p in plant_ids], origin).tolist()))
+    plant_tree = KDTree([plant_xy[p] for p in plant_ids])
+    site_xy = project([point for _, point in located], origin).tolist()
+
+    # Full loads go direct; remainders are collected per plant for sharing.
+    trips, remainders = [], {}
+    for (order, _), xy in zip(located, site_xy):
+        plant_id = resolve(order['DeliverySite'])
+        if plant_id == UNASSIGNED_PLANT or plant_id not in plant_xy:
+            plant_id = plant_ids[plant_tree.nearest(xy)[0]]
+        quantity = float(order['Quantity'] or 0)
+        if quantity <= 0:
+            skip(order, 'no quantity to deliver')
+            continue
+        full_loads = int((quantity + EPSILON) // capacity)
+        rest = quantity - full_loads * capacity
+        drop = {'order_id': order['OrderID'], 'site': order['DeliverySite'], 'xy': xy, 'quantity': capacity if full_loads else rest}
+        times, _ = timing.trip(plant_xy[plant_id], [drop])
+        if not timing.feasible(times):
+            skip(order, f"more than {config['setting_minutes']} minutes from the plant")
+            continue
+        trips += [(plant_id, [dict(drop, quantity=capacity)]) for _ in range(full_loads)]
+        if rest > EPSILON:
+            remainders.setdefault(plant_id, []).append(dict(drop, quantity=round(rest, 3)))
+
+    for plant_id, drops in remainders.items():
+        trips += _cluster(plant_xy[plant_id], plant_id, drops, capacity, config, timing)
+
+    busy = committed(conn, day, config, {order['OrderID'] for order in orders})
+    _schedule(plan, day, trips, trucks, busy, plant_xy, plants, timing, config)
+    return _finish(plan, started)
+
+
+def _cluster(plant, plant_id, drops, capacity, config, timing):
+    """Group a plant's part loads into multi-drop trips, farthest site first."""
+    tree = KDTree([drop['xy'] for drop in drops])
+    assigned = [False] * len(drops)
+    trips = []
+    for seed in sorted(range(len(drops)), key=lambda i: -_distance(plant, drops[i]['xy'])):
+        if assigned[seed]:
+            continue
+        assigned[seed] = True
+        members, load = [seed], drops[seed]['quantity']
+        for candidate in tree.query_radius(drops[seed]['xy'], config['cluster_radius_km']):
+            if len(members) >= config['max_drops']:
+                break
+            if assigned[candidate] or load + drops[candidate]['quantity'] > capacity + EPSILON:
+                continue
+            trial = members + [candidate]
+            route = [trial[i] for i in _sequence(plant, [drops[i]['xy'] for i in trial])]
+            times, _ = timing.trip(plant, [drops[i] for i in route])
+            if timing.feasible(times):
+                members, load = route, load + drops[candidate]['quantity']
+                assigned[candidate] = True
+        trips.append((plant_id, [drops[i] for i in members]))
+    return trips
+
+
+def _schedule(plan, day, trips, trucks, busy, plant_xy, plants, timing, config):
+    """Give each trip, longest first, to the truck that can start it earliest outside its ``busy`` windows."""
+    day_start, day_end = _minutes(config['day_start']), _minutes(config['day_end'])
+    state = [{'truck': truck, 'free': day_start, 'at': None} for truck in trucks]
+    timed = []
+    for plant_id, drops in trips:
+        times, cycle = timing.trip(plant_xy[plant_id], drops)
+        timed.append((cycle, plant_id, drops, times))
+    timed.sort(key=lambda trip: -trip[0])
+    for cycle, plant_id, drops, times in timed:
+        load = sum(drop['quantity'] for drop in drops)
+        best, start = None, day_start
+        for truck in state:
+            if truck['truck']['capacity'] + EPSILON < load:
+                continue
+            ready = truck['free']
+            if truck['at'] is not None and truck['at'] != plant_id:
+                ready += timing.drive(_distance(plant_xy[truck['at']], plant_xy[plant_id]))
+            ready = _fit(max(ready, day_start), cycle, busy.get(truck['truck']['VehicleID'], ()))
+            if best is None or ready < start:
+                best, start = truck, ready
+        if best is not None:
+            best['free'], best['at'] = start + cycle, plant_id
+        km = sum(_distance(a, b) for a, b in zip([plant_xy[plant_id]] + [d['xy'] for d in drops], [d['xy'] for d in drops] + [plant_xy[plant_id]]))
+        plan['trips'].append({
+            'plant_id': plant_id, 'plant': plants[plant_id][0],
+            'vehicle_id': best['truck']['VehicleID'] if best else None,
+            'vehicle': best['truck']['VehicleName'] if best else None,
+            'load': round(load, 3), 'km': round(km * config['road_factor'], 1),
+            'depart': _clock(day, start + config['loading_minutes']), 'back': _clock(day, start + cycle),
+            'late': start + cycle > day_end,
+            'drops': [{'order_id': drop['order_id'], 'site': drop['site'], 'quantity': drop['quantity'],
+                       'arrive': _clock(day, start + arrive), 'finish': _clock(day, start + finish)}
+                      for drop, (arrive, finish) in zip(drops, times)],
+        })
+    plan['trips'].sort(key=lambda trip: (trip['depart'], trip['vehicle'] or ''))
+    for number, trip in enumerate(plan['trips'], 1):
+        trip['trip'] = number
+
+
+def _finish(plan, started):
+    plan['deliveries'] = sum(len(trip['drops']) for trip in plan['trips'])
+    plan['multi_drop_trips'] = sum(1 for trip in plan['trips'] if len(trip['drops']) > 1)
+    plan['trucks_used'] = len({trip['vehicle_id'] for trip in plan['trips'] if trip['vehicle_id'] is not None})
+    plan['km'] = round(sum(trip['km'] for trip in plan['trips']), 1)
+    plan['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return plan
+
+
+def order_windows(plan):
+    """{OrderID: (first arrival, last end of discharge, [VehicleID], trips)} of a plan."""
+    windows = {}
+    for trip in plan['trips']:
+        for drop in trip['drops']:
+            start, end, vehicles, count = windows.get(drop['order_id'], (drop['arrive'], drop['finish'], [], 0))
+            if trip['vehicle_id'] is not None and trip['vehicle_id'] not in vehicles:
+                vehicles.append(trip['vehicle_id'])
+            windows[drop['order_id']] = (min(start, drop['arrive']), max(end, drop['finish']), vehicles, count + 1)
+    return windows